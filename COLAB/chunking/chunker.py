@@ -1,8 +1,14 @@
 import hashlib
+import threading
+import multiprocessing
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Tuple
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from config.settings import settings
 from parsers.tree_sitter_parser import ts_parser
+from chunking.sizer import ChunkSizer, ChunkPiece
 from utils.logger import logger
 
 class Chunk:
@@ -44,10 +50,17 @@ class Chunk:
         }
         
     @staticmethod
-    def generate_id(project_id: str, path: str, start_line: int) -> str:
-        """Generate unique chunk ID"""
+    def generate_id(project_id: str, path: str, start_line: int, part: str = None) -> str:
+        """Generate unique chunk ID (part distinguishes pieces of one node)"""
         content = f"{project_id}:{path}:{start_line}"
+        if part:
+            content += f":{part}"
         return hashlib.sha256(content.encode()).hexdigest()[:16]
+        
+    @staticmethod
+    def to_int_id(chunk_id: str) -> int:
+        """Convert chunk ID to a non-negative 64-bit integer for FAISS"""
+        return int(chunk_id, 16) & 0x7FFFFFFFFFFFFFFF
 
 class CodeChunker:
     """Main chunking orchestrator"""
@@ -77,6 +90,7 @@ class CodeChunker:
         self.project_id = project_id
         self.project_root = project_root
         self.chunks: List[Chunk] = []
+        self.sizer = ChunkSizer() if settings.CHUNK_SIZING_ENABLED else None
         
     def chunk_project(self, filters: Optional[Dict[str, Any]] = None) -> List[Chunk]:
         """
@@ -91,19 +105,105 @@ class CodeChunker:
         logger.info(f"Starting project chunking: {self.project_id}")
         
         # Find all source files
-        source_files = self._find_source_files(filters)
+        source_files = self.find_source_files(filters)
         
         logger.info(f"Found {len(source_files)} source files to chunk")
         
         # Chunk each file
-        for file_path in source_files:
-            self._chunk_file(file_path)
+        self.chunk_files(source_files)
             
         logger.info(f"Created {len(self.chunks)} chunks")
         
         return self.chunks
         
-    def _find_source_files(self, filters: Optional[Dict[str, Any]] = None) -> List[Path]:
+    def chunk_files(self, file_paths: List[Path], workers: int = None) -> List[Chunk]:
+        """
+        Chunk a specific set of files
+        
+        Args:
+            file_paths: Absolute paths of files to chunk
+            workers: Worker processes (default from settings)
+            
+        Returns:
+            List of chunks created for these files
+        """
+        start = len(self.chunks)
+        
+        for file_chunks in self.iter_file_chunks(file_paths, workers):
+            self.chunks.extend(file_chunks)
+            
+        return self.chunks[start:]
+        
+    def iter_chunks(self, file_paths: List[Path], workers: int = None) -> Iterator[Chunk]:
+        """
+        Stream chunks for a set of files without keeping them
+        
+        Unlike chunk_files(), nothing is accumulated on the chunker, so
+        memory stays bounded by whatever the consumer holds on to.
+        
+        Args:
+            file_paths: Absolute paths of files to chunk
+            workers: Worker processes (default from settings)
+        """
+        for file_chunks in self.iter_file_chunks(file_paths, workers):
+            yield from file_chunks
+            
+    def iter_file_chunks(
+        self,
+        file_paths: List[Path],
+        workers: int = None
+    ) -> Iterator[List[Chunk]]:
+        """
+        Chunk files, yielding each file's chunks in input order
+        
+        Parsing is CPU-bound, so large file sets are fanned out across a
+        process pool with one tree-sitter parser set per worker. The pool
+        is shared by all indexing jobs (see get_chunking_pool), so jobs
+        running side by side do not each start a process per core.
+        
+        Args:
+            file_paths: Absolute paths of files to chunk
+            workers: Worker processes (default from settings); with the
+                shared pool this bounds how many groups this call keeps
+                in flight
+        """
+        workers = workers or settings.CHUNKING_WORKERS
+        
+        if workers <= 1 or len(file_paths) < settings.CHUNKING_PARALLEL_MIN_FILES:
+            for file_path in file_paths:
+                yield self._chunk_file(file_path)
+            return
+            
+        logger.info(
+            f"Chunking {len(file_paths)} files in parallel",
+            meta={"workers": workers}
+        )
+        
+        # Submit files in groups and keep only a few groups in flight, so
+        # a slow consumer never lets finished results pile up in memory
+        group_size = max(1, min(64, len(file_paths) // (workers * 4)))
+        groups = [
+            (self.project_id, self.project_root, file_paths[i:i + group_size])
+            for i in range(0, len(file_paths), group_size)
+        ]
+        max_in_flight = workers * 2
+        
+        executor = get_chunking_pool()
+        pending = deque()
+        try:
+            for group in groups:
+                pending.append(executor.submit(_chunk_files_task, group))
+                if len(pending) >= max_in_flight:
+                    yield from pending.popleft().result()
+                    
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            # Do not leave groups of an abandoned stream queued on the shared pool
+            for future in pending:
+                future.cancel()
+            
+    def find_source_files(self, filters: Optional[Dict[str, Any]] = None) -> List[Path]:
         """Find all relevant source files"""
         source_files = []
         
@@ -139,37 +239,52 @@ class CodeChunker:
             
         return source_files
         
-    def _chunk_file(self, file_path: Path):
+    def _chunk_file(self, file_path: Path) -> List[Chunk]:
         """Chunk a single file"""
+        chunks = []
+        
         try:
             # Detect language
             language = ts_parser.detect_language(file_path)
             if not language:
-                return
+                return chunks
                 
-            # Parse file
-            tree = ts_parser.parse_file(file_path, language)
+            # Read source once and parse it (reusing any cached tree)
+            tree, source_bytes = ts_parser.parse_path(file_path, language)
             if not tree:
-                return
-                
-            # Read source
-            with open(file_path, 'rb') as f:
-                source_bytes = f.read()
+                return chunks
                 
             # Get relevant node types
             node_types = self._get_node_types(language)
             
             # Extract nodes
-            nodes = ts_parser.extract_nodes(tree, node_types)
+            nodes = ts_parser.extract_nodes(tree, node_types, language)
             
-            # Create chunks from nodes
-            for node in nodes:
-                self._create_chunk_from_node(
+            # Split, merge and de-duplicate nodes into size-bounded pieces
+            if self.sizer:
+                pieces = self.sizer.size_nodes(nodes, source_bytes)
+            else:
+                pieces = [
+                    ChunkPiece(
+                        node=node,
+                        node_type=node.type,
+                        start_line=node.start_point[0],
+                        end_line=node.end_point[0],
+                        text=ts_parser.get_node_text(node, source_bytes)
+                    )
+                    for node in nodes
+                ]
+                
+            # Create chunks from pieces
+            for piece in pieces:
+                chunk = self._create_chunk(
                     file_path,
-                    node,
+                    piece,
                     source_bytes,
                     language
                 )
+                if chunk:
+                    chunks.append(chunk)
                 
         except Exception as e:
             logger.warning(
@@ -177,6 +292,8 @@ class CodeChunker:
                 meta={"error": str(e)}
             )
             
+        return chunks
+        
     def _get_node_types(self, language: str) -> List[str]:
         """Get node types for language"""
         if language == 'java':
@@ -187,37 +304,36 @@ class CodeChunker:
             return self.XML_NODES
         return []
         
-    def _create_chunk_from_node(
+    def _create_chunk(
         self,
         file_path: Path,
-        node: Any,
+        piece: ChunkPiece,
         source_bytes: bytes,
         language: str
-    ):
-        """Create chunk from AST node"""
+    ) -> Optional[Chunk]:
+        """Create chunk from a sized piece of an AST node"""
         try:
             # Get relative path
             rel_path = file_path.relative_to(self.project_root)
             
-            # Extract text
-            text = ts_parser.get_node_text(node, source_bytes)
-            
             # Generate chunk ID
             chunk_id = Chunk.generate_id(
                 self.project_id,
                 str(rel_path),
-                node.start_point[0]
+                piece.start_line,
+                piece.part
             )
             
             # Extract metadata
             metadata = {
                 "language": language,
-                "nodeType": node.type,
+                "nodeType": piece.node_type,
             }
+            metadata.update(piece.metadata)
             
             # Try to get function signature
-            if node.type in ['method_declaration', 'function_declaration']:
-                signature = ts_parser.get_function_signature(node, source_bytes)
+            if piece.node_type in ['method_declaration', 'function_declaration']:
+                signature = ts_parser.get_function_signature(piece.node, source_bytes)
                 if signature:
                     metadata["signature"] = signature
             
@@ -226,17 +342,18 @@ class CodeChunker:
                 chunk_id=chunk_id,
                 project_id=self.project_id,
                 path=str(rel_path),
-                node_type=node.type,
-                start_line=node.start_point[0],
-                end_line=node.end_point[0],
-                tokens=text,
+                node_type=piece.node_type,
+                start_line=piece.start_line,
+                end_line=piece.end_line,
+                tokens=piece.text,
                 metadata=metadata
             )
             
-            self.chunks.append(chunk)
+            return chunk
             
         except Exception as e:
             logger.debug(f"Failed to create chunk: {str(e)}")
+            return None
             
     def get_chunks(self) -> List[Chunk]:
         """Get all chunks"""
@@ -248,4 +365,41 @@ class CodeChunker:
         
     def clear_chunks(self):
         """Clear all chunks"""
-        self.chunks.clear()
\ No newline at end of file
+        self.chunks.clear()
+
+def _chunk_files_task(task: Tuple[str, Path, List[Path]]) -> List[List[Chunk]]:
+    """Process pool entry point: chunk a group of files in a worker"""
+    project_id, project_root, file_paths = task
+    chunker = CodeChunker(project_id, project_root)
+    return [chunker._chunk_file(file_path) for file_path in file_paths]
+
+# Process pool shared by all indexing jobs (lazy started)
+_chunking_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def get_chunking_pool() -> ProcessPoolExecutor:
+    """
+    Get or start the chunking process pool (CHUNKING_WORKERS processes)
+    
+    Workers come from a forkserver (spawn where that is unavailable),
+    never a plain fork: the agent runs job, prefetch and warm-up threads,
+    and a child forked while one of them holds a lock (e.g. the parse
+    tree cache) would deadlock on it. A pool broken by a crashed worker
+    is replaced.
+    """
+    global _chunking_pool
+    
+    with _pool_lock:
+        if _chunking_pool is None or getattr(_chunking_pool, "_broken", False):
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            if context.get_start_method() == "forkserver":
+                # Import the parsers once in the server, not in every worker
+                context.set_forkserver_preload([__name__])
+                
+            _chunking_pool = ProcessPoolExecutor(
+                max_workers=max(1, settings.CHUNKING_WORKERS),
+                mp_context=context
+            )
+            
+        return _chunking_pool
@@ -0,0 +1,326 @@
+import re
+from typing import List, Dict, Any, Optional, Set, Tuple
+from config.settings import settings
+
+# Rough token count for code: identifiers, numbers and punctuation
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def count_tokens(text: str) -> int:
+    """Estimate the number of model tokens in a piece of code"""
+    return len(TOKEN_PATTERN.findall(text))
+
+class ChunkPiece:
+    """A size-bounded span of source produced by the sizer"""
+    
+    def __init__(
+        self,
+        node: Any,
+        node_type: str,
+        start_line: int,
+        end_line: int,
+        text: str,
+        part: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ):
+        self.node = node
+        self.node_type = node_type
+        self.start_line = start_line
+        self.end_line = end_line
+        self.text = text
+        self.part = part
+        self.metadata = metadata or {}
+
+class ChunkSizer:
+    """
+    Turn extracted AST nodes into size-bounded chunks
+    
+    Extracted nodes nest (a class and its methods are both extracted), so
+    each parent is reduced to a skeleton with its children's bodies
+    elided. Pieces over the token budget are split into overlapping line
+    windows, preferring to cut where a statement ends. Runs of tiny
+    adjacent siblings, such as fields and one-line properties, are merged
+    into one chunk.
+    """
+    
+    ELISION = "..."
+    
+    def __init__(
+        self,
+        max_tokens: int = None,
+        min_tokens: int = None,
+        overlap_lines: int = None
+    ):
+        self.max_tokens = max_tokens or settings.CHUNK_MAX_TOKENS
+        self.min_tokens = min_tokens if min_tokens is not None else settings.CHUNK_MIN_TOKENS
+        self.overlap_lines = overlap_lines if overlap_lines is not None else settings.CHUNK_OVERLAP_LINES
+        
+    def size_nodes(self, nodes: List[Any], source_bytes: bytes) -> List[ChunkPiece]:
+        """
+        Size a file's extracted nodes
+        
+        Args:
+            nodes: Extracted nodes, possibly nested
+            source_bytes: Source file bytes
+            
+        Returns:
+            Chunk pieces in source order
+        """
+        lines = source_bytes.decode('utf-8', errors='replace').split("\n")
+        roots, children = self._build_forest(nodes)
+        
+        pieces: List[ChunkPiece] = []
+        self._size_siblings(roots, children, lines, source_bytes, pieces)
+        
+        pieces.sort(key=lambda piece: (piece.start_line, piece.end_line))
+        return pieces
+        
+    def _build_forest(self, nodes: List[Any]) -> Tuple[List[Any], Dict[int, List[Any]]]:
+        """Nest extracted nodes by byte range"""
+        ordered = sorted(nodes, key=lambda n: (n.start_byte, -n.end_byte))
+        roots: List[Any] = []
+        children: Dict[int, List[Any]] = {}
+        stack: List[Any] = []
+        
+        for node in ordered:
+            while stack and node.start_byte >= stack[-1].end_byte:
+                stack.pop()
+                
+            if stack:
+                children.setdefault(id(stack[-1]), []).append(node)
+            else:
+                roots.append(node)
+            stack.append(node)
+            
+        return roots, children
+        
+    def _size_siblings(
+        self,
+        siblings: List[Any],
+        children: Dict[int, List[Any]],
+        lines: List[str],
+        source_bytes: bytes,
+        pieces: List[ChunkPiece]
+    ):
+        """Size a run of sibling nodes, merging tiny neighbours"""
+        run: List[Any] = []
+        run_tokens = 0
+        
+        for node in siblings:
+            text = self._node_text(node, source_bytes)
+            tokens = count_tokens(text)
+            
+            tiny = tokens < self.min_tokens and id(node) not in children
+            if tiny and run:
+                # Whatever sits between siblings ends up in the merged text too
+                gap = source_bytes[run[-1].end_byte:node.start_byte].decode('utf-8', errors='replace')
+                merged_tokens = run_tokens + count_tokens(gap) + tokens
+                if merged_tokens <= self.max_tokens:
+                    run.append(node)
+                    run_tokens = merged_tokens
+                    continue
+                    
+            self._flush_run(run, source_bytes, pieces)
+            run, run_tokens = ([node], tokens) if tiny else ([], 0)
+            
+            if not tiny:
+                self._size_node(node, text, tokens, children, lines, source_bytes, pieces)
+                
+        self._flush_run(run, source_bytes, pieces)
+        
+    def _flush_run(self, run: List[Any], source_bytes: bytes, pieces: List[ChunkPiece]):
+        """Emit a run of tiny siblings as a single piece"""
+        if not run:
+            return
+            
+        first, last = run[0], run[-1]
+        text = self._node_text(first, source_bytes, end_byte=last.end_byte)
+        
+        metadata = {}
+        if len(run) > 1:
+            metadata["mergedNodes"] = len(run)
+            
+        pieces.append(ChunkPiece(
+            node=first,
+            node_type=first.type,
+            start_line=first.start_point[0],
+            end_line=last.end_point[0],
+            text=text,
+            metadata=metadata
+        ))
+        
+    def _size_node(
+        self,
+        node: Any,
+        text: str,
+        tokens: int,
+        children: Dict[int, List[Any]],
+        lines: List[str],
+        source_bytes: bytes,
+        pieces: List[ChunkPiece]
+    ):
+        """Size one node and, recursively, its extracted children"""
+        node_children = children.get(id(node), [])
+        
+        if not node_children:
+            if tokens <= self.max_tokens:
+                pieces.append(ChunkPiece(
+                    node=node,
+                    node_type=node.type,
+                    start_line=node.start_point[0],
+                    end_line=node.end_point[0],
+                    text=text
+                ))
+            else:
+                entries = [
+                    (row, lines[row])
+                    for row in range(node.start_point[0], node.end_point[0] + 1)
+                ]
+                self._emit_windows(node, entries, pieces, skeleton=False)
+                
+        else:
+            # The parent keeps only what its children do not cover
+            entries = self._skeleton(node, node_children, lines)
+            skeleton_tokens = sum(count_tokens(line) for _, line in entries)
+            
+            if skeleton_tokens <= self.max_tokens:
+                pieces.append(ChunkPiece(
+                    node=node,
+                    node_type=node.type,
+                    start_line=node.start_point[0],
+                    end_line=node.end_point[0],
+                    text="\n".join(line for _, line in entries),
+                    part="skeleton",
+                    metadata={"skeleton": True}
+                ))
+            else:
+                self._emit_windows(node, entries, pieces, skeleton=True)
+                
+            self._size_siblings(node_children, children, lines, source_bytes, pieces)
+            
+    def _skeleton(
+        self,
+        node: Any,
+        node_children: List[Any],
+        lines: List[str]
+    ) -> List[Tuple[int, str]]:
+        """
+        Get (row, text) lines of a node with its children elided
+        
+        A multi-line child keeps its header (annotations and signature)
+        followed by an elision marker; a single-line child is dropped. Rows shared with the
+        parent's own first or last line are always kept.
+        """
+        first_row, last_row = node.start_point[0], node.end_point[0]
+        dropped: Set[int] = set()
+        markers: Dict[int, str] = {}
+        
+        for child in node_children:
+            start, end = child.start_point[0], child.end_point[0]
+            
+            if start == end:
+                dropped.add(start)
+                continue
+                
+            # Keep annotations and the signature, up to where the body opens
+            body = child.child_by_field_name("body")
+            header_end = body.start_point[0] if body is not None else start
+            header_end = min(max(header_end, start), end - 1)
+            
+            dropped.update(range(header_end + 1, end + 1))
+            header = lines[start]
+            indent = header[:len(header) - len(header.lstrip())]
+            markers[header_end] = f"{indent}    {self.ELISION}"
+            
+        dropped.discard(first_row)
+        dropped.discard(last_row)
+        
+        entries = []
+        for row in range(first_row, last_row + 1):
+            if row in dropped:
+                continue
+            entries.append((row, lines[row]))
+            if row in markers:
+                entries.append((row, markers[row]))
+                
+        return entries
+        
+    def _emit_windows(
+        self,
+        node: Any,
+        entries: List[Tuple[int, str]],
+        pieces: List[ChunkPiece],
+        skeleton: bool
+    ):
+        """Split lines into overlapping windows under the token budget"""
+        boundaries = self._statement_ends(node)
+        counts = [count_tokens(line) for _, line in entries]
+        windows: List[Tuple[int, int]] = []
+        
+        start = 0
+        while start < len(entries):
+            end = start
+            total = 0
+            last_break = None
+            
+            while end < len(entries):
+                if end > start and total + counts[end] > self.max_tokens:
+                    break
+                total += counts[end]
+                if entries[end][0] in boundaries:
+                    last_break = end
+                end += 1
+                
+            # Cut after the last statement if it keeps at least half the window
+            cut = end
+            if end < len(entries) and last_break is not None and last_break + 1 > start + (end - start) // 2:
+                cut = last_break + 1
+                
+            windows.append((start, cut))
+            if cut >= len(entries):
+                break
+            start = max(start + 1, cut - self.overlap_lines)
+            
+        prefix = "skeleton-" if skeleton else ""
+        for i, (start, cut) in enumerate(windows):
+            window = entries[start:cut]
+            metadata = {"part": i + 1, "parts": len(windows)}
+            if skeleton:
+                metadata["skeleton"] = True
+                
+            pieces.append(ChunkPiece(
+                node=node,
+                node_type=node.type,
+                start_line=window[0][0],
+                end_line=window[-1][0],
+                text="\n".join(line for _, line in window),
+                part=f"{prefix}{i + 1}",
+                metadata=metadata
+            ))
+            
+    @staticmethod
+    def _statement_ends(node: Any) -> Set[int]:
+        """Get rows where a statement or member inside the node ends"""
+        rows: Set[int] = set()
+        stack = [node]
+        
+        while stack:
+            current = stack.pop()
+            is_block = (
+                current.type.endswith("body")
+                or "block" in current.type
+                or current.type == "statements"
+            )
+            
+            for child in current.children:
+                if is_block and child.is_named:
+                    rows.add(child.end_point[0])
+                if child.child_count:
+                    stack.append(child)
+                    
+        return rows
+        
+    @staticmethod
+    def _node_text(node: Any, source_bytes: bytes, end_byte: int = None) -> str:
+        """Get the source text of a node, optionally extended to end_byte"""
+        end = end_byte if end_byte is not None else node.end_byte
+        return source_bytes[node.start_byte:end].decode('utf-8', errors='replace')
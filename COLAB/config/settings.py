@@ -1,7 +1,7 @@
 import os
 from pathlib import Path
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Dict
 
 class Settings(BaseModel):
     """Central configuration for MrX Colab Agent"""
@@ -17,22 +17,70 @@ class Settings(BaseModel):
     FAISS_DIR: Path = Path("/content/faiss")
     BUILD_DIR: Path = Path("/content/build")
     LOGS_DIR: Path = Path("/content/logs")
+    CHECKPOINT_DIR: Path = Path("/content/checkpoints")
     
     # Embedding Model Configuration
     DEFAULT_EMBEDDING_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
     EMBEDDING_BATCH_SIZE: int = 32
     EMBEDDING_MAX_LENGTH: int = 512
+    EMBEDDING_TOKEN_BATCHING: bool = True  # Truncate by tokens and batch by length
+    EMBEDDING_BACKEND: str = "auto"  # "torch", "onnx", "onnx-int8" or "auto" (int8 ONNX without a GPU)
+    EMBEDDING_ONNX_THREADS: int = 0  # ONNX Runtime intra-op threads, 0 = all cores
+    EMBEDDING_ONNX_MIN_COSINE: float = 0.98  # Keep torch if ONNX output drifts further than this
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 100000  # ~150MB for 384-dim models
+    EMBEDDING_CACHE_FLUSH_INTERVAL: int = 30  # Seconds between cache flushes while indexing
+    QUERY_CACHE_MAX_ENTRIES: int = 1024  # Query embeddings kept in memory
+    
+    # Chunking Configuration
+    CHUNKING_WORKERS: int = os.cpu_count() or 1
+    CHUNKING_PARALLEL_MIN_FILES: int = 32  # Below this, chunk in-process
+    TREE_CACHE_MAX_FILES: int = 2000  # Parsed trees kept for incremental re-parse
+    CHUNK_SIZING_ENABLED: bool = True
+    CHUNK_MAX_TOKENS: int = 384  # Split nodes larger than this into windows
+    CHUNK_MIN_TOKENS: int = 24  # Merge adjacent siblings smaller than this
+    CHUNK_OVERLAP_LINES: int = 3  # Lines shared between consecutive windows
+    INDEXING_BATCH_SIZE: int = 512  # Chunks embedded and indexed per pipeline step
+    INDEXING_QUEUE_BATCHES: int = 4  # Chunk batches buffered ahead of the embedder
     
     # FAISS Configuration
-    FAISS_INDEX_TYPE: str = "IndexFlatL2"  # or "HNSW"
+    FAISS_INDEX_TYPE: str = "auto"  # "auto", "flat", "HNSW", "IVFFlat", "IVFPQ" or "HNSW+SQ8"
+    FAISS_METRIC: str = "ip"  # "ip" (cosine on normalized embeddings) or "l2"
     TOP_K_CHUNKS: int = 15
-    FAISS_NPROBE: int = 10  # For HNSW
+    FAISS_NPROBE: int = 10  # IVF lists probed per query
+    FAISS_EF_SEARCH: int = 64  # HNSW candidates explored per query
+    FAISS_HNSW_M: int = 32
+    FAISS_IVF_NLIST: int = 0  # 0 = about 4 * sqrt(vectors)
+    FAISS_PQ_M: int = 0  # PQ sub-quantizers, 0 = dimension / 4
+    FAISS_MIN_TRAIN_VECTORS: int = 10000  # Trained types stay exact flat below this
+    FAISS_TRAIN_SAMPLE: int = 100000  # Max vectors sampled for training
+    FAISS_RECALL_TARGET: float = 0.95  # "auto": drives efSearch / nprobe
+    FAISS_AUTO_FLAT_MAX_VECTORS: int = 20000  # "auto": exact search up to this (at 384 dims)
+    FAISS_AUTO_MEMORY_MB: int = 1024  # "auto": beyond this, compress with IVF-PQ
+    FAISS_AUTO_HYSTERESIS: float = 0.2  # "auto": margin before switching type
+    FAISS_MMAP: bool = True  # Map saved indexes read-only until first change
+    FAISS_CACHE_MAX_MB: int = 2048  # Per-project indexes kept in memory
+    METADATA_COMPACT_RATIO: float = 0.3  # Rewrite the chunk text blob once this share of it is dead
+    LEXICAL_INDEX_ENABLED: bool = True  # BM25 identifier index kept alongside FAISS
+    HYBRID_CANDIDATES: int = 50  # Hits per retriever before rank fusion
+    RRF_K: int = 60  # Reciprocal rank fusion offset
+    RERANK_ENABLED: bool = True  # Diversify retrieved chunks before prompting
+    MMR_LAMBDA: float = 0.7  # Relevance vs. diversity (1.0 = relevance only)
+    RERANK_MAX_PER_PATH: int = 3  # Chunks per file, 0 = unlimited
+    RERANK_OVERLAP_RATIO: float = 0.5  # Same-file line overlap that counts as duplicate
+    RETRIEVAL_CACHE_SIZE: int = 256  # Cached hybrid search results per project index
+    INCREMENTAL_INDEXING: bool = True  # Re-index only files changed since last job
     
     # LLM Configuration
     LLM_MAX_TOKENS: int = 1800
     LLM_TEMPERATURE: float = 0.2
     LLM_TIMEOUT: int = 60
-    MAX_CONTEXT_TOKENS: int = 8000
+    MAX_CONTEXT_TOKENS: int = 8000  # Prompt plus response (LLM_MAX_TOKENS)
+    PROMPT_TOKENIZER: str = "cl100k_base"  # tiktoken encoding, estimated if unavailable
+    PROMPT_TOKEN_CACHE_SIZE: int = 4096  # Cached token counts of chunks and messages
+    PROMPT_HISTORY_MESSAGES: int = 5
+    PROMPT_HISTORY_MAX_TOKENS: int = 1000
+    PROMPT_MIN_CHUNK_TOKENS: int = 64  # Skip rather than trim a chunk below this
     
     # Build Configuration
     GRADLE_TIMEOUT: int = 600  # 10 minutes
@@ -40,9 +88,26 @@ class Settings(BaseModel):
     BUILD_VARIANT: str = "release"  # or "debug"
     
     # Job Configuration
-    POLL_INTERVAL: int = 30  # seconds
-    CLAIM_TTL: int = 3600  # 1 hour
+    POLL_INTERVAL: int = 30  # Longest wait between claims when idle, seconds
+    CLAIM_BACKOFF_MIN: float = 1.0  # First wait after an empty claim, doubling up to POLL_INTERVAL
+    CLAIM_BACKOFF_JITTER: float = 0.2  # Random +/- share of each backoff wait
+    CLAIM_LONG_POLL: int = 0  # Seconds the backend may hold a claim open, 0 = plain polling
+    CLAIM_TTL: int = 3600  # 1 hour, lease assumed if the backend sends no claimExpiry
     MAX_JOB_RETRIES: int = 3
+    JOB_WORKERS: int = 4  # Jobs executed at once, 1 = serial
+    JOB_CONCURRENCY: Dict[str, int] = {"gradle": 1, "chat": 4, "index-update": 2}  # Running jobs per group
+    JOB_PREFETCH: int = 2  # Jobs claimed ahead of free workers
+    JOB_CLAIM_BATCH: int = 4  # Most jobs requested per claim call
+    JOB_PREFETCH_MAX_WAIT: int = 1800  # Return a queued job to the backend after this many seconds
+    JOB_WARM_MAX_DELAY: int = 120  # Jobs of warm projects may overtake a job this long, seconds
+    LEASE_RENEW_MARGIN: int = 300  # Renew a queued job's claim this many seconds before expiry
+    HEARTBEAT_INTERVAL: int = 60  # Seconds between lease renewals (with progress) of running jobs
+    CHECKPOINT_MAX_AGE: int = 21600  # Resume interrupted jobs up to 6 hours old
+    CHECKPOINT_MAX_RESUMES: int = 2  # Fail a job interrupted more often than this
+    AFFINITY_ENABLED: bool = True  # Send warm projects with claims as a routing hint
+    AFFINITY_MAX_PROJECTS: int = 50  # Warm projects listed per claim
+    AFFINITY_REFRESH_INTERVAL: int = 60  # Seconds between warm project scans
+    JOB_CONCURRENCY_GROUPS: Dict[str, str] = {"build-and-patch": "gradle", "build-only": "gradle"}  # Job type -> group (default: the type)
     RETRY_BASE_DELAY: int = 2  # seconds
     
     # Cleanup Configuration
@@ -74,7 +139,8 @@ class Settings(BaseModel):
             self.MODELS_DIR,
             self.FAISS_DIR,
             self.BUILD_DIR,
-            self.LOGS_DIR
+            self.LOGS_DIR,
+            self.CHECKPOINT_DIR
         ]:
             dir_path.mkdir(parents=True, exist_ok=True)
 
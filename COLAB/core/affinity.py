@@ -0,0 +1,66 @@
+import sys
+from typing import List, Dict, Any
+from config.settings import settings
+
+# Cache kinds an agent can hold for a project
+AFFINITY_FIELDS = ("repo", "index", "gradle", "loaded")
+
+def get_project_affinity(project_id: str) -> Dict[str, Any]:
+    """
+    Describe what this agent already holds for a project
+    
+    - repo: checkout in WORKSPACE_DIR (no clone needed)
+    - index: saved or loaded FAISS index (no full re-index needed)
+    - gradle: project Gradle cache from an earlier build
+    - loaded: repo or index open in memory right now
+    """
+    repo_path = settings.WORKSPACE_DIR / project_id
+    
+    # Only check the in-memory caches of modules a job has imported
+    repo_manager = sys.modules.get("git.repo_manager")
+    faiss_manager = sys.modules.get("vector.faiss_manager")
+    
+    repo_loaded = bool(repo_manager and repo_manager.is_repo_cached(project_id))
+    index_loaded = bool(faiss_manager and faiss_manager.is_index_cached(project_id))
+    
+    return {
+        "projectId": project_id,
+        "repo": (repo_path / ".git").exists(),
+        "index": index_loaded or (settings.FAISS_DIR / f"{project_id}.index").exists(),
+        "gradle": (repo_path / ".gradle").is_dir(),
+        "loaded": repo_loaded or index_loaded
+    }
+
+def affinity_score(affinity: Dict[str, Any]) -> int:
+    """Count the caches held for a project"""
+    return sum(1 for field in AFFINITY_FIELDS if affinity.get(field))
+
+def project_warmth(project_id: str) -> int:
+    """Score a project for ordering local jobs (see JobManager.poll_loop)"""
+    return affinity_score(get_project_affinity(project_id))
+
+def get_warm_projects(limit: int = None) -> List[Dict[str, Any]]:
+    """
+    List the projects this agent holds warm, warmest first
+    
+    Sent with job claims so the backend can route a project's jobs to
+    the agent that already has it cloned, indexed and built.
+    """
+    limit = limit or settings.AFFINITY_MAX_PROJECTS
+    
+    project_ids = set()
+    if settings.WORKSPACE_DIR.exists():
+        project_ids.update(
+            path.name for path in settings.WORKSPACE_DIR.iterdir()
+            if (path / ".git").exists()
+        )
+    if settings.FAISS_DIR.exists():
+        project_ids.update(
+            path.name[:-len(".index")] for path in settings.FAISS_DIR.glob("*.index")
+        )
+        
+    projects = [get_project_affinity(project_id) for project_id in project_ids]
+    projects = [project for project in projects if affinity_score(project) > 0]
+    projects.sort(key=lambda project: (-affinity_score(project), project["projectId"]))
+    
+    return projects[:limit]
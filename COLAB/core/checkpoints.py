@@ -0,0 +1,132 @@
+import os
+import json
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+from config.settings import settings
+from utils.logger import logger
+
+class CheckpointJournal:
+    """
+    Local journal of the steps each running job has finished
+    
+    One append-only JSON lines file per job: a header with the job
+    itself, then one record per finished step with the data needed to
+    skip it (e.g. the indexed commit or the LLM response). Records are
+    fsynced, so after a crash or kernel restart the agent can pick the
+    job up again and continue after the last finished step. A line torn
+    by a crash mid-write is skipped.
+    """
+    
+    def __init__(self, directory: Path = None):
+        self.directory = Path(directory or settings.CHECKPOINT_DIR)
+        
+    def _path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.jsonl"
+        
+    def _append(self, job_id: str, record: Dict[str, Any]) -> bool:
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            
+            record["timestamp"] = time.time()
+            with open(self._path(job_id), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                
+            return True
+            
+        except Exception as e:
+            logger.warning(f"Failed to write checkpoint for {job_id}: {str(e)}")
+            return False
+            
+    def _read(self, job_id: str) -> List[Dict[str, Any]]:
+        path = self._path(job_id)
+        if not path.exists():
+            return []
+            
+        records = []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Torn write from a crash; records appended after it still count
+                        continue
+                        
+        except Exception as e:
+            logger.warning(f"Failed to read checkpoints for {job_id}: {str(e)}")
+            
+        return records
+        
+    def start(self, job_data: Dict[str, Any]) -> bool:
+        """
+        Open the journal of a job (the claimed job's backend fields)
+        
+        Returns True if the job already had a journal, i.e. it is being
+        resumed; the resume is recorded.
+        """
+        job_id = job_data["jobId"]
+        
+        if self._path(job_id).exists():
+            self._append(job_id, {"type": "resume"})
+            return True
+            
+        self._append(job_id, {"type": "job", "job": job_data})
+        return False
+        
+    def record(self, job_id: str, step: str, data: Optional[Dict[str, Any]] = None) -> bool:
+        """Record that a step finished, with what is needed to skip it"""
+        return self._append(job_id, {"type": "step", "step": step, "data": data or {}})
+        
+    def get(self, job_id: str, step: str) -> Optional[Dict[str, Any]]:
+        """Get the data of a finished step, or None if it has not finished"""
+        return self.steps(job_id).get(step)
+        
+    def steps(self, job_id: str) -> Dict[str, Dict[str, Any]]:
+        """Get finished steps and their data"""
+        return {
+            record["step"]: record.get("data") or {}
+            for record in self._read(job_id)
+            if record.get("type") == "step"
+        }
+        
+    def resume_count(self, job_id: str) -> int:
+        """Get how often the job has been resumed"""
+        return sum(1 for record in self._read(job_id) if record.get("type") == "resume")
+        
+    def finish(self, job_id: str):
+        """Drop the journal of a job that completed or failed"""
+        try:
+            self._path(job_id).unlink(missing_ok=True)
+        except Exception as e:
+            logger.warning(f"Failed to remove checkpoints for {job_id}: {str(e)}")
+            
+    def unfinished(self) -> List[Dict[str, Any]]:
+        """
+        Get jobs whose journal was left behind by a crash
+        
+        Journals older than CHECKPOINT_MAX_AGE are dropped instead; by
+        then the backend has likely given up on the job.
+        """
+        if not self.directory.exists():
+            return []
+            
+        jobs = []
+        for path in sorted(self.directory.glob("*.jsonl"), key=lambda p: p.stat().st_mtime):
+            job_id = path.stem
+            
+            if time.time() - path.stat().st_mtime > settings.CHECKPOINT_MAX_AGE:
+                logger.info(f"Dropping stale checkpoints of job {job_id}")
+                self.finish(job_id)
+                continue
+                
+            records = self._read(job_id)
+            if not records or records[0].get("type") != "job":
+                self.finish(job_id)
+                continue
+                
+            jobs.append(records[0]["job"])
+            
+        return jobs
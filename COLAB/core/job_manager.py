@@ -1,10 +1,19 @@
 import time
+import random
+import threading
+import traceback
 import requests
-from typing import Optional, Dict, Any
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Callable
+from datetime import datetime, timezone
 from config.settings import settings
 from utils.logger import logger
 from utils.retry import retry_decorator
+from core.checkpoints import CheckpointJournal
+
+class JobLostError(Exception):
+    """Raised in a running job whose claim the backend gave to another agent"""
+    pass
 
 class Job:
     """Job data model"""
@@ -17,6 +26,27 @@ class Job:
         self.payload = data.get("payload", {})
         self.created_at = data.get("createdAt")
         self.claimed_at = None
+        self.claimed_time: Optional[float] = None
+        self.lease_expires: Optional[float] = None
+        self.progress: Optional[Dict[str, Any]] = None
+        self.resumed = False
+        # Set when the backend rejects the lease; the job must stop
+        self.lost = False
+        
+    def set_lease(self, claim_expiry: Optional[str] = None):
+        """Set the lease deadline from the backend's claimExpiry (default CLAIM_TTL)"""
+        remaining = settings.CLAIM_TTL
+        if claim_expiry:
+            try:
+                expiry = datetime.fromisoformat(claim_expiry.replace("Z", "+00:00"))
+                if expiry.tzinfo is None:
+                    # Backend timestamps without an offset are UTC
+                    expiry = expiry.replace(tzinfo=timezone.utc)
+                remaining = (expiry - datetime.now(timezone.utc)).total_seconds()
+            except ValueError:
+                logger.warning(f"Unparseable claimExpiry: {claim_expiry}")
+                
+        self.lease_expires = time.time() + remaining
         
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -26,9 +56,47 @@ class Job:
             "state": self.state,
             "payload": self.payload,
             "createdAt": self.created_at,
-            "claimedAt": self.claimed_at
+            "claimedAt": self.claimed_at,
+            "progress": self.progress
+        }
+        
+    def to_claim_data(self) -> Dict[str, Any]:
+        """Get the fields the job was claimed with, to rebuild it later"""
+        return {
+            "jobId": self.id,
+            "projectId": self.project_id,
+            "type": self.type,
+            "payload": self.payload,
+            "createdAt": self.created_at
         }
 
+class ClaimBackoff:
+    """
+    Delay before the next claim while the job queue is empty
+    
+    Starts at min_delay and doubles after each empty claim up to
+    max_delay. Each delay is randomly stretched or shrunk by up to
+    `jitter` so idle agents don't poll the backend in lockstep.
+    """
+    
+    def __init__(self, min_delay: float, max_delay: float, jitter: float = 0.2):
+        self.min_delay = min_delay
+        self.max_delay = max(min_delay, max_delay)
+        self.jitter = jitter
+        self.attempts = 0
+        
+    def reset(self):
+        """Start over from min_delay (a job was claimed)"""
+        self.attempts = 0
+        
+    def next_delay(self) -> float:
+        """Get the delay after another empty claim"""
+        delay = min(self.min_delay * (2 ** self.attempts), self.max_delay)
+        if delay < self.max_delay:
+            self.attempts += 1
+            
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
 class JobManager:
     """Manage job lifecycle: claim, execute, update, complete"""
     
@@ -36,32 +104,79 @@ class JobManager:
         self.backend_url = settings.BACKEND_URL
         self.colab_id = settings.COLAB_ID
         self.claim_secret = settings.CLAIM_SECRET
-        self.current_job: Optional[Job] = None
         self.session = requests.Session()
         
-    @retry_decorator(max_retries=3, base_delay=2)
-    def claim_job(self) -> Optional[Job]:
+        # Claimed jobs by ID; those in _waiting have not started yet
+        self.active_jobs: Dict[str, Job] = {}
+        self._waiting: List[str] = []
+        self._jobs_lock = threading.Lock()
+        self._slot_freed = threading.Event()
+        self._lease_supported = True
+        self._stopping = threading.Event()
+        self._heartbeat_thread: Optional[threading.Thread] = None
+        self.journal = CheckpointJournal()
+        
+        # Scores how warm a project's caches are (see poll_loop)
+        self.warmth: Optional[Callable[[str], int]] = None
+        
+        # Lists the projects held warm, sent as a routing hint with claims
+        self.affinity: Optional[Callable[[], List[Dict[str, Any]]]] = None
+        self._warm_projects: List[Dict[str, Any]] = []
+        self._warm_projects_time = 0.0
+        
+    def _headers(self) -> Dict[str, str]:
+        # FIXED: Proper authentication headers
+        return {
+            "Content-Type": "application/json",
+            "X-Colab-Secret": self.claim_secret,
+            "X-Colab-Id": self.colab_id
+        }
+        
+    def claim_job(self, wait: float = 0) -> Optional[Job]:
         """
         Poll backend to claim next available job
         Returns Job object or None if no jobs available
         """
+        jobs = self.claim_jobs(1, wait=wait)
+        return jobs[0] if jobs else None
+        
+    @retry_decorator(max_retries=3, base_delay=2)
+    def claim_jobs(self, max_jobs: int, wait: float = 0) -> List[Job]:
+        """
+        Claim up to max_jobs jobs in one request
+        
+        Backends without batch support return a single job, which is
+        handled the same way. Claimed jobs are added to the local queue.
+        
+        Args:
+            max_jobs: Most jobs to claim
+            wait: Seconds the backend may hold the request open until a
+                job arrives (long-poll); backends without long-poll
+                support answer right away
+                
+        Returns:
+            Claimed jobs (empty if none are available)
+        """
         try:
             url = f"{self.backend_url}/api/jobs/claim"
+            params = {}
+            if max_jobs > 1:
+                params["max"] = max_jobs
+            if wait > 0:
+                params["wait"] = f"{wait:g}"
+                
+            # Ask the backend to prefer jobs of projects this agent holds warm
+            warm_projects = self._get_warm_projects()
             
-            # FIXED: Proper authentication headers
-            headers = {
-                "Content-Type": "application/json",
-                "X-Colab-Secret": self.claim_secret,
-                "X-Colab-Id": self.colab_id
-            }
-            
-            logger.debug(f"Attempting to claim job from {url}")
+            logger.debug(f"Attempting to claim up to {max_jobs} job(s) from {url}")
             logger.debug(f"Headers: Colab-Id={self.colab_id}, Secret={'*' * 20}")
             
             response = self.session.post(
                 url,
-                headers=headers,
-                timeout=30
+                headers=self._headers(),
+                params=params,
+                json={"warmProjects": warm_projects} if warm_projects is not None else None,
+                timeout=30 + wait
             )
             
             logger.debug(f"Response status: {response.status_code}")
@@ -69,7 +184,7 @@ class JobManager:
             # FIXED: Handle 204 (no jobs) correctly
             if response.status_code == 204:
                 logger.debug("No jobs available (204)")
-                return None
+                return []
             
             # FIXED: Handle 200 with proper error checking
             if response.status_code == 200:
@@ -80,98 +195,171 @@ class JobManager:
                     # FIXED: Check if job is actually present
                     if not job_data:
                         logger.debug("Empty response body")
-                        return None
+                        return []
                     
-                    # FIXED: Handle both {job: {...}} and direct job object
-                    if "job" in job_data:
-                        job_info = job_data["job"]
-                        if job_info is None:
-                            logger.debug("Job field is null")
-                            return None
+                    # Batch {jobs: [...]}, single {job: {...}} or a direct job object
+                    if "jobs" in job_data:
+                        job_infos = job_data["jobs"] or []
+                    elif "job" in job_data:
+                        job_infos = [job_data["job"]] if job_data["job"] else []
                     else:
-                        # Response might be the job directly
-                        job_info = job_data
+                        job_infos = [job_data]
+                        
+                    if not job_infos:
+                        logger.debug("Job field is null")
+                        return []
                     
-                    # FIXED: Validate required fields
-                    required_fields = ["jobId", "projectId", "type"]
-                    for field in required_fields:
-                        if field not in job_info:
-                            logger.error(f"Missing required field: {field}")
-                            logger.error(f"Job data: {job_info}")
-                            return None
-                    
-                    job = Job(job_info)
-                    job.claimed_at = datetime.utcnow().isoformat() + "Z"
-                    
-                    self.current_job = job
-                    
-                    logger.info(
-                        f"✅ Claimed job: {job.id}",
-                        meta={
-                            "job_id": job.id,
-                            "project_id": job.project_id,
-                            "type": job.type
-                        }
-                    )
-                    
-                    # Immediately update state to 'running'
-                    self.update_job_state("running")
-                    
-                    return job
+                    jobs = []
+                    for job_info in job_infos:
+                        job = self._accept_job(job_info)
+                        if job:
+                            jobs.append(job)
+                            
+                    # Marked 'running' once a worker slot picks them up
+                    return jobs
                     
                 except Exception as e:
                     logger.error(f"Failed to parse job response: {str(e)}")
                     logger.error(f"Response text: {response.text}")
-                    return None
+                    return []
             
             # FIXED: Handle authentication errors
             if response.status_code == 401:
                 logger.error("❌ Authentication failed - check COLAB_AGENT_SECRET")
                 logger.error("Response: " + response.text)
-                return None
+                return []
             
             # Handle other errors
             logger.error(f"Unexpected status code: {response.status_code}")
             logger.error(f"Response: {response.text}")
-            return None
+            return []
                 
         except requests.exceptions.Timeout:
             logger.error("Request timeout while claiming job")
-            return None
+            return []
             
         except requests.exceptions.RequestException as e:
             logger.error(f"❌ Job claim request failed: {str(e)}")
             if hasattr(e, 'response') and e.response is not None:
                 logger.error(f"Response status: {e.response.status_code}")
                 logger.error(f"Response body: {e.response.text}")
-            return None
+            return []
             
         except Exception as e:
             logger.error(f"❌ Unexpected error claiming job: {str(e)}")
-            import traceback
             logger.error(traceback.format_exc())
-            return None
+            return []
             
+    def _accept_job(self, job_info: Dict[str, Any]) -> Optional[Job]:
+        """Validate a claimed job and add it to the local queue"""
+        # FIXED: Validate required fields
+        required_fields = ["jobId", "projectId", "type"]
+        for field in required_fields:
+            if field not in job_info:
+                logger.error(f"Missing required field: {field}")
+                logger.error(f"Job data: {job_info}")
+                return None
+                
+        job = Job(job_info)
+        job.claimed_at = datetime.utcnow().isoformat() + "Z"
+        job.claimed_time = time.time()
+        job.set_lease(job_info.get("claimExpiry"))
+        
+        with self._jobs_lock:
+            self.active_jobs[job.id] = job
+            self._waiting.append(job.id)
+            
+        logger.info(
+            f"✅ Claimed job: {job.id}",
+            meta={
+                "job_id": job.id,
+                "project_id": job.project_id,
+                "type": job.type
+            }
+        )
+        
+        return job
+        
+    def renew_lease(self, job_id: str) -> bool:
+        """Extend the claim on a job, sending its progress along"""
+        job = self.get_job(job_id)
+        if not job or not self._lease_supported:
+            return False
+            
+        try:
+            response = self.session.post(
+                f"{self.backend_url}/api/jobs/{job_id}/lease",
+                headers=self._headers(),
+                json={"progress": job.progress} if job.progress else None,
+                timeout=30
+            )
+            
+            if response.status_code in (404, 405) and "JOB_NOT_FOUND" not in response.text:
+                # The backend has no lease endpoint; claims simply don't expire early
+                logger.info("Backend does not support lease renewal")
+                self._lease_supported = False
+                return False
+                
+            if response.status_code in (404, 409):
+                # Expired and handed to another agent, or gone
+                job.lost = True
+                logger.warning(f"Lost claim on job {job_id}, stopping it: {response.status_code}")
+                return False
+                
+            if response.status_code != 200:
+                logger.warning(f"Failed to renew lease of {job_id}: {response.status_code}")
+                return False
+                
+            job.set_lease((response.json() or {}).get("claimExpiry"))
+            logger.debug(f"Renewed lease of {job_id}")
+            return True
+            
+        except Exception as e:
+            logger.warning(f"Failed to renew lease of {job_id}: {str(e)}")
+            return False
+            
+    def return_job(self, job_id: str) -> bool:
+        """Hand a claimed job that has not started back to the backend queue"""
+        try:
+            response = self.session.post(
+                f"{self.backend_url}/api/jobs/{job_id}/release",
+                headers=self._headers(),
+                timeout=30
+            )
+            
+            if response.status_code != 200:
+                logger.warning(f"Backend did not take back job {job_id}: {response.status_code}")
+                return False
+                
+        except Exception as e:
+            logger.warning(f"Failed to return job {job_id}: {str(e)}")
+            return False
+            
+        logger.info(f"↩️ Returned job to backend: {job_id}")
+        self.release_job(job_id)
+        return True
+        
     @retry_decorator(max_retries=3, base_delay=1)
     def update_job_state(
         self,
+        job_id: str,
         state: str,
         result: Optional[Dict[str, Any]] = None,
         error: Optional[str] = None
     ) -> bool:
         """Update job state in backend"""
-        if not self.current_job:
-            logger.warning("No current job to update")
+        job = self.get_job(job_id)
+        if not job:
+            logger.warning(f"No active job to update: {job_id}")
             return False
             
-        try:
-            url = f"{self.backend_url}/api/jobs/{self.current_job.id}"
+        if job.lost:
+            logger.warning(f"Not reporting {state} for job {job_id}, another agent holds it")
+            return False
             
-            headers = {
-                "Content-Type": "application/json",
-                "X-Colab-Secret": self.claim_secret,
-                "X-Colab-Id": self.colab_id
-            }
+        try:
+            url = f"{self.backend_url}/api/jobs/{job_id}"
+            headers = self._headers()
             
             payload = {
                 "state": state,
@@ -198,11 +386,11 @@ class JobManager:
                 logger.error(f"Response: {response.text}")
                 return False
             
-            self.current_job.state = state
+            job.state = state
             
             logger.info(
                 f"✅ Job state updated: {state}",
-                meta={"job_id": self.current_job.id}
+                meta={"job_id": job_id}
             )
             
             return True
@@ -213,95 +401,476 @@ class JobManager:
                 logger.error(f"Response: {e.response.text}")
             return False
             
-    def mark_running(self) -> bool:
+    def get_job(self, job_id: str) -> Optional[Job]:
+        """Get a claimed job by ID"""
+        with self._jobs_lock:
+            return self.active_jobs.get(job_id)
+            
+    def mark_running(self, job_id: str) -> bool:
         """Mark job as running"""
-        return self.update_job_state("running")
+        return self.update_job_state(job_id, "running")
         
-    def mark_completed(self, result: Dict[str, Any]) -> bool:
+    def mark_completed(self, job_id: str, result: Dict[str, Any]) -> bool:
         """Mark job as completed with result"""
-        return self.update_job_state("completed", result=result)
+        return self.update_job_state(job_id, "completed", result=result)
         
-    def mark_failed(self, error: str) -> bool:
+    def mark_failed(self, job_id: str, error: str) -> bool:
         """Mark job as failed with error"""
-        return self.update_job_state("failed", error=error)
+        return self.update_job_state(job_id, "failed", error=error)
+        
+    def release_job(self, job_id: str):
+        """Forget a finished job and free its slot"""
+        with self._jobs_lock:
+            job = self.active_jobs.pop(job_id, None)
+            if job_id in self._waiting:
+                self._waiting.remove(job_id)
+                
+        if job:
+            logger.info(f"Releasing job: {job_id}")
+            
+            # The job may have cloned, indexed or built a project
+            self._warm_projects_time = 0.0
+            self._slot_freed.set()
+            
+    def _get_warm_projects(self) -> Optional[List[Dict[str, Any]]]:
+        """Get the warm project list (None = no hint), refreshed every AFFINITY_REFRESH_INTERVAL seconds"""
+        if not self.affinity or not settings.AFFINITY_ENABLED:
+            return None
+            
+        if time.monotonic() - self._warm_projects_time >= settings.AFFINITY_REFRESH_INTERVAL:
+            try:
+                self._warm_projects = self.affinity()
+            except Exception as e:
+                logger.warning(f"Failed to list warm projects: {str(e)}")
+                self._warm_projects = []
+            self._warm_projects_time = time.monotonic()
+            
+        return self._warm_projects
+        
+    def report_progress(self, job_id: str, step: str, **detail):
+        """
+        Set the current step of a running job
         
-    def release_job(self):
-        """Release current job"""
-        if self.current_job:
-            logger.info(f"Releasing job: {self.current_job.id}")
-            self.current_job = None
+        Sent with the next lease heartbeat, e.g.
+        report_progress(job.id, "indexing", files=120). Raises
+        JobLostError once another agent holds the job, so it stops at
+        its next step.
+        """
+        job = self.get_job(job_id)
+        if not job:
+            return
             
-    def poll_loop(self, callback, interval: int = None):
+        self._ensure_claimed(job)
+        job.progress = {
+            "step": step,
+            "updatedAt": datetime.utcnow().isoformat() + "Z",
+            **detail
+        }
+        logger.debug(f"Job {job_id} progress: {step}", meta=detail or None)
+        
+    def checkpoint(self, job_id: str, step: str, data: Optional[Dict[str, Any]] = None) -> bool:
+        """Record a finished step so a resumed job can skip it"""
+        job = self.get_job(job_id)
+        if job:
+            self._ensure_claimed(job)
+        return self.journal.record(job_id, step, data)
+        
+    @staticmethod
+    def _ensure_claimed(job: Job):
+        """Stop a job at its next step once its claim is lost"""
+        if job.lost:
+            raise JobLostError(f"Job {job.id} is now held by another agent")
+        
+    def get_checkpoint(self, job_id: str, step: str) -> Optional[Dict[str, Any]]:
+        """Get the data of a step finished before a restart, or None"""
+        return self.journal.get(job_id, step)
+        
+    def _heartbeat_loop(self):
+        """Renew the claims of running jobs every HEARTBEAT_INTERVAL seconds"""
+        while not self._stopping.wait(settings.HEARTBEAT_INTERVAL):
+            if not self._lease_supported:
+                return
+                
+            with self._jobs_lock:
+                running = [job_id for job_id in self.active_jobs if job_id not in self._waiting]
+                
+            for job_id in running:
+                self.renew_lease(job_id)
+                
+    def resume_unfinished(self) -> int:
+        """
+        Queue jobs a previous run of the agent was executing when it died
+        
+        Their journals are still on disk. Each claim is renewed first:
+        if the backend handed the job to another agent meanwhile (404 or
+        409), the journal is dropped; if the backend can't be asked, the
+        job is left for the next start. A job that has already been
+        resumed CHECKPOINT_MAX_RESUMES times is failed instead, in case
+        it is what kills the agent.
+        """
+        resumed = 0
+        for job_data in self.journal.unfinished():
+            job = Job(job_data)
+            if self.get_job(job.id):
+                continue
+                
+            job.state = "running"
+            job.resumed = True
+            job.claimed_at = datetime.utcnow().isoformat() + "Z"
+            job.claimed_time = time.time()
+            job.set_lease()
+            
+            with self._jobs_lock:
+                self.active_jobs[job.id] = job
+                
+            renewed = self.renew_lease(job.id)
+            if job.lost:
+                logger.info(f"Interrupted job {job.id} is held by another agent, dropping it")
+                self.journal.finish(job.id)
+                self.release_job(job.id)
+                continue
+                
+            if not renewed and self._lease_supported:
+                logger.warning(f"Could not confirm the claim of interrupted job {job.id}, leaving it for the next start")
+                self.release_job(job.id)
+                continue
+                
+            if self.journal.resume_count(job.id) >= settings.CHECKPOINT_MAX_RESUMES:
+                logger.error(f"Job {job.id} was interrupted too often, failing it")
+                self.mark_failed(job.id, "Job interrupted repeatedly by agent restarts")
+                self.journal.finish(job.id)
+                self.release_job(job.id)
+                continue
+                
+            with self._jobs_lock:
+                self._waiting.append(job.id)
+                
+            resumed += 1
+            logger.info(
+                f"♻️ Resuming interrupted job: {job.id}",
+                meta={"job_id": job.id, "type": job.type, "steps": list(self.journal.steps(job.id))}
+            )
+            
+        return resumed
+        
+    def get_concurrency_group(self, job_type: str) -> str:
+        """Get the concurrency group of a job type (e.g. both build types share "gradle")"""
+        return settings.JOB_CONCURRENCY_GROUPS.get(job_type, job_type)
+        
+    def free_slots(self, workers: int) -> int:
+        """Get how many more jobs may be claimed (workers plus JOB_PREFETCH)"""
+        # Serial mode can't renew leases while a job runs, so it doesn't prefetch
+        prefetch = settings.JOB_PREFETCH if workers > 1 else 0
+        with self._jobs_lock:
+            return max(0, workers + prefetch - len(self.active_jobs))
+            
+    def has_waiting(self) -> bool:
+        """Check if claimed jobs are waiting for a slot"""
+        with self._jobs_lock:
+            return bool(self._waiting)
+            
+    def _get_warmth(self, project_id: str) -> int:
+        if not self.warmth:
+            return 0
+            
+        try:
+            return self.warmth(project_id)
+        except Exception as e:
+            logger.warning(f"Project warmth check failed: {str(e)}")
+            return 0
+            
+    def _next_runnable(self, workers: int) -> Optional[Job]:
+        """
+        Take the waiting job that should start next
+        
+        A job waits while all workers are busy, while its concurrency
+        group is at its limit, or while another job of the same project
+        runs (jobs of one project share its checkout and index).
+        
+        Among jobs that may start, those for projects with warm caches
+        go first, then the oldest. Jobs that have waited JOB_WARM_MAX_DELAY
+        seconds go before all others, in claim order, whatever their warmth.
+        """
+        with self._jobs_lock:
+            running = [
+                job for job_id, job in self.active_jobs.items()
+                if job_id not in self._waiting
+            ]
+            if len(running) >= workers:
+                return None
+                
+            group_counts: Dict[str, int] = {}
+            for job in running:
+                group = self.get_concurrency_group(job.type)
+                group_counts[group] = group_counts.get(group, 0) + 1
+            busy_projects = {job.project_id for job in running}
+            
+            candidates = []
+            for job_id in self._waiting:
+                job = self.active_jobs[job_id]
+                group = self.get_concurrency_group(job.type)
+                limit = settings.JOB_CONCURRENCY.get(group, workers)
+                
+                if group_counts.get(group, 0) < limit and job.project_id not in busy_projects:
+                    candidates.append(job)
+                    
+        if not candidates:
+            return None
+            
+        # Only the poll loop dispatches, so candidates can't be taken meanwhile
+        now = time.time()
+        
+        def priority(item):
+            index, job = item
+            overdue = now - (job.claimed_time or now) >= settings.JOB_WARM_MAX_DELAY
+            return (not overdue, 0 if overdue else -self._get_warmth(job.project_id), index)
+            
+        best = min(enumerate(candidates), key=priority)[1]
+        
+        with self._jobs_lock:
+            self._waiting.remove(best.id)
+            
+        return best
+        
+    def _maintain_leases(self):
+        """
+        Renew claims of waiting jobs that are about to expire
+        
+        A job that has waited longer than JOB_PREFETCH_MAX_WAIT, or whose
+        lease can't be renewed, is returned to the backend for another
+        agent. If the backend can't take it back it stays queued here.
+        """
+        now = time.time()
+        with self._jobs_lock:
+            expiring = [
+                self.active_jobs[job_id] for job_id in self._waiting
+                if self.active_jobs[job_id].lease_expires is not None
+                and self.active_jobs[job_id].lease_expires - now < settings.LEASE_RENEW_MARGIN
+            ]
+            
+        for job in expiring:
+            waited = now - (job.claimed_time or now)
+            if waited < settings.JOB_PREFETCH_MAX_WAIT and self.renew_lease(job.id):
+                continue
+                
+            if job.lost:
+                self.release_job(job.id)
+                continue
+                
+            if not self.return_job(job.id):
+                # Don't retry every loop; the backend does not expire claims on its own
+                job.lease_expires = None
+                logger.warning(f"Keeping job {job.id} queued after its lease ran out")
+                
+    def _run_job(self, job: Job, callback: Callable[[Job], Any]):
+        """Execute one job and release it, reporting failures to the backend"""
+        # Pool threads are reused; drop log lines a previous job left behind
+        logger.clear_buffer()
+        
+        logger.info(f"📋 Executing job: {job.id} (type: {job.type})")
+        if job.state != "running":
+            self.mark_running(job.id)
+            
+        # A journal left by a crashed run means some steps can be skipped
+        job.resumed = self.journal.start(job.to_claim_data())
+        
+        try:
+            callback(job)
+            logger.info(f"✅ Job {job.id} completed successfully")
+            self.journal.finish(job.id)
+        except JobLostError as e:
+            logger.warning(f"Stopped job {job.id}: {str(e)}")
+            self.journal.finish(job.id)
+        except Exception as e:
+            logger.error(
+                f"❌ Job execution failed: {str(e)}",
+                meta={"job_id": job.id}
+            )
+            logger.error(traceback.format_exc())
+            self.mark_failed(job.id, str(e))
+            self.journal.finish(job.id)
+        finally:
+            self.release_job(job.id)
+            
+    def _dispatch(
+        self,
+        callback: Callable[[Job], Any],
+        executor: Optional[ThreadPoolExecutor],
+        workers: int
+    ) -> int:
+        """Start every waiting job that may run now; returns how many started"""
+        started = 0
+        while True:
+            job = self._next_runnable(workers)
+            if not job:
+                return started
+                
+            started += 1
+            if executor:
+                executor.submit(self._run_job, job, callback)
+            else:
+                self._run_job(job, callback)
+                
+    def _return_waiting(self):
+        """
+        Give jobs that were claimed but never started back to the backend
+        
+        A job the backend doesn't take back is only dropped here, so its
+        lease runs out and another agent claims it. Interrupted jobs
+        queued for resuming keep their journal and resume on the next
+        start.
+        """
+        with self._jobs_lock:
+            waiting = [self.active_jobs[job_id] for job_id in self._waiting]
+            
+        for job in waiting:
+            if job.resumed or not self.return_job(job.id):
+                self.release_job(job.id)
+            
+    def poll_loop(
+        self,
+        callback,
+        interval: int = None,
+        workers: int = None,
+        warmth: Optional[Callable[[str], int]] = None,
+        affinity: Optional[Callable[[], List[Dict[str, Any]]]] = None
+    ):
         """
         Main polling loop
         
+        Claims jobs in batches while fewer than `workers` plus
+        JOB_PREFETCH are held and runs them on a thread pool, within the
+        per-group limits of JOB_CONCURRENCY. With one worker, jobs run
+        serially on the calling thread. Claims of prefetched jobs are
+        renewed while they wait.
+        
+        A free slot is filled right away; only an empty claim waits, with
+        exponential backoff from CLAIM_BACKOFF_MIN up to `interval`. With
+        CLAIM_LONG_POLL set the backend holds the claim open instead, and
+        no backoff is needed as long as it does.
+        
         Args:
             callback: Function to call when job is claimed
-            interval: Poll interval in seconds (default from settings)
+            interval: Longest wait between claims when idle, in seconds
+                (default from settings)
+            workers: Jobs executed at once (default from settings)
+            warmth: Scores how much of a project is already loaded (repo,
+                index); waiting jobs of warmer projects start first
+            affinity: Lists the projects this agent holds warm; sent with
+                every claim so the backend can route their jobs here
         """
         interval = interval or settings.POLL_INTERVAL
+        workers = max(1, workers or settings.JOB_WORKERS)
+        self.warmth = warmth
+        self.affinity = affinity
+        self._warm_projects_time = 0.0
+        backoff = ClaimBackoff(settings.CLAIM_BACKOFF_MIN, interval, settings.CLAIM_BACKOFF_JITTER)
         
-        logger.info(f"🚀 Starting job polling loop (interval: {interval}s)")
+        logger.info(f"🚀 Starting job polling loop (max interval: {interval}s, workers: {workers})")
         logger.info(f"Backend: {self.backend_url}")
         logger.info(f"Colab ID: {self.colab_id}")
         
+        executor = None
+        if workers > 1:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job-worker")
+            
+        self._stopping.clear()
+        self._heartbeat_thread = threading.Thread(
+            target=self._heartbeat_loop,
+            name="job-heartbeat",
+            daemon=True
+        )
+        self._heartbeat_thread.start()
+        
+        self.resume_unfinished()
+        self._dispatch(callback, executor, workers)
+        
         consecutive_failures = 0
         consecutive_empty = 0
         
-        while True:
-            try:
-                logger.debug(f"Polling for jobs (attempt {consecutive_empty + 1})...")
-                
-                job = self.claim_job()
-                
-                if job:
-                    # Reset counters on success
-                    consecutive_failures = 0
-                    consecutive_empty = 0
-                    
-                    logger.info(f"📋 Executing job: {job.id} (type: {job.type})")
+        try:
+            while True:
+                try:
+                    self._slot_freed.clear()
+                    claimed = 0
+                    empty = False
+                    long_polled = False
                     
-                    # Execute callback with job
-                    try:
-                        callback(job)
-                        logger.info(f"✅ Job {job.id} completed successfully")
-                    except Exception as e:
-                        logger.error(
-                            f"❌ Job execution failed: {str(e)}",
-                            meta={"job_id": job.id}
-                        )
-                        import traceback
-                        logger.error(traceback.format_exc())
-                        self.mark_failed(str(e))
-                    finally:
-                        self.release_job()
-                else:
-                    consecutive_empty += 1
+                    self._maintain_leases()
                     
-                    if consecutive_empty == 1:
-                        logger.debug("No jobs available")
-                    elif consecutive_empty == 10:
-                        logger.info("⏳ Still waiting for jobs (10 attempts)")
-                    elif consecutive_empty % 50 == 0:
-                        logger.info(f"⏳ Still polling... ({consecutive_empty} attempts)")
+                    while self.free_slots(workers) > 0:
+                        logger.debug(f"Polling for jobs (attempt {consecutive_empty + 1})...")
+                        
+                        # Don't block in a long-poll while claimed jobs wait for a slot
+                        wait = 0 if self.has_waiting() else settings.CLAIM_LONG_POLL
+                        batch = min(self.free_slots(workers), max(1, settings.JOB_CLAIM_BATCH))
+                        started = time.monotonic()
+                        
+                        jobs = self.claim_jobs(batch, wait=wait)
+                        if not jobs:
+                            empty = True
+                            long_polled = wait > 0 and time.monotonic() - started >= wait / 2
+                            break
+                            
+                        claimed += len(jobs)
+                        self._dispatch(callback, executor, workers)
+                        
+                    if claimed:
+                        # Reset counters on success
+                        consecutive_failures = 0
+                        consecutive_empty = 0
+                        backoff.reset()
+                    elif empty:
+                        consecutive_empty += 1
+                        
+                        if consecutive_empty == 1:
+                            logger.debug("No jobs available")
+                        elif consecutive_empty == 10:
+                            logger.info("⏳ Still waiting for jobs (10 attempts)")
+                        elif consecutive_empty % 50 == 0:
+                            logger.info(f"⏳ Still polling... ({consecutive_empty} attempts)")
+                            
+                    # Waiting jobs may start once a running one finishes
+                    self._dispatch(callback, executor, workers)
                     
-                time.sleep(interval)
-                
-            except KeyboardInterrupt:
-                logger.info("🛑 Polling loop interrupted by user")
-                break
-                
-            except Exception as e:
-                consecutive_failures += 1
-                logger.error(f"❌ Error in polling loop (failure {consecutive_failures}): {str(e)}")
-                import traceback
-                logger.error(traceback.format_exc())
-                
-                if consecutive_failures >= 5:
-                    logger.error("❌ Too many consecutive failures, stopping")
+                    if not empty:
+                        # Every slot is taken; a finishing job wakes the loop
+                        delay = min(interval, settings.LEASE_RENEW_MARGIN / 2)
+                    elif long_polled:
+                        # The backend already waited for us
+                        delay = 0
+                    else:
+                        delay = backoff.next_delay()
+                        
+                    if executor:
+                        # Wake early when a job finishes to fill its slot
+                        self._slot_freed.wait(delay)
+                    elif delay:
+                        time.sleep(delay)
+                        
+                except KeyboardInterrupt:
+                    logger.info("🛑 Polling loop interrupted by user")
                     break
+                    
+                except Exception as e:
+                    consecutive_failures += 1
+                    logger.error(f"❌ Error in polling loop (failure {consecutive_failures}): {str(e)}")
+                    logger.error(traceback.format_exc())
+                    
+                    if consecutive_failures >= 5:
+                        logger.error("❌ Too many consecutive failures, stopping")
+                        break
+                        
+                    time.sleep(interval * 2)  # Wait longer after error
+                    
+        finally:
+            self._return_waiting()
+            
+            if executor:
+                logger.info(f"Waiting for {len(self.active_jobs)} running job(s) to finish")
+                executor.shutdown(wait=True)
                 
-                time.sleep(interval * 2)  # Wait longer after error
+            self._stopping.set()
 
 # Global job manager instance
 job_manager = JobManager()
@@ -0,0 +1,394 @@
+import json
+import time
+import uuid
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from typing import Optional, Dict, Any, List
+from utils.logger import logger
+from core.affinity import affinity_score
+
+# Same rules as updateJobState in the Cloudflare backend
+VALID_TRANSITIONS = {
+    "pending": ["claimed", "failed"],
+    "claimed": ["running", "failed"],
+    "running": ["completed", "failed"],
+    "completed": [],
+    "failed": ["pending"]
+}
+
+# Longest long-poll wait a client may request, in seconds
+MAX_CLAIM_WAIT = 60
+
+class LocalBackend:
+    """
+    In-process stand-in for the backend jobs API
+    
+    Serves the claim and job update endpoints the agent uses, so the
+    polling loop can run against it in tests or offline. Claims accept a
+    `wait` query parameter (seconds) and are held open until a job is
+    queued or the wait runs out (long-poll), and a `max` parameter to
+    claim several jobs at once.
+    
+    Claims expire after lease_ttl seconds unless renewed through
+    POST /api/jobs/{id}/lease; expired claims that have not started go
+    back to the queue, as do jobs handed back through
+    POST /api/jobs/{id}/release. Lease renewals may carry the job's
+    progress, which is stored on the job.
+    
+    Claims may carry the projects the agent holds warm ({"warmProjects":
+    [...]}, see core.affinity). Jobs of those projects are handed to it
+    first, and a job whose project another recently seen agent holds
+    warmer is left for that agent for up to affinity_max_wait seconds.
+    
+    Example:
+        backend = LocalBackend(claim_secret="secret")
+        settings.BACKEND_URL = backend.start()
+        backend.enqueue("project-1", "chat", {"message": "hi"})
+    """
+    
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        claim_secret: str = "",
+        lease_ttl: float = 1800,
+        affinity_ttl: float = 120,
+        affinity_max_wait: float = 30
+    ):
+        """
+        Args:
+            host: Interface to bind
+            port: Port to bind (0 = any free port)
+            claim_secret: Required X-Colab-Secret header (empty = not checked)
+            lease_ttl: Seconds a claim lasts before the job is requeued
+            affinity_ttl: Seconds an agent's warm project list stays valid
+            affinity_max_wait: Seconds a job is held for a warmer agent
+        """
+        self.host = host
+        self.port = port
+        self.claim_secret = claim_secret
+        self.lease_ttl = lease_ttl
+        self.affinity_ttl = affinity_ttl
+        self.affinity_max_wait = affinity_max_wait
+        # Warm projects (ID -> score) and last claim time per agent
+        self.agents: Dict[str, Dict[str, Any]] = {}
+        self._queued_at: Dict[str, float] = {}
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.claim_requests = 0
+        self._pending: deque = deque()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+        
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+        
+    def start(self) -> str:
+        """Start serving in a background thread; returns the base URL"""
+        self._stopped = False
+        self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            name="local-backend",
+            daemon=True
+        )
+        self._thread.start()
+        
+        logger.info(f"Local backend listening on {self.url}")
+        return self.url
+        
+    def stop(self):
+        """Stop serving and release waiting claims"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+            
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            
+    def enqueue(self, project_id: str, job_type: str, payload: Optional[Dict[str, Any]] = None) -> str:
+        """Add a pending job; returns its ID"""
+        job_id = f"job-{uuid.uuid4().hex[:12]}"
+        
+        with self._condition:
+            self.jobs[job_id] = {
+                "jobId": job_id,
+                "projectId": project_id,
+                "type": job_type,
+                "state": "pending",
+                "payload": payload or {},
+                "createdAt": self._now(),
+                "updatedAt": self._now(),
+                "claimedBy": None,
+                "claimExpiry": None
+            }
+            self._pending.append(job_id)
+            self._queued_at[job_id] = time.monotonic()
+            self._condition.notify_all()
+            
+        return job_id
+        
+    def claim(
+        self,
+        colab_id: str,
+        wait: float = 0,
+        max_jobs: int = 1,
+        warm_projects: Optional[List[Dict[str, Any]]] = None
+    ) -> list:
+        """
+        Claim up to max_jobs pending jobs, waiting up to `wait` seconds for one
+        
+        Args:
+            colab_id: Claiming agent
+            wait: Long-poll wait in seconds
+            max_jobs: Most jobs to hand out
+            warm_projects: The agent's warm projects (routing hint)
+        """
+        with self._condition:
+            self.claim_requests += 1
+            if warm_projects is not None:
+                self.agents[colab_id] = {
+                    "projects": {
+                        project["projectId"]: affinity_score(project)
+                        for project in warm_projects
+                        if project.get("projectId")
+                    },
+                    "seen": time.monotonic()
+                }
+                
+            self._requeue_expired()
+            
+            # Re-check now and then: held jobs become claimable by waiting
+            deadline = time.monotonic() + min(wait, MAX_CLAIM_WAIT)
+            picked = self._select(colab_id, max_jobs)
+            while not picked and not self._stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(min(remaining, 1.0))
+                picked = self._select(colab_id, max_jobs)
+                
+            claimed = []
+            for job_id in picked:
+                self._pending.remove(job_id)
+                job = self.jobs[job_id]
+                job["state"] = "claimed"
+                job["claimedBy"] = colab_id
+                job["claimExpiry"] = self._expiry()
+                job["updatedAt"] = self._now()
+                claimed.append(dict(job))
+                
+            return claimed
+            
+    def _select(self, colab_id: str, max_jobs: int) -> List[str]:
+        """Pick pending jobs for an agent, warmest projects first, then oldest"""
+        now = time.monotonic()
+        mine = self.agents.get(colab_id, {}).get("projects", {})
+        others = [
+            agent["projects"] for agent_id, agent in self.agents.items()
+            if agent_id != colab_id and now - agent["seen"] < self.affinity_ttl
+        ]
+        
+        ranked = sorted(
+            enumerate(self._pending),
+            key=lambda item: (-mine.get(self.jobs[item[1]]["projectId"], 0), item[0])
+        )
+        
+        picked = []
+        for _, job_id in ranked:
+            project_id = self.jobs[job_id]["projectId"]
+            score = mine.get(project_id, 0)
+            
+            held = now - self._queued_at.get(job_id, now) < self.affinity_max_wait
+            if held and any(projects.get(project_id, 0) > score for projects in others):
+                continue
+                
+            picked.append(job_id)
+            if len(picked) >= max_jobs:
+                break
+                
+        return picked
+        
+    def renew(self, job_id: str, colab_id: str, progress: Optional[Dict[str, Any]] = None) -> tuple:
+        """Extend a claim and store the reported progress; returns (status code, response body)"""
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if not job:
+                return 404, self._error("JOB_NOT_FOUND", f"Job {job_id} not found")
+                
+            if job["state"] not in ("claimed", "running") or job["claimedBy"] != colab_id:
+                return 409, self._error("NOT_CLAIMED", f"Job {job_id} is not claimed by {colab_id}")
+                
+            job["claimExpiry"] = self._expiry()
+            if progress:
+                job["progress"] = progress
+            return 200, dict(job)
+            
+    def release(self, job_id: str, colab_id: str) -> tuple:
+        """Put a claimed job that has not started back at the front of the queue"""
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if not job:
+                return 404, self._error("JOB_NOT_FOUND", f"Job {job_id} not found")
+                
+            if job["state"] != "claimed" or job["claimedBy"] != colab_id:
+                return 409, self._error("NOT_CLAIMED", f"Job {job_id} is not claimed by {colab_id}")
+                
+            self._unclaim(job)
+            self._pending.appendleft(job_id)
+            self._condition.notify_all()
+            return 200, dict(job)
+            
+    def _requeue_expired(self):
+        """Put claimed jobs whose lease ran out back in the queue"""
+        now = self._now()
+        for job_id, job in self.jobs.items():
+            if job["state"] == "claimed" and job["claimExpiry"] and job["claimExpiry"] < now:
+                self._unclaim(job)
+                self._pending.appendleft(job_id)
+                
+    def _unclaim(self, job: Dict[str, Any]):
+        job["state"] = "pending"
+        job["claimedBy"] = None
+        job["claimExpiry"] = None
+        job["updatedAt"] = self._now()
+        
+    def _expiry(self) -> str:
+        return (datetime.utcnow() + timedelta(seconds=self.lease_ttl)).isoformat() + "Z"
+        
+    def update(self, job_id: str, body: Dict[str, Any]) -> tuple:
+        """Apply a state update; returns (status code, response body)"""
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if not job:
+                return 404, self._error("JOB_NOT_FOUND", f"Job {job_id} not found")
+                
+            state = body.get("state")
+            if not state:
+                return 400, self._error("INVALID_INPUT", "state is required")
+                
+            if state not in VALID_TRANSITIONS.get(job["state"], []):
+                return 400, self._error(
+                    "INVALID_STATE_TRANSITION",
+                    f"Cannot transition from {job['state']} to {state}"
+                )
+                
+            job["state"] = state
+            job["updatedAt"] = self._now()
+            for key in ("result", "error"):
+                if key in body:
+                    job[key] = body[key]
+                    
+            return 200, dict(job)
+            
+    @staticmethod
+    def _now() -> str:
+        return datetime.utcnow().isoformat() + "Z"
+        
+    @staticmethod
+    def _error(code: str, message: str) -> Dict[str, Any]:
+        return {"error": True, "code": code, "message": message}
+        
+    def _make_handler(self):
+        backend = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(f"Local backend: {format % args}")
+                
+            def _send(self, status: int, body: Dict[str, Any]):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                
+            def _read_body(self) -> Dict[str, Any]:
+                length = int(self.headers.get("Content-Length") or 0)
+                if not length:
+                    return {}
+                return json.loads(self.rfile.read(length) or b"{}")
+                
+            def _authorized(self) -> bool:
+                if backend.claim_secret and self.headers.get("X-Colab-Secret") != backend.claim_secret:
+                    self._send(401, backend._error("UNAUTHORIZED", "Invalid Colab credentials"))
+                    return False
+                return True
+                
+            def do_POST(self):
+                url = urlparse(self.path)
+                parts = url.path.strip("/").split("/")
+                colab_id = self.headers.get("X-Colab-Id", "")
+                
+                if len(parts) == 4 and parts[:2] == ["api", "jobs"] and parts[3] in ("lease", "release"):
+                    if not self._authorized():
+                        return
+                        
+                    if parts[3] == "release":
+                        self._send(*backend.release(parts[2], colab_id))
+                        return
+                        
+                    try:
+                        body = self._read_body()
+                    except ValueError:
+                        self._send(400, backend._error("INVALID_INPUT", "Invalid JSON body"))
+                        return
+                        
+                    self._send(*backend.renew(parts[2], colab_id, body.get("progress")))
+                    return
+                    
+                if url.path != "/api/jobs/claim":
+                    self._send(404, backend._error("NOT_FOUND", "Not found"))
+                    return
+                    
+                if not self._authorized():
+                    return
+                    
+                query = parse_qs(url.query)
+                try:
+                    wait = float(query.get("wait", ["0"])[0])
+                    max_jobs = int(query.get("max", ["1"])[0])
+                    body = self._read_body()
+                except ValueError:
+                    self._send(400, backend._error("INVALID_INPUT", "Invalid wait, max or body"))
+                    return
+                    
+                jobs = backend.claim(colab_id, wait, max(1, max_jobs), body.get("warmProjects"))
+                claim_token = f"local-{uuid.uuid4().hex}" if jobs else None
+                
+                if "max" in query:
+                    self._send(200, {"jobs": jobs, "claimToken": claim_token})
+                elif jobs:
+                    self._send(200, {"job": jobs[0], "claimToken": claim_token})
+                else:
+                    self._send(200, {"job": None})
+                    
+            def do_PATCH(self):
+                parts = urlparse(self.path).path.strip("/").split("/")
+                if len(parts) != 3 or parts[:2] != ["api", "jobs"]:
+                    self._send(404, backend._error("NOT_FOUND", "Not found"))
+                    return
+                    
+                if not self._authorized():
+                    return
+                    
+                try:
+                    body = self._read_body()
+                except ValueError:
+                    self._send(400, backend._error("INVALID_INPUT", "Invalid JSON body"))
+                    return
+                    
+                self._send(*backend.update(parts[2], body))
+                
+        return Handler
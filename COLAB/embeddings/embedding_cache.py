@@ -0,0 +1,215 @@
+import re
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+from config.settings import settings
+from utils.logger import logger
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed embedding cache
+    
+    Vectors live in a fixed-capacity memory-mapped float32 file, one slot
+    per entry. Each slot also records the SHA256 of the text it holds, so
+    a slot is only trusted if its key matches. Least recently used
+    entries are evicted once the cache is full.
+    """
+    
+    KEY_SIZE = 32
+    
+    def __init__(
+        self,
+        model_name: str,
+        dimension: int,
+        max_entries: int = None,
+        cache_dir: Path = None
+    ):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.capacity = max_entries or settings.EMBEDDING_CACHE_MAX_ENTRIES
+        self.cache_dir = (cache_dir or settings.MODELS_DIR / "embedding_cache") / self._safe_name(model_name)
+        self.vectors_path = self.cache_dir / "vectors.f32"
+        self.keys_path = self.cache_dir / "keys.bin"
+        self.lru_path = self.cache_dir / "lru.npy"
+        
+        self._vectors: Optional[np.memmap] = None
+        self._keys: Optional[np.memmap] = None
+        self._slots: "OrderedDict[bytes, int]" = OrderedDict()
+        self._free: List[int] = []
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        
+        self._open()
+        
+    @staticmethod
+    def make_key(text: str) -> bytes:
+        """Get cache key for a text"""
+        return hashlib.sha256(text.encode('utf-8')).digest()
+        
+    def get_many(self, keys: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Look up cached embeddings
+        
+        Args:
+            keys: Cache keys from make_key()
+            
+        Returns:
+            Tuple of (vectors N x dimension, boolean hit mask)
+        """
+        vectors = np.zeros((len(keys), self.dimension), dtype='float32')
+        hit_mask = np.zeros(len(keys), dtype=bool)
+        
+        with self._lock:
+            for i, key in enumerate(keys):
+                slot = self._slots.get(key)
+                if slot is None or bytes(self._keys[slot]) != key:
+                    continue
+                    
+                vectors[i] = self._vectors[slot]
+                hit_mask[i] = True
+                self._slots.move_to_end(key)
+                
+            hits = int(hit_mask.sum())
+            self.hits += hits
+            self.misses += len(keys) - hits
+            self._dirty = self._dirty or hits > 0
+            
+        return vectors, hit_mask
+        
+    def put_many(self, keys: List[bytes], vectors: np.ndarray):
+        """Store embeddings, evicting least recently used entries if full"""
+        if len(keys) != len(vectors):
+            raise ValueError("Key count must match vector count")
+            
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                slot = self._slots.get(key)
+                
+                if slot is None:
+                    slot = self._allocate_slot()
+                    self._slots[key] = slot
+                else:
+                    self._slots.move_to_end(key)
+                    
+                self._vectors[slot] = vector
+                self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                
+            self._dirty = True
+            
+    def flush(self) -> bool:
+        """Persist vectors and LRU order to disk"""
+        with self._lock:
+            if not self._dirty:
+                return True
+                
+            try:
+                self._vectors.flush()
+                self._keys.flush()
+                
+                # Slots in LRU order, least recently used first
+                order = np.fromiter(self._slots.values(), dtype=np.int64, count=len(self._slots))
+                tmp_path = self.lru_path.with_suffix(".tmp.npy")
+                np.save(tmp_path, order)
+                tmp_path.replace(self.lru_path)
+                
+                self._dirty = False
+                return True
+                
+            except Exception as e:
+                logger.warning(f"Failed to flush embedding cache: {str(e)}")
+                return False
+                
+    def get_stats(self) -> Dict[str, int]:
+        """Get cache statistics"""
+        with self._lock:
+            return {
+                "entries": len(self._slots),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+        
+    def _allocate_slot(self) -> int:
+        """Get a free slot, evicting the least recently used entry if needed"""
+        if self._free:
+            return self._free.pop()
+            
+        _, slot = self._slots.popitem(last=False)
+        return slot
+        
+    def _open(self):
+        """Open or create the memory-mapped store"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        
+        vectors_bytes = self.capacity * self.dimension * 4
+        reset = (
+            not self.vectors_path.exists()
+            or self.vectors_path.stat().st_size != vectors_bytes
+            or not self.keys_path.exists()
+        )
+        
+        if reset:
+            # Capacity or dimension changed - start over
+            for path in [self.vectors_path, self.keys_path, self.lru_path]:
+                path.unlink(missing_ok=True)
+                
+        mode = 'w+' if reset else 'r+'
+        self._vectors = np.memmap(
+            self.vectors_path,
+            dtype='float32',
+            mode=mode,
+            shape=(self.capacity, self.dimension)
+        )
+        self._keys = np.memmap(
+            self.keys_path,
+            dtype=np.uint8,
+            mode=mode,
+            shape=(self.capacity, self.KEY_SIZE)
+        )
+        
+        if not reset and self.lru_path.exists():
+            try:
+                for slot in np.load(self.lru_path):
+                    self._slots[bytes(self._keys[slot])] = int(slot)
+            except Exception as e:
+                logger.warning(f"Embedding cache index unreadable, starting empty: {str(e)}")
+                self._slots.clear()
+                
+        used = set(self._slots.values())
+        self._free = [s for s in range(self.capacity - 1, -1, -1) if s not in used]
+        
+        logger.info(
+            "Embedding cache opened",
+            meta={
+                "model": self.model_name,
+                "entries": len(self._slots),
+                "capacity": self.capacity
+            }
+        )
+        
+    @staticmethod
+    def _safe_name(model_name: str) -> str:
+        """Turn a model name into a directory name"""
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)
+
+# Cache instances per model
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+def get_embedding_cache(model_name: str, dimension: int) -> EmbeddingCache:
+    """
+    Get or create embedding cache for model
+    
+    Concurrent indexing jobs share one instance; two would map the
+    same files and overwrite each other's slots.
+    """
+    key = f"{model_name}:{dimension}"
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(model_name, dimension)
+        return _caches[key]
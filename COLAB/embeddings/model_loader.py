@@ -1,8 +1,16 @@
-from sentence_transformers import SentenceTransformer
-from typing import List, Optional, Any
+import time
+import threading
+from typing import List, Optional, Any, Iterable, Iterator, Tuple, TYPE_CHECKING
 import numpy as np
 from config.settings import settings
 from utils.logger import logger
+from embeddings.embedding_cache import EmbeddingCache, get_embedding_cache
+from embeddings.onnx_backend import OnnxEncoder, QUALITY_PROBES, compare_embeddings
+from utils.pipeline import prefetch, batched
+from utils.lru import LRUCache
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 class EmbeddingModel:
     """Wrapper for local embedding models"""
@@ -18,15 +26,22 @@ class EmbeddingModel:
     
     def __init__(self, model_name: str = None):
         self.model_name = model_name or settings.DEFAULT_EMBEDDING_MODEL
-        self.model: Optional[SentenceTransformer] = None
+        self.model: Optional["SentenceTransformer"] = None
         self.dimension: int = 0
         self._loaded = False
+        self._token_batching = False
+        self.backend = "torch"
+        self._onnx: Optional[OnnxEncoder] = None
         
     def load(self) -> bool:
         """Load embedding model"""
         try:
             logger.info(f"Loading embedding model: {self.model_name}")
             
+            # Imported here: sentence-transformers pulls in torch, which
+            # takes seconds and is not needed by jobs that never embed
+            from sentence_transformers import SentenceTransformer
+            
             # Resolve model path
             if self.model_name in self.MODELS:
                 model_path = self.MODELS[self.model_name]
@@ -42,16 +57,27 @@ class EmbeddingModel:
             # Get embedding dimension
             self.dimension = self.model.get_sentence_embedding_dimension()
             
-            # Warm up model with dummy input
-            _ = self.model.encode(["test"], show_progress_bar=False)
+            # Length bucketing needs a fast tokenizer for batched tokenization
+            tokenizer = getattr(self.model, "tokenizer", None)
+            self._token_batching = (
+                settings.EMBEDDING_TOKEN_BATCHING
+                and getattr(tokenizer, "is_fast", False)
+            )
             
             self._loaded = True
             
+            self._load_backend(model_path)
+            
+            # Warm up model with dummy input
+            self._warm_up()
+            
             logger.info(
                 f"Model loaded successfully",
                 meta={
                     "model": self.model_name,
-                    "dimension": self.dimension
+                    "dimension": self.dimension,
+                    "token_batching": self._token_batching,
+                    "backend": self.backend
                 }
             )
             
@@ -61,6 +87,81 @@ class EmbeddingModel:
             logger.error(f"Failed to load model: {str(e)}")
             return False
             
+    def _load_backend(self, model_path: str):
+        """
+        Switch inference to ONNX Runtime if configured
+        
+        The ONNX copy is checked against the PyTorch model on a few probe
+        texts; if the lowest cosine similarity is below
+        EMBEDDING_ONNX_MIN_COSINE the PyTorch model is kept, so vectors
+        stay compatible with existing indexes.
+        """
+        backend = settings.EMBEDDING_BACKEND
+        if backend == "auto":
+            backend = "torch" if self.model.device.type == "cuda" else "onnx-int8"
+            
+        if backend == "torch":
+            return
+            
+        if backend not in ("onnx", "onnx-int8"):
+            logger.warning(f"Unknown embedding backend {backend}, using torch")
+            return
+            
+        if not self._token_batching:
+            logger.warning("ONNX backend needs token batching with a fast tokenizer, using torch")
+            return
+            
+        try:
+            encoder = OnnxEncoder.from_sentence_transformer(
+                self.model,
+                model_path,
+                quantize=backend == "onnx-int8"
+            )
+            
+            reference = self.encode(QUALITY_PROBES)
+            self._onnx = encoder
+            candidate = self.encode(QUALITY_PROBES)
+            
+            similarity = compare_embeddings(reference, candidate)
+            if similarity < settings.EMBEDDING_ONNX_MIN_COSINE:
+                self._onnx = None
+                logger.warning(
+                    f"ONNX embeddings differ from the PyTorch model, using torch",
+                    meta={"backend": backend, "min_cosine": similarity}
+                )
+                return
+                
+            self.backend = backend
+            logger.info(
+                f"Using ONNX embedding backend",
+                meta={"backend": backend, "min_cosine": similarity}
+            )
+            
+        except Exception as e:
+            self._onnx = None
+            logger.warning(f"ONNX backend unavailable, using torch: {str(e)}")
+            
+    def _warm_up(self):
+        """
+        Encode a dummy input, dropping to plain torch batches if
+        token-bucketed encoding fails
+        
+        This runs before the model encodes anything else, so the cache
+        tag (and the index state built from it) already reflects the
+        fallback. encode() itself never switches backends.
+        """
+        try:
+            self.encode(["test"])
+        except Exception as e:
+            if not self._token_batching:
+                raise
+                
+            logger.warning(f"Token-bucketed encoding failed, using plain batches: {str(e)}")
+            self._token_batching = False
+            self._onnx = None
+            self.backend = "torch"
+            self.encode(["test"])
+            
     def encode(
         self,
         texts: List[str],
@@ -84,6 +185,11 @@ class EmbeddingModel:
         batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
         
         try:
+            # No fallback here: vectors of another backend or truncation
+            # mode would be mixed into indexes built with this one
+            if self._token_batching:
+                return self._encode_bucketed(texts, batch_size)
+                
             embeddings = self.model.encode(
                 texts,
                 batch_size=batch_size,
@@ -98,6 +204,103 @@ class EmbeddingModel:
             logger.error(f"Encoding failed: {str(e)}")
             raise
             
+    def _encode_bucketed(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """
+        Encode texts in length-sorted buckets
+        
+        Texts are tokenized once and truncated by real token count. They
+        are then sorted by length so each batch is padded only to its own
+        longest member, and batches are sized by a padded-token budget of
+        batch_size * max tokens, so short chunks share large batches.
+        Results are returned in the original order.
+        """
+        tokenizer = self.model.tokenizer
+        max_tokens = self.get_max_tokens()
+        
+        input_ids = tokenizer(
+            texts,
+            add_special_tokens=True,
+            truncation=True,
+            max_length=max_tokens,
+            return_attention_mask=False,
+            return_token_type_ids=False
+        )["input_ids"]
+        
+        order = sorted(range(len(texts)), key=lambda i: len(input_ids[i]), reverse=True)
+        token_budget = batch_size * max_tokens
+        pad_id = tokenizer.pad_token_id or 0
+        pad_left = getattr(tokenizer, "padding_side", "right") == "left"
+        
+        embeddings = np.zeros((len(texts), self.dimension), dtype='float32')
+        start = 0
+        
+        while start < len(order):
+            # Longest first, so the first sequence sets the padded width
+            width = max(1, len(input_ids[order[start]]))
+            size = max(1, min(len(order) - start, token_budget // width))
+            batch = order[start:start + size]
+            
+            ids = np.full((len(batch), width), pad_id, dtype=np.int64)
+            mask = np.zeros((len(batch), width), dtype=np.int64)
+            for row, i in enumerate(batch):
+                seq = input_ids[i]
+                cols = slice(width - len(seq), width) if pad_left else slice(0, len(seq))
+                ids[row, cols] = seq
+                mask[row, cols] = 1
+                
+            output = self._forward(ids, mask)
+            
+            # L2 normalization
+            norms = np.linalg.norm(output, axis=1, keepdims=True)
+            embeddings[batch] = output / np.maximum(norms, 1e-12)
+            start += size
+            
+        return embeddings
+        
+    def _forward(self, ids: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """Run one padded batch through the active backend"""
+        if self._onnx is not None:
+            return self._onnx.run(ids, mask)
+            
+        import torch
+        
+        with torch.inference_mode():
+            features = {
+                "input_ids": torch.from_numpy(ids).to(self.model.device),
+                "attention_mask": torch.from_numpy(mask).to(self.model.device)
+            }
+            output = self.model(features)["sentence_embedding"]
+            return output.float().cpu().numpy()
+            
+    def clip_texts(self, texts: List[str]) -> List[str]:
+        """
+        Cap text length before encoding
+        
+        With token batching the tokenizer truncates by real token count,
+        so this only bounds tokenizer work on huge inputs. Otherwise texts
+        are cut at roughly 4 characters per token.
+        """
+        chars_per_token = 16 if self._token_batching else 4
+        max_chars = self.get_max_tokens() * chars_per_token
+        return [text[:max_chars] if len(text) > max_chars else text for text in texts]
+        
+    def get_cache_tag(self) -> str:
+        """Get a prefix that distinguishes cached embeddings by truncation mode and backend"""
+        tag = ""
+        if self.backend == "onnx-int8":
+            # Quantized vectors are close to, but not the same as, fp32 ones
+            tag = "int8:"
+        if self._token_batching:
+            tag += f"tokens:{self.get_max_tokens()}\n"
+        return tag
+        
+    def get_max_tokens(self) -> int:
+        """Get the token limit applied to each text"""
+        model_limit = getattr(self.model, "max_seq_length", None) if self.model else None
+        if model_limit:
+            return min(settings.EMBEDDING_MAX_LENGTH, model_limit)
+        return settings.EMBEDDING_MAX_LENGTH
+        
     def encode_single(self, text: str) -> np.ndarray:
         """Encode single text"""
         return self.encode([text])[0]
@@ -113,13 +316,30 @@ class EmbeddingModel:
     def get_model_name(self) -> str:
         """Get model name"""
         return self.model_name
+        
+    def get_backend(self) -> str:
+        """Get the inference backend in use ("torch", "onnx" or "onnx-int8")"""
+        return self.backend
 
 class BatchEmbedder:
     """Batch embedding generator with progress tracking"""
     
-    def __init__(self, model: EmbeddingModel):
+    def __init__(self, model: EmbeddingModel, use_cache: bool = None):
         self.model = model
         
+        if use_cache is None:
+            use_cache = settings.EMBEDDING_CACHE_ENABLED
+            
+        self.cache: Optional[EmbeddingCache] = None
+        if use_cache:
+            try:
+                self.cache = get_embedding_cache(
+                    model.get_model_name(),
+                    model.get_dimension()
+                )
+            except Exception as e:
+                logger.warning(f"Embedding cache unavailable: {str(e)}")
+                
     def embed_chunks(
         self,
         chunks: List[Any],
@@ -140,22 +360,8 @@ class BatchEmbedder:
             
         logger.info(f"Generating embeddings for {len(chunks)} chunks")
         
-        # Extract text from chunks
-        texts = [chunk.tokens for chunk in chunks]
-        
-        # Truncate if needed
-        max_length = settings.EMBEDDING_MAX_LENGTH
-        texts = [
-            text[:max_length * 4] if len(text) > max_length * 4 else text
-            for text in texts
-        ]
-        
-        # Generate embeddings
-        embeddings = self.model.encode(
-            texts,
-            batch_size=batch_size,
-            show_progress=True
-        )
+        hits_before = self.cache.hits if self.cache else 0
+        embeddings = self._embed(chunks, batch_size, show_progress=True)
         
         logger.info(
             f"Embeddings generated",
@@ -165,21 +371,190 @@ class BatchEmbedder:
             }
         )
         
+        if self.cache:
+            self.cache.flush()
+            hits = self.cache.hits - hits_before
+            logger.info(
+                f"Embedding cache: {hits} hits, {len(chunks) - hits} misses",
+                meta=self.cache.get_stats()
+            )
+            
+        return embeddings
+        
+    def embed_stream(
+        self,
+        chunks: Iterable[Any],
+        batch_size: int = None
+    ) -> Iterator[Tuple[List[Any], np.ndarray]]:
+        """
+        Embed a stream of chunks in fixed-size batches
+        
+        Chunks are pulled from the source in a background thread behind a
+        bounded queue, so chunking the next batch overlaps with embedding
+        the current one while only a few batches are ever held in memory.
+        
+        Args:
+            chunks: Iterable of Chunk objects (e.g. CodeChunker.iter_chunks)
+            batch_size: Model batch size
+            
+        Yields:
+            Tuples of (chunk batch, embeddings for that batch)
+        """
+        total = 0
+        hits_before = self.cache.hits if self.cache else 0
+        
+        batches = prefetch(
+            batched(chunks, settings.INDEXING_BATCH_SIZE),
+            settings.INDEXING_QUEUE_BATCHES
+        )
+        
+        last_flush = time.monotonic()
+        
+        try:
+            for batch in batches:
+                embeddings = self._embed(batch, batch_size)
+                total += len(batch)
+                
+                # Persist progress so an interrupted run re-uses what was embedded
+                if self.cache and time.monotonic() - last_flush >= settings.EMBEDDING_CACHE_FLUSH_INTERVAL:
+                    self.cache.flush()
+                    last_flush = time.monotonic()
+                    
+                yield batch, embeddings
+        finally:
+            if self.cache:
+                self.cache.flush()
+                
+        hits = self.cache.hits - hits_before if self.cache else 0
+        logger.info(
+            f"Streamed embeddings for {total} chunks",
+            meta={"cache_hits": hits, "computed": total - hits}
+        )
+        
+    def _embed(
+        self,
+        chunks: List[Any],
+        batch_size: int = None,
+        show_progress: bool = False
+    ) -> np.ndarray:
+        """Embed chunk texts, sending only cache misses to the model"""
+        return self.embed_texts([chunk.tokens for chunk in chunks], batch_size, show_progress)
+        
+    def embed_texts(
+        self,
+        texts: List[str],
+        batch_size: int = None,
+        show_progress: bool = False
+    ) -> np.ndarray:
+        """Embed chunk texts the way chunks are embedded (clipped, cached)"""
+        texts = self.model.clip_texts(texts)
+        
+        if not self.cache:
+            return self.model.encode(texts, batch_size=batch_size, show_progress=show_progress)
+            
+        tag = self.model.get_cache_tag()
+        keys = [EmbeddingCache.make_key(tag + text) for text in texts]
+        embeddings, hit_mask = self.cache.get_many(keys)
+        
+        misses = np.flatnonzero(~hit_mask)
+        if len(misses) > 0:
+            computed = self.model.encode(
+                [texts[i] for i in misses],
+                batch_size=batch_size,
+                show_progress=show_progress
+            )
+            embeddings[misses] = computed
+            self.cache.put_many([keys[i] for i in misses], computed)
+            
         return embeddings
         
     def embed_query(self, query: str) -> np.ndarray:
         """Generate embedding for search query"""
-        return self.model.encode_single(query)
+        return self.embed_queries([query])[0]
+        
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Generate embeddings for several search queries in one batch
+        
+        Query embeddings are kept in an in-memory LRU keyed by model and
+        whitespace-normalized text, so repeated chat turns skip the model.
+        """
+        if not queries:
+            return np.zeros((0, self.model.get_dimension()), dtype='float32')
+            
+        prefix = f"{self.model.get_model_name()}\n{self.model.get_cache_tag()}"
+        keys = [prefix + " ".join(query.split()) for query in queries]
+        
+        embeddings = np.zeros((len(queries), self.model.get_dimension()), dtype='float32')
+        misses = []
+        for i, key in enumerate(keys):
+            cached = _query_cache.get(key)
+            if cached is None:
+                misses.append(i)
+            else:
+                embeddings[i] = cached
+                
+        if misses:
+            computed = self.model.encode([queries[i] for i in misses])
+            for i, vector in zip(misses, computed):
+                embeddings[i] = vector
+                _query_cache.put(keys[i], vector.copy())
+                
+        return embeddings
+
+# Query embeddings shared by all BatchEmbedders
+_query_cache = LRUCache(max_items=settings.QUERY_CACHE_MAX_ENTRIES)
 
 # Global model instance (lazy loaded)
 _embedding_model: Optional[EmbeddingModel] = None
+_model_lock = threading.Lock()
+_warmup_thread: Optional[threading.Thread] = None
 
 def get_embedding_model(model_name: str = None) -> EmbeddingModel:
-    """Get or create global embedding model"""
+    """
+    Get or create global embedding model
+    
+    If a background warm-up is loading the model, this waits for it
+    instead of loading a second copy. A model that failed to load is
+    returned but not kept, so the next call tries again.
+    """
     global _embedding_model
     
-    if _embedding_model is None:
-        _embedding_model = EmbeddingModel(model_name)
-        _embedding_model.load()
+    if _embedding_model is not None:
+        return _embedding_model
+        
+    if _warmup_thread is not None and _warmup_thread.is_alive() and _warmup_thread is not threading.current_thread():
+        logger.info("Waiting for embedding model warm-up")
         
-    return _embedding_model
+    with _model_lock:
+        if _embedding_model is not None:
+            return _embedding_model
+            
+        model = EmbeddingModel(model_name)
+        if model.load():
+            _embedding_model = model
+        return model
+        
+def start_model_warmup(model_name: str = None) -> threading.Thread:
+    """
+    Download, load and warm up the global embedding model in the background
+    
+    Lets the agent authenticate and start polling straight away; only
+    jobs that need embeddings wait in get_embedding_model().
+    """
+    global _warmup_thread
+    
+    if _warmup_thread is None or not _warmup_thread.is_alive():
+        _warmup_thread = threading.Thread(
+            target=get_embedding_model,
+            args=(model_name,),
+            name="embedding-warmup",
+            daemon=True
+        )
+        _warmup_thread.start()
+        
+    return _warmup_thread
+
+def is_embedding_model_ready() -> bool:
+    """Check if the global embedding model is loaded"""
+    return _embedding_model is not None
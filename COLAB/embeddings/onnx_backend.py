@@ -0,0 +1,139 @@
+import os
+import numpy as np
+from pathlib import Path
+from typing import Any
+from config.settings import settings
+from utils.logger import logger
+
+# Code-like probe texts used to compare ONNX output with the PyTorch model
+QUALITY_PROBES = [
+    "class MainActivity : AppCompatActivity() {",
+    "override fun onCreate(savedInstanceState: Bundle?) { super.onCreate(savedInstanceState) }",
+    "val button = findViewById<Button>(R.id.login_button)",
+    "public void onClick(View v) { startActivity(new Intent(this, SettingsActivity.class)); }",
+    "implementation 'androidx.recyclerview:recyclerview:1.3.2'",
+    "<TextView android:id=\"@+id/title\" android:layout_width=\"match_parent\" />",
+    "private fun loadUsers() = viewModelScope.launch { repository.fetchUsers() }",
+    "Fix the crash when the login screen rotates"
+]
+
+class OnnxEncoder:
+    """
+    Sentence encoder running an exported model through onnxruntime
+    
+    The whole SentenceTransformer pipeline (transformer plus pooling) is
+    exported as one graph taking input_ids and attention_mask, so its
+    output matches the PyTorch model and vectors stay compatible with
+    existing indexes. The graph can be dynamically quantized to int8,
+    which is typically 2-4x faster on CPU.
+    """
+    
+    def __init__(self, model_path: Path, quantized: bool):
+        import onnxruntime as ort
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = settings.EMBEDDING_ONNX_THREADS or os.cpu_count() or 1
+        options.inter_op_num_threads = 1
+        
+        self.model_path = model_path
+        self.quantized = quantized
+        self.session = ort.InferenceSession(
+            str(model_path),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        
+    @classmethod
+    def from_sentence_transformer(
+        cls,
+        model: Any,
+        model_name: str,
+        quantize: bool
+    ) -> "OnnxEncoder":
+        """
+        Export (once) and load an ONNX copy of a SentenceTransformer
+        
+        Args:
+            model: Loaded SentenceTransformer
+            model_name: Model name or path, used to name the export directory
+            quantize: Use a dynamic int8 quantized copy
+        """
+        export_dir = settings.MODELS_DIR / "onnx" / model_name.strip("/").replace("/", "--")
+        fp32_path = export_dir / "model.onnx"
+        int8_path = export_dir / "model.int8.onnx"
+        
+        if not fp32_path.exists():
+            export_dir.mkdir(parents=True, exist_ok=True)
+            cls._export(model, fp32_path)
+            
+        if quantize and not int8_path.exists():
+            cls._quantize(fp32_path, int8_path)
+            
+        return cls(int8_path if quantize else fp32_path, quantize)
+        
+    @staticmethod
+    def _export(model: Any, path: Path):
+        """Export the full SentenceTransformer pipeline to ONNX"""
+        import torch
+        
+        class SentenceEmbedding(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+                
+            def forward(self, input_ids, attention_mask):
+                features = {"input_ids": input_ids, "attention_mask": attention_mask}
+                return self.model(features)["sentence_embedding"]
+                
+        logger.info(f"Exporting embedding model to ONNX", meta={"path": str(path)})
+        
+        device = model.device
+        wrapper = SentenceEmbedding(model).to("cpu").eval()
+        sample = torch.ones((2, 8), dtype=torch.long)
+        tmp_path = path.with_suffix(".tmp")
+        
+        with torch.inference_mode():
+            torch.onnx.export(
+                wrapper,
+                (sample, sample),
+                str(tmp_path),
+                input_names=["input_ids", "attention_mask"],
+                output_names=["sentence_embedding"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "sentence_embedding": {0: "batch"}
+                },
+                opset_version=17,
+                dynamo=False
+            )
+            
+        tmp_path.replace(path)
+        
+        # Export runs on CPU; put the PyTorch model back where it was
+        model.to(device)
+        
+    @staticmethod
+    def _quantize(fp32_path: Path, int8_path: Path):
+        """Dynamically quantize weights to int8"""
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        
+        logger.info(f"Quantizing ONNX embedding model to int8", meta={"path": str(int8_path)})
+        
+        tmp_path = int8_path.with_suffix(".tmp")
+        quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QInt8)
+        tmp_path.replace(int8_path)
+        
+    def run(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """Get unnormalized sentence embeddings for a padded batch"""
+        return self.session.run(
+            None,
+            {"input_ids": input_ids, "attention_mask": attention_mask}
+        )[0]
+
+def compare_embeddings(reference: np.ndarray, candidate: np.ndarray) -> float:
+    """Get the lowest cosine similarity between matching rows"""
+    reference = reference / np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+    candidate = candidate / np.maximum(np.linalg.norm(candidate, axis=1, keepdims=True), 1e-12)
+    return float(np.min(np.sum(reference * candidate, axis=1)))
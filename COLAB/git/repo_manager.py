@@ -1,6 +1,6 @@
 import git
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Set
 from config.settings import settings
 from config.secrets import secret_manager
 from utils.logger import logger
@@ -138,6 +138,51 @@ class RepoManager:
             return self.repo.head.commit.hexsha
         return None
         
+    def get_changed_files(self, since_commit: str) -> Optional[Set[str]]:
+        """
+        Get files changed between a commit and the working tree
+        
+        Covers committed, uncommitted and untracked changes, including
+        deletions. Paths are relative to the repository root.
+        
+        Args:
+            since_commit: Commit SHA to diff against
+            
+        Returns:
+            Set of changed paths, or None if the commit is not available
+            (e.g. outside a shallow clone's history)
+        """
+        if not self.repo or not since_commit:
+            return None
+            
+        try:
+            self.repo.commit(since_commit)
+        except Exception:
+            logger.info(f"Commit not in local history: {since_commit[:12]}")
+            return None
+            
+        try:
+            # NUL-separated: paths with spaces or non-ASCII characters are not quoted
+            diff_output = self.repo.git.diff(
+                "--name-only",
+                "--no-renames",
+                "-z",
+                since_commit
+            )
+            
+            changed = set(path for path in diff_output.split("\0") if path)
+            changed.update(self.repo.untracked_files)
+            
+            return changed
+            
+        except Exception as e:
+            logger.warning(f"Failed to diff against {since_commit[:12]}: {str(e)}")
+            return None
+            
+    def get_dirty_files(self) -> Set[str]:
+        """Get files that differ from HEAD in the working tree"""
+        return self.get_changed_files(self.get_latest_commit()) or set()
+        
     def _configure_git(self):
         """Configure Git user"""
         try:
@@ -167,4 +212,9 @@ def get_repo_manager(project_id: str, repo_url: str) -> RepoManager:
         manager = RepoManager(project_id, repo_url)
         _repos[project_id] = manager
         
-    return _repos[project_id]
\ No newline at end of file
+    return _repos[project_id]
+
+def is_repo_cached(project_id: str) -> bool:
+    """Check if a project's repository is already open"""
+    manager = _repos.get(project_id)
+    return manager is not None and manager.is_initialized()
\ No newline at end of file
@@ -1,6 +1,7 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from config.settings import settings
 from utils.logger import logger
+from llm.tokenizer import token_counter, TOKENS_PER_MESSAGE
 
 class PromptBuilder:
     """Build retrieval-augmented prompts for LLM"""
@@ -27,8 +28,15 @@ Format your response as:
 // modified code
 </after>"""
     
+    TRUNCATION_MARKER = "... (truncated)"
+    
     def __init__(self):
         self.max_tokens = settings.MAX_CONTEXT_TOKENS
+        self.counter = token_counter
+        
+    def get_prompt_budget(self) -> int:
+        """Get tokens available for the prompt, leaving room for the response"""
+        return self.max_tokens - settings.LLM_MAX_TOKENS
         
     def build_prompt(
         self,
@@ -40,9 +48,14 @@ Format your response as:
         """
         Build complete prompt with RAG context
         
+        The prompt is kept within MAX_CONTEXT_TOKENS minus LLM_MAX_TOKENS.
+        The system prompt and the request always go in; chat history gets
+        up to PROMPT_HISTORY_MAX_TOKENS of what is left, and retrieved
+        chunks fill the rest in rank order.
+        
         Args:
             user_message: User's request
-            retrieved_chunks: List of (chunk_metadata, distance) tuples
+            retrieved_chunks: List of (chunk_metadata, score) tuples, best first
             chat_history: Recent chat messages
             project_config: Project configuration from mrx-config.json
             
@@ -63,28 +76,46 @@ Format your response as:
             "content": system_content
         })
         
-        # Add chat history (summarized if too long)
+        budget = self.get_prompt_budget()
+        request = self._format_request(user_message)
+        used = self._estimate_tokens(messages) + self.counter.count(request) + TOKENS_PER_MESSAGE
+        
+        # Add chat history (most recent first, within its share of the budget)
         if chat_history:
-            history_content = self._format_chat_history(chat_history)
+            intro = "Previous conversation context:\n"
+            history_budget = min(settings.PROMPT_HISTORY_MAX_TOKENS, budget - used)
+            history_budget -= self.counter.count(intro) + TOKENS_PER_MESSAGE
+            history_content = self._format_chat_history(chat_history, history_budget)
             if history_content:
+                content = f"{intro}{history_content}"
                 messages.append({
                     "role": "user",
-                    "content": f"Previous conversation context:\n{history_content}"
+                    "content": content
                 })
+                used += self.counter.count(content) + TOKENS_PER_MESSAGE
         
         # Build user message with retrieved context
-        user_content = self._build_user_message(user_message, retrieved_chunks)
+        user_content, packing = self._build_user_message(
+            user_message,
+            retrieved_chunks,
+            budget - used
+        )
         
         messages.append({
             "role": "user",
             "content": user_content
         })
         
-        # Estimate and log token count
+        # Count and log prompt tokens
         estimated_tokens = self._estimate_tokens(messages)
         logger.info(
             "Prompt built",
-            meta={"estimated_tokens": estimated_tokens}
+            meta={
+                "estimated_tokens": estimated_tokens,
+                "budget": budget,
+                "exact": self.counter.is_exact(),
+                **packing
+            }
         )
         
         return messages
@@ -104,67 +135,96 @@ Format your response as:
             
         return "\n".join(parts)
         
-    def _format_chat_history(self, history: List[Dict]) -> str:
-        """Format and optionally summarize chat history"""
-        # Take last N messages to stay within token budget
-        max_history = 5
-        recent = history[-max_history:] if len(history) > max_history else history
+    def _format_chat_history(self, history: List[Dict], max_tokens: int) -> str:
+        """Format the most recent chat messages that fit in max_tokens"""
+        recent = history[-settings.PROMPT_HISTORY_MESSAGES:]
         
         formatted = []
-        for msg in recent:
+        remaining = max_tokens
+        
+        # Newest first, so the latest turns survive a tight budget
+        for msg in reversed(recent):
             role = msg.get("role", "user")
-            content = msg.get("content", "")
+            line = f"{role}: {msg.get('content', '')}"
             
-            # Truncate long messages
-            if len(content) > 500:
-                content = content[:500] + "..."
+            cost = self.counter.count(line) + 1
+            if cost > remaining:
+                trimmed = self.counter.trim_to_tokens(line, remaining - self.counter.count("...") - 1)
+                if len(trimmed) > len(role) + 2:
+                    formatted.append(trimmed + "...")
+                break
                 
-            formatted.append(f"{role}: {content}")
+            formatted.append(line)
+            remaining -= cost
             
-        return "\n".join(formatted)
+        return "\n".join(reversed(formatted))
+        
+    def _format_request(self, message: str) -> str:
+        return f"\nUser Request:\n{message}"
         
     def _build_user_message(
         self,
         message: str,
-        chunks: List[tuple]
-    ) -> str:
-        """Build user message with retrieved code context"""
+        chunks: List[tuple],
+        max_tokens: int
+    ) -> Tuple[str, Dict[str, int]]:
+        """
+        Build user message with retrieved code context
+        
+        Chunks are packed greedily in rank order. One that does not fit is
+        cut at a line boundary if at least PROMPT_MIN_CHUNK_TOKENS of it
+        would fit, and skipped otherwise.
+        
+        Returns:
+            (message content, packing stats)
+        """
         parts = []
+        stats = {"chunks_included": 0, "chunks_trimmed": 0, "chunks_dropped": 0}
         
-        # Add retrieved code context
-        if chunks:
-            parts.append("Relevant code from the project:\n")
+        intro = "Relevant code from the project:\n"
+        remaining = max_tokens - self.counter.count(intro) - 1
+        marker_tokens = self.counter.count(self.TRUNCATION_MARKER) + 1
+        
+        for metadata, _ in chunks or []:
+            header = (
+                f"\n--- Chunk {stats['chunks_included'] + 1} ---\n"
+                f"File: {metadata.get('path', 'unknown')}\n"
+                f"Type: {metadata.get('nodeType', 'code')}\n"
+                f"Line: {metadata.get('startLine', 0)}\n"
+                f"```\n"
+            )
+            footer = "\n```\n"
+            code = metadata.get("tokens", "")
             
-            for i, (metadata, distance) in enumerate(chunks, 1):
-                path = metadata.get("path", "unknown")
-                node_type = metadata.get("nodeType", "code")
-                start_line = metadata.get("startLine", 0)
-                tokens = metadata.get("tokens", "")
-                
-                # Truncate very long chunks
-                if len(tokens) > 1000:
-                    tokens = tokens[:1000] + "\n... (truncated)"
+            overhead = self.counter.count(header) + self.counter.count(footer) + 1
+            cost = overhead + self.counter.count(code)
+            
+            if cost > remaining:
+                room = remaining - overhead - marker_tokens
+                code = self.counter.trim_to_tokens(code, room) if room >= settings.PROMPT_MIN_CHUNK_TOKENS else ""
+                if not code:
+                    stats["chunks_dropped"] += 1
+                    continue
                     
-                parts.append(
-                    f"\n--- Chunk {i} ---\n"
-                    f"File: {path}\n"
-                    f"Type: {node_type}\n"
-                    f"Line: {start_line}\n"
-                    f"```\n{tokens}\n```\n"
-                )
+                code = f"{code}\n{self.TRUNCATION_MARKER}"
+                cost = overhead + self.counter.count(code)
+                stats["chunks_trimmed"] += 1
+                
+            parts.append(f"{header}{code}{footer}")
+            remaining -= cost
+            stats["chunks_included"] += 1
+            
+        if parts:
+            parts.insert(0, intro)
         
         # Add user's actual request
-        parts.append(f"\nUser Request:\n{message}")
+        parts.append(self._format_request(message))
         
-        return "\n".join(parts)
+        return "\n".join(parts), stats
         
     def _estimate_tokens(self, messages: List[Dict]) -> int:
-        """Rough token estimation (1 token ≈ 4 characters)"""
-        total_chars = sum(
-            len(msg.get("content", ""))
-            for msg in messages
-        )
-        return total_chars // 4
+        """Count prompt tokens (estimated if tiktoken is unavailable)"""
+        return self.counter.count_messages(messages)
         
     def build_error_fix_prompt(
         self,
@@ -0,0 +1,115 @@
+import re
+import math
+import hashlib
+from typing import List, Dict
+from config.settings import settings
+from utils.logger import logger
+from utils.lru import LRUCache
+
+# Fallback estimate: words, numbers and single punctuation marks, with
+# long words costing about one token per 4 characters as in BPE vocabularies
+ESTIMATE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Chat formatting overhead per message (role, separators)
+TOKENS_PER_MESSAGE = 4
+
+class TokenCounter:
+    """
+    Count LLM tokens with tiktoken, or estimate them without it
+    
+    Counts for longer texts (retrieved chunks, history) are cached by
+    content hash, since the same chunks come back turn after turn.
+    """
+    
+    # Texts shorter than this are cheaper to count than to hash and cache
+    CACHE_MIN_CHARS = 256
+    
+    def __init__(self, encoding_name: str = None):
+        self.encoding_name = encoding_name or settings.PROMPT_TOKENIZER
+        self._encoding = None
+        self._loaded = False
+        self._cache = LRUCache(max_items=settings.PROMPT_TOKEN_CACHE_SIZE)
+        
+    def _get_encoding(self):
+        """Load the tiktoken encoding on first use"""
+        if not self._loaded:
+            self._loaded = True
+            try:
+                import tiktoken
+                self._encoding = tiktoken.get_encoding(self.encoding_name)
+            except Exception as e:
+                logger.warning(f"tiktoken unavailable, estimating token counts: {str(e)}")
+                self._encoding = None
+                
+        return self._encoding
+        
+    def is_exact(self) -> bool:
+        """Check if counts come from the real tokenizer"""
+        return self._get_encoding() is not None
+        
+    def count(self, text: str) -> int:
+        """Count tokens in text"""
+        if not text:
+            return 0
+            
+        if len(text) < self.CACHE_MIN_CHARS:
+            return self._count(text)
+            
+        key = hashlib.sha1(text.encode('utf-8', errors='replace')).digest()
+        tokens = self._cache.get(key)
+        if tokens is None:
+            tokens = self._count(text)
+            self._cache.put(key, tokens)
+        return tokens
+        
+    def _count(self, text: str) -> int:
+        encoding = self._get_encoding()
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+            
+        return sum(
+            max(1, math.ceil(len(word) / 4))
+            for word in ESTIMATE_PATTERN.findall(text)
+        )
+        
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        """Count tokens of a chat prompt, including per-message overhead"""
+        return sum(
+            self.count(msg.get("content", "")) + TOKENS_PER_MESSAGE
+            for msg in messages
+        ) + 3
+        
+    def trim_to_tokens(self, text: str, max_tokens: int) -> str:
+        """
+        Keep the longest prefix of whole lines that fits in max_tokens
+        
+        If not even the first line fits, whole words of it are kept
+        instead. Returns an empty string if nothing fits.
+        """
+        kept = []
+        used = 0
+        
+        lines = text.split("\n")
+        for line in lines:
+            # Each line also costs its newline
+            cost = self._count(line) + 1
+            if used + cost > max_tokens:
+                break
+            kept.append(line)
+            used += cost
+            
+        if kept or not lines:
+            return "\n".join(kept)
+            
+        words = []
+        for word in lines[0].split(" "):
+            cost = self._count(word) + 1
+            if used + cost > max_tokens:
+                break
+            words.append(word)
+            used += cost
+            
+        return " ".join(words)
+
+# Global token counter
+token_counter = TokenCounter()
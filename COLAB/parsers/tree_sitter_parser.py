@@ -1,14 +1,28 @@
-from tree_sitter_languages import get_parser
-from typing import List, Dict, Any, Optional
+import threading
+from tree_sitter_languages import get_parser, get_language
+from typing import List, Dict, Any, Optional, Tuple, Iterable
 from pathlib import Path
+from config.settings import settings
 from utils.logger import logger
+from utils.lru import LRUCache
+
+class CachedTree:
+    """Parsed tree together with the source and file state it came from"""
+    
+    def __init__(self, tree: Any, source: bytes, mtime_ns: int, size: int):
+        self.tree = tree
+        self.source = source
+        self.mtime_ns = mtime_ns
+        self.size = size
 
 class TreeSitterParser:
     """Base Tree-Sitter parser for code analysis"""
     
     def __init__(self):
-        self.parsers = {}
         self.languages = {}
+        self._local = threading.local()
+        self._queries: Dict[Tuple[str, frozenset], Any] = {}
+        self._trees = LRUCache(max_items=settings.TREE_CACHE_MAX_FILES)
         self._init_parsers()
         
     def _init_parsers(self):
@@ -26,10 +40,18 @@ class TreeSitterParser:
             raise
             
     def get_parser(self, language: str):
-        """Get parser for specified language"""
+        """Get this thread's pooled parser for specified language"""
         if language not in self.languages:
             raise ValueError(f"Unsupported language: {language}")
-        return get_parser(language)
+            
+        parsers = getattr(self._local, 'parsers', None)
+        if parsers is None:
+            parsers = self._local.parsers = {}
+            
+        if language not in parsers:
+            parsers[language] = get_parser(language)
+            
+        return parsers[language]
         
     def parse_file(self, file_path: Path, language: str) -> Optional[Any]:
         """
@@ -42,37 +64,184 @@ class TreeSitterParser:
         Returns:
             Tree-sitter tree object or None
         """
+        return self.parse_path(file_path, language)[0]
+        
+    def parse_path(
+        self,
+        file_path: Path,
+        language: str
+    ) -> Tuple[Optional[Any], Optional[bytes]]:
+        """
+        Parse file, reusing the cached tree when possible
+        
+        An unchanged file (same mtime and size) returns the cached tree
+        without being read. A changed file is re-parsed incrementally
+        from its previous tree.
+        
+        Args:
+            file_path: Path to source file
+            language: Language identifier (java, kotlin, xml)
+            
+        Returns:
+            Tuple of (tree or None, source bytes or None)
+        """
+        key = (str(file_path), language)
+        
         try:
+            stat = file_path.stat()
+            cached = self._trees.get(key)
+            
+            if (
+                cached is not None
+                and cached.mtime_ns == stat.st_mtime_ns
+                and cached.size == stat.st_size
+            ):
+                return cached.tree, cached.source
+                
             # Read file content
             with open(file_path, 'rb') as f:
                 content = f.read()
                 
+        except Exception as e:
+            logger.error(
+                f"Failed to parse file: {file_path}",
+                meta={"error": str(e)}
+            )
+            return None, None
+            
+        # Take the old tree out of the cache before editing it
+        old = self._trees.pop(key)
+        
+        if old is not None and old.source == content:
+            # Touched but not modified
+            tree = old.tree
+        else:
+            old_tree = None
+            if old is not None and self._apply_edit(old.tree, old.source, content):
+                old_tree = old.tree
+                
+            tree = self.parse_bytes(content, language, old_tree)
+            
+        if tree is not None:
+            self._trees.put(
+                key,
+                CachedTree(tree, content, stat.st_mtime_ns, stat.st_size)
+            )
+            
+        return tree, content
+        
+    def parse_bytes(
+        self,
+        content: bytes,
+        language: str,
+        old_tree: Any = None
+    ) -> Optional[Any]:
+        """
+        Parse source that has already been read
+        
+        Args:
+            content: Source file bytes
+            language: Language identifier (java, kotlin, xml)
+            old_tree: Previous tree, already edited, for incremental parsing
+            
+        Returns:
+            Tree-sitter tree object or None
+        """
+        try:
             # Get parser
-            parser = get_parser(language)
+            parser = self.get_parser(language)
             
             # Parse
-            tree = parser.parse(content)
-            
+            if old_tree is not None:
+                tree = parser.parse(content, old_tree)
+            else:
+                tree = parser.parse(content)
+                
             return tree
             
         except Exception as e:
             logger.error(
-                f"Failed to parse file: {file_path}",
+                f"Failed to parse source ({language})",
                 meta={"error": str(e)}
             )
             return None
             
+    def _apply_edit(self, tree: Any, old_source: bytes, new_source: bytes) -> bool:
+        """
+        Describe the change between two versions of a file as one edit
+        
+        The edited region spans from the first differing byte to the
+        last differing byte, which covers any patch to a single file.
+        """
+        try:
+            shortest = min(len(old_source), len(new_source))
+            
+            start = self._match_length(
+                lambda n: old_source[:n] == new_source[:n],
+                shortest
+            )
+            suffix = self._match_length(
+                lambda n: old_source[len(old_source) - n:] == new_source[len(new_source) - n:],
+                shortest - start
+            )
+            
+            old_end = len(old_source) - suffix
+            new_end = len(new_source) - suffix
+            
+            tree.edit(
+                start_byte=start,
+                old_end_byte=old_end,
+                new_end_byte=new_end,
+                start_point=self._byte_to_point(old_source, start),
+                old_end_point=self._byte_to_point(old_source, old_end),
+                new_end_point=self._byte_to_point(new_source, new_end)
+            )
+            
+            return True
+            
+        except Exception as e:
+            logger.debug(f"Incremental edit failed, parsing from scratch: {str(e)}")
+            return False
+            
+    @staticmethod
+    def _match_length(matches, limit: int) -> int:
+        """Binary search the longest length n <= limit where matches(n)"""
+        low, high = 0, limit
+        while low < high:
+            mid = (low + high + 1) // 2
+            if matches(mid):
+                low = mid
+            else:
+                high = mid - 1
+        return low
+        
+    @staticmethod
+    def _byte_to_point(source: bytes, offset: int) -> Tuple[int, int]:
+        """Convert a byte offset to a tree-sitter (row, column) point"""
+        row = source.count(b'\n', 0, offset)
+        line_start = source.rfind(b'\n', 0, offset) + 1
+        return (row, offset - line_start)
+        
+    def clear_tree_cache(self):
+        """Drop all cached trees"""
+        self._trees.clear()
+        
     def extract_nodes(
         self,
         tree,
-        node_types: List[str]
+        node_types: Iterable[str],
+        language: str = None
     ) -> List[Any]:
         """
         Extract nodes of specific types from AST
         
+        Nodes are returned in document order, outer nodes before the
+        nodes nested inside them.
+        
         Args:
             tree: Tree-sitter tree
-            node_types: List of node type names to extract
+            node_types: Node type names to extract
+            language: Language of the tree; enables a precompiled query
             
         Returns:
             List of matching nodes
@@ -80,16 +249,70 @@ class TreeSitterParser:
         if not tree:
             return []
             
+        node_types = frozenset(node_types)
+        
+        if language:
+            query = self._get_query(language, node_types)
+            if query is not None:
+                return [node for node, _ in query.captures(tree.root_node)]
+                
+        return self._walk_nodes(tree, node_types)
+        
+    def _walk_nodes(self, tree, node_types: frozenset) -> List[Any]:
+        """Iterative pre-order walk with a tree cursor"""
         nodes = []
+        cursor = tree.walk()
         
-        def traverse(node):
+        while True:
+            node = cursor.node
             if node.type in node_types:
                 nodes.append(node)
-            for child in node.children:
-                traverse(child)
                 
-        traverse(tree.root_node)
-        return nodes
+            if cursor.goto_first_child():
+                continue
+                
+            while not cursor.goto_next_sibling():
+                if not cursor.goto_parent():
+                    return nodes
+                    
+    def _get_query(self, language: str, node_types: frozenset) -> Optional[Any]:
+        """Get a cached query capturing every node of the given types"""
+        key = (language, node_types)
+        
+        if key not in self._queries:
+            self._queries[key] = self._compile_query(language, node_types)
+            
+        return self._queries[key]
+        
+    def _compile_query(self, language: str, node_types: frozenset) -> Optional[Any]:
+        """Compile a query, skipping node types the grammar doesn't know"""
+        try:
+            ts_language = get_language(language)
+        except Exception as e:
+            logger.debug(f"No query support for {language}: {str(e)}")
+            return None
+            
+        try:
+            return ts_language.query(
+                " ".join(f"({node_type}) @node" for node_type in sorted(node_types))
+            )
+        except Exception:
+            pass
+            
+        valid_types = []
+        for node_type in sorted(node_types):
+            try:
+                ts_language.query(f"({node_type}) @node")
+                valid_types.append(node_type)
+            except Exception:
+                logger.debug(f"Unknown node type for {language}: {node_type}")
+                
+        if not valid_types:
+            return None
+            
+        return ts_language.query(
+            " ".join(f"({node_type}) @node" for node_type in valid_types)
+        )
         
     def get_node_text(self, node, source_bytes: bytes) -> str:
         """Get text content of a node"""
@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Modules import each other from the agent root, as in the notebook
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config.settings import settings
+
+@pytest.fixture(autouse=True)
+def agent_dirs(tmp_path, monkeypatch):
+    """Keep workspaces, indexes and job journals of a test in its tmp_path"""
+    monkeypatch.setattr(settings, "WORKSPACE_DIR", tmp_path / "workspace")
+    monkeypatch.setattr(settings, "FAISS_DIR", tmp_path / "faiss")
+    monkeypatch.setattr(settings, "CHECKPOINT_DIR", tmp_path / "checkpoints")
+    return tmp_path
@@ -0,0 +1,37 @@
+import threading
+
+import numpy as np
+
+from config.settings import settings
+from embeddings import embedding_cache
+from embeddings.embedding_cache import EmbeddingCache, get_embedding_cache
+
+def test_concurrent_jobs_share_one_cache(agent_dirs, monkeypatch):
+    monkeypatch.setattr(settings, "MODELS_DIR", agent_dirs / "models")
+    monkeypatch.setattr(settings, "EMBEDDING_CACHE_MAX_ENTRIES", 1000)
+    monkeypatch.setattr(embedding_cache, "_caches", {})
+    barrier = threading.Barrier(8)
+    caches = []
+    found = []
+    
+    def worker(n: int):
+        barrier.wait()
+        cache = get_embedding_cache("test-model", 8)
+        caches.append(cache)
+        
+        texts = [f"text {n} {i}" for i in range(100)]
+        keys = [EmbeddingCache.make_key(text) for text in texts]
+        cache.put_many(keys, np.full((100, 8), n, dtype='float32'))
+        
+        vectors, hits = cache.get_many(keys)
+        found.append(bool(hits.all()) and bool((vectors == n).all()))
+        
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+        
+    assert found == [True] * 8
+    assert all(cache is caches[0] for cache in caches)
+    assert caches[0].get_stats()["entries"] == 800
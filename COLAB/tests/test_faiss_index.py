@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from config.settings import settings
+from vector.faiss_manager import FAISSIndex, select_index_config
+
+@pytest.fixture
+def small_tiers(monkeypatch):
+    """Put the flat tier boundary at ~1000 vectors for 32 dimensions"""
+    monkeypatch.setattr(settings, "FAISS_INDEX_TYPE", "auto")
+    monkeypatch.setattr(settings, "FAISS_AUTO_FLAT_MAX_VECTORS", 84)
+    monkeypatch.setattr(settings, "FAISS_MIN_TRAIN_VECTORS", 500)
+    monkeypatch.setattr(settings, "LEXICAL_INDEX_ENABLED", False)
+
+def corpus(n: int, d: int = 32):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((n, d)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    chunk_ids = [f"{i:016x}" for i in range(1, n + 1)]
+    metadata = [
+        {
+            "chunkId": chunk_id,
+            "projectId": "p1",
+            "path": f"src/F{i % 7}.kt",
+            "nodeType": "function",
+            "startLine": i,
+            "endLine": i + 1,
+            "tokens": f"fun f{i}()",
+            "metadata": {"language": "kotlin", "nodeType": "function"},
+            "timestamp": None
+        }
+        for i, chunk_id in enumerate(chunk_ids)
+    ]
+    return chunk_ids, vectors, metadata
+
+def test_auto_tiers_above_flat_remove_in_place():
+    for n in (100_000, 10_000_000):
+        index_type, _ = select_index_config(n, 384)
+        assert index_type in ("ivf_flat", "ivf_pq")
+
+def test_removing_from_auto_selected_index_does_not_rebuild(small_tiers, monkeypatch):
+    chunk_ids, vectors, metadata = corpus(3000)
+    index = FAISSIndex("p1", 32)
+    assert index.create_index()
+    assert index.upsert(chunk_ids, vectors, metadata)
+    assert index.retune()
+    assert index.index_type == "ivf_flat"
+    assert not index.is_staging()
+    
+    def rebuild(ids):
+        raise AssertionError("index rebuilt to remove vectors")
+        
+    monkeypatch.setattr(index, "_rebuild_without", rebuild)
+    removed = chunk_ids[10:15]
+    
+    assert index.remove(removed) == 5
+    assert index.index.ntotal == 2995
+    
+    # Replacing a chunk removes its old vector the same way
+    assert index.upsert(chunk_ids[:1], vectors[1:2], metadata[:1])
+    assert index.index.ntotal == 2995
+    
+    for i in range(10, 15):
+        hits = index.search(vectors[i], 5)
+        assert all(meta["chunkId"] not in removed for meta, _ in hits)
+    assert index.search(vectors[20], 1)[0][0]["chunkId"] == chunk_ids[20]
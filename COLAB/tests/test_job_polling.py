@@ -0,0 +1,403 @@
+import signal
+import threading
+import time
+
+import pytest
+
+from config.settings import settings
+from core.job_manager import ClaimBackoff, JobLostError, JobManager
+from core.local_backend import LocalBackend
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    """Shrink the polling waits so a test runs in about a second"""
+    monkeypatch.setattr(settings, "CLAIM_BACKOFF_MIN", 0.05)
+    monkeypatch.setattr(settings, "CLAIM_BACKOFF_JITTER", 0)
+    monkeypatch.setattr(settings, "CLAIM_LONG_POLL", 0)
+    monkeypatch.setattr(settings, "HEARTBEAT_INTERVAL", 0.2)
+
+@pytest.fixture
+def make_backend():
+    """Start LocalBackends on free ports; stopped after the test"""
+    backends = []
+    
+    def make(**kwargs) -> LocalBackend:
+        backend = LocalBackend(**kwargs)
+        backend.start()
+        backends.append(backend)
+        return backend
+        
+    yield make
+    
+    for backend in backends:
+        backend.stop()
+
+@pytest.fixture
+def backend(make_backend):
+    return make_backend()
+
+def make_manager(backend: LocalBackend, colab_id: str = "agent-1", warm=None) -> JobManager:
+    manager = JobManager()
+    manager.backend_url = backend.url
+    manager.colab_id = colab_id
+    manager.claim_secret = ""
+    if warm is not None:
+        manager.affinity = lambda: warm
+    return manager
+
+def run_poll_loop(manager: JobManager, callback, until, timeout: float = 10, **kwargs) -> bool:
+    """
+    Run manager.poll_loop on this thread until `until()` holds
+    
+    The loop is stopped with SIGINT, the way a notebook interrupt stops
+    it. A real signal also wakes a claim held open by a long-poll.
+    Returns whether `until()` held before the timeout.
+    """
+    finished = threading.Event()
+    lock = threading.Lock()
+    main_thread = threading.main_thread().ident
+    
+    def watch():
+        deadline = time.monotonic() + timeout
+        while not finished.is_set() and not until() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        with lock:
+            if not finished.is_set():
+                signal.pthread_kill(main_thread, signal.SIGINT)
+                
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+    try:
+        manager.poll_loop(callback, **kwargs)
+    finally:
+        with lock:
+            finished.set()
+    watcher.join()
+    
+    return until()
+
+def completed(backend: LocalBackend, *job_ids):
+    return lambda: all(backend.jobs[job_id]["state"] == "completed" for job_id in job_ids)
+
+def test_claim_backoff_doubles_up_to_max_and_resets():
+    backoff = ClaimBackoff(1, 8, jitter=0)
+    
+    assert [backoff.next_delay() for _ in range(6)] == [1, 2, 4, 8, 8, 8]
+    backoff.reset()
+    assert backoff.next_delay() == 1
+
+def test_long_poll_starts_job_queued_while_claim_is_held(monkeypatch, backend):
+    monkeypatch.setattr(settings, "CLAIM_LONG_POLL", 5)
+    manager = make_manager(backend)
+    queued = {}
+    started = {}
+    
+    def enqueue():
+        queued["time"] = time.monotonic()
+        queued["id"] = backend.enqueue("p1", "chat")
+        
+    def callback(job):
+        started[job.id] = time.monotonic()
+        manager.mark_completed(job.id, {"ok": True})
+        
+    threading.Timer(0.5, enqueue).start()
+    assert run_poll_loop(
+        manager, callback,
+        until=lambda: "id" in queued and completed(backend, queued["id"])(),
+        interval=1, workers=2
+    )
+    
+    # Handed over by the held claim, not by a later poll
+    assert started[queued["id"]] - queued["time"] < 0.3
+    assert backend.claim_requests <= 3
+
+def test_idle_claims_back_off_and_reset_after_a_job(backend):
+    manager = make_manager(backend)
+    jobs = {}
+    idle = {}
+    
+    def scenario():
+        time.sleep(1.5)
+        idle["requests"] = backend.claim_requests
+        jobs["first"] = backend.enqueue("p1", "chat")
+        while backend.jobs[jobs["first"]]["state"] != "completed":
+            time.sleep(0.01)
+        jobs["queued"] = time.monotonic()
+        jobs["second"] = backend.enqueue("p2", "chat")
+        
+    def callback(job):
+        jobs[job.id] = time.monotonic()
+        manager.mark_completed(job.id, {"ok": True})
+        
+    threading.Thread(target=scenario, daemon=True).start()
+    assert run_poll_loop(
+        manager, callback,
+        until=lambda: "second" in jobs and completed(backend, jobs["second"])(),
+        interval=0.8, workers=1
+    )
+    
+    # 0.05 + 0.1 + 0.2 + 0.4 + 0.8 seconds apart instead of every 0.05
+    assert idle["requests"] <= 7
+    # The first job reset the backoff, so the second waits at most ~0.2s
+    assert jobs[jobs["second"]] - jobs["queued"] < 0.45
+
+def test_claims_take_several_jobs_per_request(monkeypatch, backend):
+    monkeypatch.setattr(settings, "JOB_CLAIM_BATCH", 4)
+    monkeypatch.setattr(settings, "JOB_PREFETCH", 2)
+    for index in range(4):
+        backend.enqueue(f"p{index}", "chat")
+        
+    manager = make_manager(backend, "agent-batch")
+    claimed = manager.claim_jobs(4)
+    
+    assert len(claimed) == 4
+    assert backend.claim_requests == 1
+    assert all(backend.jobs[job.id]["claimedBy"] == "agent-batch" for job in claimed)
+    assert all(0 < job.lease_expires - time.time() <= backend.lease_ttl for job in claimed)
+    
+    # The polling loop fills workers + prefetch slots in as few requests
+    batches = []
+    claim = backend.claim
+    
+    def counting_claim(*args, **kwargs):
+        jobs = claim(*args, **kwargs)
+        if jobs:
+            batches.append(len(jobs))
+        return jobs
+        
+    backend.claim = counting_claim
+    job_ids = [backend.enqueue(f"q{index}", "chat") for index in range(8)]
+    
+    poller = make_manager(backend, "agent-poll")
+    
+    def callback(job):
+        time.sleep(0.1)
+        poller.mark_completed(job.id, {"ok": True})
+        
+    assert run_poll_loop(poller, callback, until=completed(backend, *job_ids), interval=0.2, workers=2)
+    
+    assert sum(batches) == 8
+    assert batches[0] == 4
+    assert len(batches) < 8
+
+def test_expired_claim_is_requeued_for_another_agent(make_backend):
+    backend = make_backend(lease_ttl=0.3)
+    job_id = backend.enqueue("p1", "chat")
+    
+    crashed = make_manager(backend, "agent-crashed")
+    assert [job.id for job in crashed.claim_jobs(1)] == [job_id]
+    time.sleep(0.5)
+    
+    manager = make_manager(backend, "agent-2")
+    ran = []
+    
+    def callback(job):
+        ran.append(job.id)
+        manager.mark_completed(job.id, {"ok": True})
+        
+    assert run_poll_loop(manager, callback, until=completed(backend, job_id), interval=0.2, workers=2)
+    assert ran == [job_id]
+    assert backend.jobs[job_id]["claimedBy"] == "agent-2"
+
+def test_waiting_jobs_keep_their_claims(monkeypatch, make_backend):
+    # The third build waits longer than the lease for the Gradle slot
+    backend = make_backend(lease_ttl=1.0)
+    monkeypatch.setattr(settings, "LEASE_RENEW_MARGIN", 0.6)
+    monkeypatch.setattr(settings, "JOB_PREFETCH", 2)
+    job_ids = [backend.enqueue(f"p{index}", "build-only") for index in range(3)]
+    
+    manager = make_manager(backend)
+    other = make_manager(backend, "agent-2")
+    ran = []
+    stolen = []
+    
+    def callback(job):
+        ran.append(job.id)
+        time.sleep(0.6)
+        manager.mark_completed(job.id, {"ok": True})
+        
+    def steal():
+        time.sleep(1.4)
+        stolen.extend(job.id for job in other.claim_jobs(4))
+        
+    threading.Thread(target=steal, daemon=True).start()
+    assert run_poll_loop(manager, callback, until=completed(backend, *job_ids), interval=0.2, workers=3)
+    
+    assert sorted(ran) == sorted(job_ids)
+    assert stolen == []
+
+def test_job_is_held_for_the_agent_that_has_its_project_warm(make_backend):
+    backend = make_backend(affinity_max_wait=1.0)
+    warm = make_manager(backend, "agent-warm", warm=[{"projectId": "pA", "repo": True, "index": True}])
+    
+    # Advertise pA; the warm agent gets its jobs first
+    assert warm.claim_jobs(1) == []
+    backend.enqueue("pB", "chat")
+    warm_job = backend.enqueue("pA", "chat")
+    assert [job.id for job in warm.claim_jobs(1)] == [warm_job]
+    
+    held_job = backend.enqueue("pA", "chat")
+    queued = time.monotonic()
+    cold_job = backend.enqueue("pC", "chat")
+    
+    manager = make_manager(backend, "agent-cold")
+    started = {}
+    
+    def callback(job):
+        started[job.id] = time.monotonic()
+        manager.mark_completed(job.id, {"ok": True})
+        
+    assert run_poll_loop(
+        manager, callback,
+        until=completed(backend, held_job, cold_job),
+        interval=0.2, workers=2, affinity=lambda: []
+    )
+    
+    # pC right away, pA only once the warm agent had its chance
+    assert started[cold_job] < started[held_job]
+    assert started[held_job] - queued >= 0.9
+
+def test_concurrency_groups_and_projects_limit_parallel_jobs(monkeypatch, backend):
+    monkeypatch.setattr(settings, "JOB_PREFETCH", 2)
+    jobs = [
+        ("p1", "build-only"), ("p2", "build-and-patch"), ("p3", "build-only"),
+        ("p1", "chat"), ("p4", "chat"), ("p4", "chat"), ("p5", "chat"), ("p6", "index-update")
+    ]
+    job_ids = [backend.enqueue(project_id, job_type) for project_id, job_type in jobs]
+    
+    manager = make_manager(backend)
+    lock = threading.Lock()
+    running = {}
+    peak = {"all": 0, "gradle": 0}
+    overlap = []
+    
+    def callback(job):
+        group = manager.get_concurrency_group(job.type)
+        with lock:
+            if any(other.project_id == job.project_id for other in running.values()):
+                overlap.append(job.id)
+            running[job.id] = job
+            builds = sum(1 for other in running.values() if manager.get_concurrency_group(other.type) == "gradle")
+            peak["gradle"] = max(peak["gradle"], builds)
+            peak["all"] = max(peak["all"], len(running))
+            
+        time.sleep(0.2 if group == "gradle" else 0.1)
+        
+        with lock:
+            running.pop(job.id)
+        manager.mark_completed(job.id, {"ok": True})
+        
+    assert run_poll_loop(manager, callback, until=completed(backend, *job_ids), interval=0.2, workers=4)
+    
+    assert peak["gradle"] == 1
+    assert peak["all"] > 1
+    assert overlap == []
+    assert not manager.active_jobs
+
+def test_stopping_returns_prefetched_jobs(monkeypatch, backend):
+    monkeypatch.setattr(settings, "JOB_PREFETCH", 2)
+    job_ids = [backend.enqueue(f"p{index}", "build-only") for index in range(3)]
+    manager = make_manager(backend)
+    started = []
+    
+    def callback(job):
+        started.append(job.id)
+        time.sleep(0.3)
+        manager.mark_completed(job.id, {"ok": True})
+        
+    # Stop while one build runs and the other two wait for the Gradle slot
+    run_poll_loop(manager, callback, until=lambda: bool(started), interval=0.2, workers=2)
+    
+    waiting = [job_id for job_id in job_ids if job_id not in started]
+    assert len(started) == 1
+    assert backend.jobs[started[0]]["state"] == "completed"
+    assert all(backend.jobs[job_id]["state"] == "pending" for job_id in waiting)
+    assert not manager.active_jobs
+    
+    other = make_manager(backend, "agent-2")
+    assert sorted(job.id for job in other.claim_jobs(4)) == sorted(waiting)
+
+def test_prefetched_jobs_the_backend_refuses_are_left_to_expire(monkeypatch, make_backend):
+    backend = make_backend(lease_ttl=0.5)
+    monkeypatch.setattr(settings, "JOB_PREFETCH", 2)
+    job_ids = [backend.enqueue(f"p{index}", "build-only") for index in range(3)]
+    manager = make_manager(backend)
+    monkeypatch.setattr(manager, "return_job", lambda job_id: False)
+    started = []
+    
+    def callback(job):
+        started.append(job.id)
+        time.sleep(0.3)
+        manager.mark_completed(job.id, {"ok": True})
+        
+    run_poll_loop(manager, callback, until=lambda: bool(started), interval=0.2, workers=2)
+    
+    waiting = [job_id for job_id in job_ids if job_id not in started]
+    assert len(waiting) == 2
+    assert all(backend.jobs[job_id]["state"] == "claimed" for job_id in waiting)
+    assert not manager.active_jobs
+    
+    time.sleep(0.6)
+    other = make_manager(backend, "agent-2")
+    assert sorted(job.id for job in other.claim_jobs(4)) == sorted(waiting)
+
+def claim_data(backend: LocalBackend, job_id: str) -> dict:
+    job = backend.jobs[job_id]
+    return {key: job[key] for key in ("jobId", "projectId", "type", "payload", "createdAt")}
+
+def test_resume_skips_jobs_another_agent_took_over(backend):
+    taken = backend.enqueue("p1", "chat")
+    mine = backend.enqueue("p2", "chat")
+    
+    # Both were running here when the agent died; one lease ran out meanwhile
+    crashed = make_manager(backend)
+    for job in crashed.claim_jobs(2):
+        crashed.mark_running(job.id)
+        crashed.journal.start(job.to_claim_data())
+    backend.jobs[taken]["claimedBy"] = "agent-2"
+    
+    manager = make_manager(backend)
+    ran = []
+    
+    def callback(job):
+        ran.append(job.id)
+        manager.mark_completed(job.id, {"ok": True})
+        
+    assert run_poll_loop(manager, callback, until=completed(backend, mine), interval=0.2, workers=2)
+    
+    assert ran == [mine]
+    assert backend.jobs[taken]["state"] == "running"
+    assert [job["jobId"] for job in manager.journal.unfinished()] == []
+
+def test_job_stops_when_its_claim_is_lost(backend):
+    job_id = backend.enqueue("p1", "chat")
+    manager = make_manager(backend)
+    stopped = []
+    
+    def callback(job):
+        started = time.monotonic()
+        try:
+            while time.monotonic() - started < 3:
+                manager.report_progress(job.id, "indexing")
+                if time.monotonic() - started > 0.1:
+                    # The lease ran out and the backend handed the job on
+                    backend.jobs[job.id]["claimedBy"] = "agent-2"
+                time.sleep(0.05)
+        except JobLostError:
+            # Like the notebook's handler; the failure must not reach the backend
+            reported = manager.mark_failed(job.id, "stopped")
+            stopped.append((time.monotonic() - started, reported))
+            return
+        manager.mark_completed(job.id, {"ok": True})
+        
+    assert run_poll_loop(
+        manager, callback,
+        until=lambda: bool(stopped) and not manager.active_jobs,
+        interval=0.2, workers=2
+    )
+    
+    elapsed, reported = stopped[0]
+    assert elapsed < 1
+    assert not reported
+    assert backend.jobs[job_id]["state"] == "running"
+    assert "error" not in backend.jobs[job_id]
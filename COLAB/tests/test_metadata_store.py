@@ -0,0 +1,56 @@
+from config.settings import settings
+from vector.metadata_store import MetadataStore
+
+def chunk(key: int, text: str) -> dict:
+    return {
+        "chunkId": f"{key:016x}",
+        "projectId": "p1",
+        "path": f"src/File{key % 3}.kt",
+        "nodeType": "function",
+        "startLine": key,
+        "endLine": key + 5,
+        "tokens": text,
+        "metadata": {"language": "kotlin", "nodeType": "function", "symbol": f"fn{key}"},
+        "timestamp": "2026-01-02T03:04:05.000Z"
+    }
+
+def test_save_appends_changed_rows_without_rewriting_the_blob(agent_dirs):
+    store = MetadataStore(agent_dirs / "p1")
+    for key in range(100):
+        store[key] = chunk(key, f"fun f{key}() = {key}\n" * 20)
+    assert store.save()
+    
+    before = store.blob_path.read_bytes()
+    store[5] = chunk(5, "fun changed() = 5")
+    store[200] = chunk(200, "fun added() = 200")
+    del store[7]
+    assert store.save()
+    
+    after = store.blob_path.read_bytes()
+    assert after.startswith(before)
+    assert len(after) > len(before)
+    
+    reloaded = MetadataStore(agent_dirs / "p1")
+    assert reloaded.load()
+    assert len(reloaded) == 100
+    assert reloaded[5] == chunk(5, "fun changed() = 5")
+    assert reloaded[200] == chunk(200, "fun added() = 200")
+    assert reloaded[42] == chunk(42, "fun f42() = 42\n" * 20)
+    assert 7 not in reloaded
+
+def test_save_compacts_once_enough_of_the_blob_is_dead(agent_dirs):
+    store = MetadataStore(agent_dirs / "p1")
+    for key in range(10):
+        store[key] = chunk(key, "x" * 1000)
+    assert store.save()
+    
+    # Replacing 5 of 10 rows leaves a third of the blob dead
+    for key in range(5):
+        store[key] = chunk(key, "y" * 1000)
+    assert store.save()
+    
+    live_bytes = int(store._rows['text_length'].sum() + store._rows['extra_length'].sum())
+    assert store.blob_path.stat().st_size == live_bytes
+    assert store[0]["tokens"] == "y" * 1000
+    assert store[9]["tokens"] == "x" * 1000
+    assert settings.METADATA_COMPACT_RATIO < 1 / 3
@@ -1,5 +1,6 @@
 import logging
 import json
+import threading
 from datetime import datetime
 from typing import Dict, Any, Optional
 from enum import Enum
@@ -12,11 +13,19 @@ class LogLevel(str, Enum):
     CRITICAL = "CRITICAL"
 
 class StructuredLogger:
-    """Structured JSON logger for streaming to KV"""
+    """
+    Structured JSON logger for streaming to KV
+    
+    The streaming buffer is per thread, so jobs running concurrently on
+    worker threads each stream only their own log lines.
+    """
+    
+    # Buffers nobody drains (poll loop, background threads) keep this many lines
+    MAX_RETAINED = 10000
     
     def __init__(self, component: str = "colab-agent"):
         self.component = component
-        self.buffer = []
+        self._local = threading.local()
         self.max_buffer_size = 100
         
         # Setup standard logger
@@ -26,6 +35,14 @@ class StructuredLogger:
         )
         self.logger = logging.getLogger(component)
         
+    @property
+    def buffer(self) -> list:
+        """Log buffer of the current thread"""
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            buffer = self._local.buffer = []
+        return buffer
+        
     def _create_log_entry(
         self, 
         level: LogLevel, 
@@ -50,7 +67,10 @@ class StructuredLogger:
         entry = self._create_log_entry(level, message, meta)
         
         # Add to buffer for streaming
-        self.buffer.append(entry)
+        buffer = self.buffer
+        buffer.append(entry)
+        if len(buffer) > self.MAX_RETAINED:
+            del buffer[:-self.max_buffer_size]
         
         # Also log to console
         log_line = json.dumps(entry)
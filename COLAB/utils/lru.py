@@ -0,0 +1,109 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Hashable
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and/or total size"""
+    
+    def __init__(
+        self,
+        max_items: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        size_fn: Optional[Callable[[Any], int]] = None,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None
+    ):
+        """
+        Args:
+            max_items: Maximum number of entries (None = unbounded)
+            max_bytes: Maximum total size as measured by size_fn
+            size_fn: Returns the size of a value (default: 1 per entry)
+            on_evict: Called with (key, value) for each evicted entry
+        """
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn or (lambda value: 1)
+        self.on_evict = on_evict
+        self.total_bytes = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: dict = {}
+        self._lock = threading.RLock()
+        
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get value and mark it most recently used"""
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+            
+    def put(self, key: Hashable, value: Any):
+        """Insert or replace value, evicting old entries if over budget"""
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+                
+            size = self.size_fn(value)
+            self._data[key] = value
+            self._sizes[key] = size
+            self.total_bytes += size
+            
+            self._evict(keep=key)
+            
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove and return value"""
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+            
+    def resize(self, key: Hashable):
+        """Re-measure a value whose size changed in place"""
+        with self._lock:
+            if key in self._data:
+                self.put(key, self._data[key])
+                
+    def clear(self):
+        """Remove all entries without calling on_evict"""
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.total_bytes = 0
+            
+    def keys(self) -> list:
+        """Get keys from least to most recently used"""
+        with self._lock:
+            return list(self._data)
+            
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+            
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+            
+    def _remove(self, key: Hashable) -> Any:
+        """Remove entry and update size accounting"""
+        value = self._data.pop(key)
+        self.total_bytes -= self._sizes.pop(key)
+        return value
+        
+    def _evict(self, keep: Hashable = None):
+        """Evict least recently used entries until within limits"""
+        while self._data and self._over_budget():
+            key = next(iter(self._data))
+            if key == keep:
+                # Never evict the entry that was just inserted
+                break
+                
+            value = self._remove(key)
+            if self.on_evict:
+                self.on_evict(key, value)
+                
+    def _over_budget(self) -> bool:
+        """Check if cache exceeds either limit"""
+        if self.max_items is not None and len(self._data) > self.max_items:
+            return True
+        if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+            return True
+        return False
@@ -0,0 +1,69 @@
+import queue
+import threading
+from typing import Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+class _ProducerError:
+    """Wraps an exception raised by the producer thread"""
+    
+    def __init__(self, error: BaseException):
+        self.error = error
+
+def prefetch(iterable: Iterable[T], max_buffered: int) -> Iterator[T]:
+    """
+    Run an iterable in a background thread behind a bounded queue
+    
+    The producer can run ahead of the consumer by at most max_buffered
+    items, so the two stages overlap without unbounded memory growth.
+    Exceptions raised by the producer are re-raised in the consumer.
+    
+    Args:
+        iterable: Source of items (consumed in a background thread)
+        max_buffered: Maximum number of items waiting in the queue
+    """
+    buffer: "queue.Queue" = queue.Queue(maxsize=max(1, max_buffered))
+    stopped = threading.Event()
+    
+    def produce():
+        try:
+            for item in iterable:
+                if stopped.is_set():
+                    return
+                buffer.put(item)
+            buffer.put(_DONE)
+        except BaseException as e:
+            buffer.put(_ProducerError(e))
+            
+    thread = threading.Thread(target=produce, name="pipeline-prefetch", daemon=True)
+    thread.start()
+    
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _ProducerError):
+                raise item.error
+            yield item
+    finally:
+        # Unblock the producer if the consumer stops early
+        stopped.set()
+        while thread.is_alive():
+            try:
+                buffer.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+def batched(iterable: Iterable[T], batch_size: int) -> Iterator[List[T]]:
+    """Group items into lists of at most batch_size"""
+    batch: List[T] = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
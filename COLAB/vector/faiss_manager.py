@@ -1,52 +1,196 @@
 import faiss
+import hashlib
+import json
 import numpy as np
 import pickle
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Callable
 from datetime import datetime
 from config.settings import settings
 from utils.logger import logger
 from storage.kv_client import kv_client
+from chunking.chunker import Chunk
+from vector.metadata_store import MetadataStore
+from vector.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from vector.reranker import Reranker
+from utils.lru import LRUCache
+
+class SearchResults:
+    """
+    Results of a batched search
+    
+    ids and distances are (num_queries, top_k) arrays, nearest first, with
+    id -1 and an infinite distance in unused slots. Distances follow
+    FAISSIndex.search: lower is closer. Chunk metadata is only resolved
+    when a row is read.
+    """
+    
+    def __init__(self, ids: np.ndarray, distances: np.ndarray, metadata: MetadataStore):
+        self.ids = ids
+        self.distances = distances
+        self.metadata = metadata
+        
+    @classmethod
+    def empty(cls, num_queries: int, metadata: MetadataStore) -> "SearchResults":
+        """Create results with no hits for each query"""
+        return cls(
+            np.empty((num_queries, 0), dtype='int64'),
+            np.empty((num_queries, 0), dtype='float32'),
+            metadata
+        )
+        
+    @property
+    def top_k(self) -> int:
+        return self.ids.shape[1]
+        
+    def __len__(self) -> int:
+        return len(self.ids)
+        
+    def get(self, query_index: int) -> List[Tuple[Dict[str, Any], float]]:
+        """Get (metadata, distance) tuples for one query"""
+        results = []
+        for idx, dist in zip(self.ids[query_index], self.distances[query_index]):
+            if idx < 0:
+                continue
+            meta = self.metadata.get(int(idx))
+            if meta is not None:
+                results.append((meta, float(dist)))
+        return results
+        
+    def merged(self, top_k: int = None) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Combine hits from all queries, keeping each chunk's best distance
+        
+        Args:
+            top_k: Maximum number of results (default: all unique hits)
+            
+        Returns:
+            List of (metadata, distance) tuples, nearest first
+        """
+        ids = self.ids.ravel()
+        distances = self.distances.ravel()
+        valid = ids >= 0
+        ids, distances = ids[valid], distances[valid]
+        
+        # Sort by distance, then keep the first occurrence of each id
+        order = np.argsort(distances, kind='stable')
+        _, first = np.unique(ids[order], return_index=True)
+        best = order[np.sort(first)]
+        
+        results = []
+        for idx, dist in zip(ids[best], distances[best]):
+            if top_k is not None and len(results) >= top_k:
+                break
+            meta = self.metadata.get(int(idx))
+            if meta is not None:
+                results.append((meta, float(dist)))
+        return results
 
 class FAISSIndex:
     """FAISS vector index manager"""
     
+    # Accepted FAISS_INDEX_TYPE spellings -> canonical type
+    INDEX_TYPES = {
+        "flat": "flat",
+        "IndexFlatL2": "flat",
+        "hnsw": "hnsw",
+        "HNSW": "hnsw",
+        "ivf_flat": "ivf_flat",
+        "IVFFlat": "ivf_flat",
+        "ivf_pq": "ivf_pq",
+        "IVFPQ": "ivf_pq",
+        "hnsw_sq8": "hnsw_sq8",
+        "HNSW+SQ8": "hnsw_sq8"
+    }
+    
+    # Types that must be trained on a sample before vectors can be added
+    TRAINED_TYPES = {"ivf_flat", "ivf_pq", "hnsw_sq8"}
+    
+    # Types whose stored codes only approximate the original vectors
+    QUANTIZED_TYPES = {"ivf_pq", "hnsw_sq8"}
+    
+    METRICS = {
+        "ip": faiss.METRIC_INNER_PRODUCT,
+        "l2": faiss.METRIC_L2
+    }
+    
     def __init__(self, project_id: str, dimension: int):
         self.project_id = project_id
         self.dimension = dimension
         self.index: Optional[faiss.Index] = None
-        self.metadata: List[Dict[str, Any]] = []
+        self.metadata = MetadataStore(settings.FAISS_DIR / project_id)
+        self.lexical: Optional[LexicalIndex] = None
+        if settings.LEXICAL_INDEX_ENABLED:
+            self.lexical = LexicalIndex(settings.FAISS_DIR / project_id)
         self.version = 0
+        self.index_type: Optional[str] = None
+        self.metric: str = settings.FAISS_METRIC
+        self.auto = settings.FAISS_INDEX_TYPE == "auto"
+        self.params: Dict[str, Any] = {}
+        self.read_only = False
+        # Re-embeds chunk texts when vectors leave a quantized index
+        self.embed_texts: Optional[Callable[[List[str]], np.ndarray]] = None
+        self._retrieval_cache = LRUCache(max_items=settings.RETRIEVAL_CACHE_SIZE)
+        self._retrieval_cache_version = self.version
         self.index_path = settings.FAISS_DIR / f"{project_id}.index"
-        self.metadata_path = settings.FAISS_DIR / f"{project_id}_meta.pkl"
+        self.header_path = settings.FAISS_DIR / f"{project_id}_index.json"
+        self.legacy_metadata_path = settings.FAISS_DIR / f"{project_id}_meta.pkl"
         
-    def create_index(self, index_type: str = None) -> bool:
+    def create_index(
+        self,
+        index_type: str = None,
+        metric: str = None,
+        expected_vectors: int = 0
+    ) -> bool:
         """
         Create new FAISS index
         
+        Vectors are addressed by stable 64-bit chunk IDs, so individual
+        chunks can be replaced or removed without rebuilding.
+        
+        Index types that need training start out as an exact flat index
+        and are trained and migrated once enough vectors are present.
+        
         Args:
-            index_type: "flat" or "hnsw"
+            index_type: "auto", "flat", "hnsw", "ivf_flat", "ivf_pq" or "hnsw_sq8"
+            metric: "ip" or "l2"
+            expected_vectors: Expected corpus size, used by "auto"
         """
         try:
             index_type = index_type or settings.FAISS_INDEX_TYPE
-            
-            if index_type == "IndexFlatL2" or index_type == "flat":
-                # Simple L2 distance index (exact search)
-                self.index = faiss.IndexFlatL2(self.dimension)
-                logger.info("Created IndexFlatL2")
+            metric = metric or settings.FAISS_METRIC
+            if metric not in self.METRICS:
+                raise ValueError(f"Unsupported metric: {metric}")
                 
-            elif index_type == "HNSW" or index_type == "hnsw":
-                # HNSW index for faster approximate search
-                self.index = faiss.IndexHNSWFlat(self.dimension, 32)
-                self.index.hnsw.efConstruction = 40
-                self.index.hnsw.efSearch = 16
-                logger.info("Created HNSW index")
+            self.auto = index_type == "auto"
+            if self.auto:
+                index_type, self.params = select_index_config(expected_vectors, self.dimension)
+            else:
+                index_type = self.resolve_index_type(index_type)
+                self.params = {}
                 
+            self.index_type = index_type
+            self.metric = metric
+            
+            if index_type in self.TRAINED_TYPES:
+                base = self._create_base_index("flat")
             else:
-                raise ValueError(f"Unsupported index type: {index_type}")
+                base = self._create_base_index(index_type)
                 
-            self.version = 1
-            self.metadata = []
+            self.index = self._wrap(base)
+            self.read_only = False
+            self.version += 1
+            self.metadata.clear()
+            
+            logger.info(
+                f"Created index",
+                meta={
+                    "index_type": index_type,
+                    "auto": self.auto,
+                    "metric": metric,
+                    "staging": self.is_staging()
+                }
+            )
             
             return True
             
@@ -54,15 +198,263 @@ class FAISSIndex:
             logger.error(f"Failed to create index: {str(e)}")
             return False
             
-    def add_vectors(
+    @classmethod
+    def resolve_index_type(cls, index_type: str) -> str:
+        """Map a configured index type name to its canonical form"""
+        if index_type not in cls.INDEX_TYPES:
+            raise ValueError(f"Unsupported index type: {index_type}")
+        return cls.INDEX_TYPES[index_type]
+        
+    def _create_base_index(self, index_type: str, num_vectors: int = 0) -> faiss.Index:
+        """Create the underlying positional index (untrained)"""
+        metric = self.METRICS[self.metric]
+        m = settings.FAISS_HNSW_M
+        
+        if index_type == "flat":
+            # Exact search
+            factory = "Flat"
+        elif index_type == "hnsw":
+            # Graph index for faster approximate search
+            factory = f"HNSW{m}"
+        elif index_type == "ivf_flat":
+            factory = f"IVF{self._get_nlist(num_vectors)},Flat"
+        elif index_type == "ivf_pq":
+            # Product-quantized codes: a fraction of the float storage
+            # (no polysemous training, it is not used at query time)
+            factory = f"IVF{self._get_nlist(num_vectors)},PQ{self._get_pq_m()}np"
+        elif index_type == "hnsw_sq8":
+            # Graph over 8-bit scalar-quantized vectors
+            factory = f"HNSW{m},SQ8"
+        else:
+            raise ValueError(f"Unsupported index type: {index_type}")
+            
+        index = faiss.index_factory(self.dimension, factory, metric)
+        
+        hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+        if hnsw is not None:
+            hnsw.efConstruction = 40
+            
+        self._apply_search_params(index)
+        return index
+        
+    def _get_nlist(self, num_vectors: int) -> int:
+        """Get number of IVF lists for a corpus size"""
+        if settings.FAISS_IVF_NLIST:
+            nlist = settings.FAISS_IVF_NLIST
+        else:
+            nlist = int(4 * np.sqrt(max(num_vectors, 1)))
+            
+        # FAISS wants roughly 39+ training points per list
+        return max(1, min(nlist, num_vectors // 39 or 1))
+        
+    def _get_pq_m(self) -> int:
+        """Get number of PQ sub-quantizers (must divide the dimension)"""
+        target = self.params.get("pqM") or settings.FAISS_PQ_M or max(1, self.dimension // 4)
+        for m in range(min(target, self.dimension), 0, -1):
+            if self.dimension % m == 0:
+                return m
+        return 1
+        
+    def _apply_search_params(self, index: faiss.Index = None):
+        """Apply nprobe / efSearch (auto-selected or from settings) to the base index"""
+        index = faiss.downcast_index(index if index is not None else self._base_index())
+        
+        if isinstance(index, faiss.IndexIVF):
+            index.nprobe = min(self.params.get("nprobe", settings.FAISS_NPROBE), index.nlist)
+            
+        hnsw = getattr(index, "hnsw", None)
+        if hnsw is not None:
+            hnsw.efSearch = self.params.get("efSearch", settings.FAISS_EF_SEARCH)
+            
+    def is_staging(self) -> bool:
+        """Check if a trained index type is still held in a flat index"""
+        if self.index is None or self.index_type not in self.TRAINED_TYPES:
+            return False
+        return isinstance(self._base_index(), faiss.IndexFlat)
+        
+    def is_quantized(self) -> bool:
+        """Check if the index holds approximate (quantized) vector codes"""
+        return self.index_type in self.QUANTIZED_TYPES and not self.is_staging()
+        
+    def train_if_ready(self) -> bool:
+        """
+        Train the target index type and migrate vectors into it
+        
+        Runs once the staging flat index holds FAISS_MIN_TRAIN_VECTORS.
+        Training uses a random sample of at most FAISS_TRAIN_SAMPLE
+        vectors.
+        
+        Returns:
+            True if the index was migrated
+        """
+        if not self.is_staging() or self.index.ntotal < settings.FAISS_MIN_TRAIN_VECTORS:
+            return False
+            
+        self.migrate(self.index_type, self.params)
+        return True
+        
+    def retune(self) -> bool:
+        """
+        Re-select the index type for the current corpus size ("auto" only)
+        
+        Thresholds carry a hysteresis band around the current type, so a
+        project hovering near a boundary does not flip back and forth.
+        
+        Returns:
+            True if the index was migrated
+        """
+        if not self.auto or self.index is None:
+            return False
+            
+        index_type, params = select_index_config(
+            self.index.ntotal,
+            self.dimension,
+            current_type=self.index_type
+        )
+        
+        if index_type == self.index_type:
+            # Same structure: only query-time parameters may move
+            updated = dict(self.params)
+            updated.update({k: v for k, v in params.items() if k in ("nprobe", "efSearch")})
+            if updated != self.params:
+                self.params = updated
+                self._apply_search_params()
+            return False
+            
+        self.migrate(index_type, params)
+        return True
+        
+    def migrate(self, index_type: str, params: Dict[str, Any] = None):
+        """Move all vectors into a new index of the given type"""
+        self._ensure_writable()
+        previous = self.index_type
+        ids, vectors = self._reconstruct_all()
+        
+        self.index_type = index_type
+        self.params = params or {}
+        
+        # Trained types stay in a staging flat index until there is enough data
+        base_type = index_type
+        if index_type in self.TRAINED_TYPES and len(vectors) < settings.FAISS_MIN_TRAIN_VECTORS:
+            base_type = "flat"
+            
+        self.index = self._wrap(self._build_trained_index(base_type, vectors))
+        if len(vectors) > 0:
+            self.index.add_with_ids(vectors, ids)
+            
+        self.version += 1
+        
+        logger.info(
+            f"Migrated index",
+            meta={
+                "from": previous,
+                "to": index_type,
+                "params": self.params,
+                "vectors": self.index.ntotal
+            }
+        )
+        
+    def _reconstruct_all(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get (ids, vectors) of everything in the index
+        
+        Quantized types only hold a decoded approximation of each vector.
+        Their vectors are re-embedded from the stored chunk text instead
+        (see embed_texts), so moving them into a new index does not carry
+        the quantization error along.
+        """
+        base = self._base_index()
+        
+        if self.index.ntotal == 0:
+            return np.zeros(0, dtype='int64'), np.zeros((0, self.dimension), dtype='float32')
+            
+        if isinstance(base, faiss.IndexIVF):
+            invlists = base.invlists
+            ids = np.concatenate([
+                faiss.rev_swig_ptr(invlists.get_ids(i), invlists.list_size(i)).copy()
+                for i in range(base.nlist)
+            ]).astype('int64')
+        else:
+            ids = faiss.vector_to_array(self.index.id_map)
+            
+        if self.is_quantized():
+            vectors = self._reembed(ids)
+            if vectors is not None:
+                return ids, vectors
+                
+        # Decoded approximation for quantized types
+        if isinstance(base, faiss.IndexIVF):
+            return ids, base.reconstruct_batch(ids)
+        return ids, base.reconstruct_n(0, self.index.ntotal)
+            
+    def _reembed(self, ids: np.ndarray) -> Optional[np.ndarray]:
+        """Embed the stored chunk texts of the given IDs again, or None"""
+        if self.embed_texts is None:
+            logger.warning("No embedder attached, copying quantized vectors")
+            return None
+            
+        try:
+            texts = [self.metadata[i].get("tokens", "") for i in ids.tolist()]
+            vectors = np.ascontiguousarray(self.embed_texts(texts), dtype='float32')
+            
+            logger.info(
+                f"Re-embedded vectors of quantized index",
+                meta={
+                    "index_type": self.index_type,
+                    "vectors": len(vectors)
+                }
+            )
+            
+            return vectors
+            
+        except Exception as e:
+            logger.warning(f"Failed to re-embed vectors, copying quantized vectors: {str(e)}")
+            return None
+        
+    def _wrap(self, base: faiss.Index) -> faiss.Index:
+        """
+        Make a positional index addressable by chunk ID
+        
+        IVF indexes store IDs natively and keep a hash table from ID to
+        list position. Everything else goes through IndexIDMap2, which
+        relies on the base index compacting positions on removal.
+        """
+        if isinstance(base, faiss.IndexIVF):
+            base.set_direct_map_type(faiss.DirectMap.Hashtable)
+            return base
+        return faiss.IndexIDMap2(base)
+        
+    def _base_index(self) -> faiss.Index:
+        """Get the positional index under the ID mapping"""
+        if isinstance(self.index, faiss.IndexIDMap2):
+            return faiss.downcast_index(self.index.index)
+        return faiss.downcast_index(self.index)
+        
+    def _build_trained_index(self, index_type: str, vectors: np.ndarray) -> faiss.Index:
+        """Create a base index of the given type trained on a sample"""
+        base = self._create_base_index(index_type, len(vectors))
+        
+        if not base.is_trained:
+            sample = vectors
+            if len(vectors) > settings.FAISS_TRAIN_SAMPLE:
+                rng = np.random.default_rng(0)
+                rows = rng.choice(len(vectors), settings.FAISS_TRAIN_SAMPLE, replace=False)
+                sample = vectors[np.sort(rows)]
+            base.train(np.ascontiguousarray(sample, dtype='float32'))
+            
+        return base
+        
+    def upsert(
         self,
+        chunk_ids: List[str],
         vectors: np.ndarray,
         chunk_metadata: List[Dict[str, Any]]
     ) -> bool:
         """
-        Add vectors to index
+        Insert or replace vectors by chunk ID
         
         Args:
+            chunk_ids: Chunk IDs from Chunk.generate_id()
             vectors: Numpy array of vectors (N x dimension)
             chunk_metadata: List of metadata dicts for each vector
         """
@@ -70,21 +462,47 @@ class FAISSIndex:
             if self.index is None:
                 raise RuntimeError("Index not created")
                 
-            if len(vectors) != len(chunk_metadata):
-                raise ValueError("Vector count must match metadata count")
+            self._ensure_writable()
+            
+            if not (len(chunk_ids) == len(vectors) == len(chunk_metadata)):
+                raise ValueError("Chunk ID, vector and metadata counts must match")
+                
+            if len(chunk_ids) == 0:
+                return True
                 
-            # Ensure vectors are float32
-            vectors = vectors.astype('float32')
+            # Keep the first occurrence of duplicate IDs (outer node wins)
+            ids = np.array([Chunk.to_int_id(cid) for cid in chunk_ids], dtype='int64')
+            _, first = np.unique(ids, return_index=True)
+            first.sort()
             
-            # Add to index
-            self.index.add(vectors)
+            if len(first) < len(ids):
+                logger.debug(f"Dropped {len(ids) - len(first)} duplicate chunk IDs")
+                
+            ids = ids[first]
+            vectors = np.ascontiguousarray(vectors[first], dtype='float32')
             
-            # Store metadata
-            self.metadata.extend(chunk_metadata)
+            # Replace existing vectors for these IDs
+            existing = [i for i in ids.tolist() if i in self.metadata]
+            if existing:
+                self._remove_ids(np.array(existing, dtype='int64'))
+                
+            self.index.add_with_ids(vectors, ids)
+            
+            for i, idx in zip(ids.tolist(), first.tolist()):
+                self.metadata[i] = chunk_metadata[idx]
+                
+            if self.lexical is not None:
+                self.lexical.upsert(
+                    ids.tolist(),
+                    (self._lexical_text(chunk_metadata[idx]) for idx in first.tolist())
+                )
+                
+            self.version += 1
             
             logger.info(
-                f"Added {len(vectors)} vectors to index",
+                f"Upserted {len(ids)} vectors",
                 meta={
+                    "replaced": len(existing),
                     "total_vectors": self.index.ntotal,
                     "dimension": self.dimension
                 }
@@ -93,9 +511,99 @@ class FAISSIndex:
             return True
             
         except Exception as e:
-            logger.error(f"Failed to add vectors: {str(e)}")
+            logger.error(f"Failed to upsert vectors: {str(e)}")
             return False
             
+    def add_vectors(
+        self,
+        vectors: np.ndarray,
+        chunk_metadata: List[Dict[str, Any]]
+    ) -> bool:
+        """
+        Add vectors to index
+        
+        Args:
+            vectors: Numpy array of vectors (N x dimension)
+            chunk_metadata: List of metadata dicts for each vector
+        """
+        return self.upsert(
+            [meta["chunkId"] for meta in chunk_metadata],
+            vectors,
+            chunk_metadata
+        )
+        
+    def remove(self, chunk_ids: List[str]) -> int:
+        """
+        Remove vectors by chunk ID
+        
+        Args:
+            chunk_ids: Chunk IDs to remove (unknown IDs are ignored)
+            
+        Returns:
+            Number of vectors removed
+        """
+        if self.index is None or not chunk_ids:
+            return 0
+            
+        try:
+            ids = {Chunk.to_int_id(cid) for cid in chunk_ids}
+            ids = np.array([i for i in ids if i in self.metadata], dtype='int64')
+            
+            if len(ids) == 0:
+                return 0
+                
+            self._ensure_writable()
+            self._remove_ids(ids)
+            
+            for i in ids.tolist():
+                self.metadata.pop(i, None)
+                
+            if self.lexical is not None:
+                self.lexical.remove(ids.tolist())
+                
+            self.version += 1
+            
+            logger.info(
+                f"Removed {len(ids)} vectors",
+                meta={"total_vectors": self.index.ntotal}
+            )
+            
+            return len(ids)
+            
+        except Exception as e:
+            logger.error(f"Failed to remove vectors: {str(e)}")
+            return 0
+            
+    def _remove_ids(self, ids: np.ndarray):
+        """Remove IDs from the FAISS index"""
+        try:
+            if isinstance(self.index, faiss.IndexIVF):
+                # Removal through the ID hash table needs an explicit ID list
+                self.index.remove_ids(faiss.IDSelectorArray(len(ids), faiss.swig_ptr(ids)))
+            else:
+                self.index.remove_ids(faiss.IDSelectorBatch(ids))
+        except RuntimeError:
+            # HNSW cannot delete in place - rebuild from stored vectors
+            self._rebuild_without(ids)
+            
+    def _rebuild_without(self, ids: np.ndarray):
+        """Rebuild the index keeping every vector except the given IDs"""
+        all_ids, vectors = self._reconstruct_all()
+        keep = ~np.isin(all_ids, ids)
+        
+        vectors, all_ids = vectors[keep], all_ids[keep]
+        
+        # Trained types drop back to staging if too few vectors remain
+        base_type = self.index_type
+        if base_type in self.TRAINED_TYPES and len(vectors) < settings.FAISS_MIN_TRAIN_VECTORS:
+            base_type = "flat"
+            
+        rebuilt = self._wrap(self._build_trained_index(base_type, vectors))
+        if len(vectors) > 0:
+            rebuilt.add_with_ids(vectors, all_ids)
+            
+        self.index = rebuilt
+        
     def search(
         self,
         query_vector: np.ndarray,
@@ -109,41 +617,216 @@ class FAISSIndex:
             top_k: Number of results to return
             
         Returns:
-            List of (metadata, distance) tuples
+            List of (metadata, distance) tuples, nearest first. With the
+            inner-product metric the distance is 1 - cosine similarity.
+        """
+        results = self.search_batch(query_vector, top_k)
+        if len(results) == 0:
+            return []
+            
+        hits = results.get(0)
+        logger.debug(
+            f"Search returned {len(hits)} results",
+            meta={"top_k": results.top_k}
+        )
+        
+        return hits
+        
+    def search_batch(
+        self,
+        query_matrix: np.ndarray,
+        top_k: int = None
+    ) -> "SearchResults":
+        """
+        Search for several query vectors in one FAISS call
+        
+        Args:
+            query_matrix: Query embeddings, shape (num_queries, dimension)
+                or a single vector
+            top_k: Number of results per query
+            
+        Returns:
+            SearchResults with ids and distances as (num_queries, top_k)
+            arrays; metadata is looked up only when results are read.
         """
+        query_matrix = np.asarray(query_matrix, dtype='float32')
+        if query_matrix.ndim == 1:
+            query_matrix = query_matrix.reshape(1, -1)
+            
         try:
             if self.index is None or self.index.ntotal == 0:
                 logger.warning("Index is empty")
-                return []
+                return SearchResults.empty(len(query_matrix), self.metadata)
                 
             top_k = top_k or settings.TOP_K_CHUNKS
             top_k = min(top_k, self.index.ntotal)
             
-            # Ensure query is 2D float32
-            if query_vector.ndim == 1:
-                query_vector = query_vector.reshape(1, -1)
-            query_vector = query_vector.astype('float32')
+            distances, ids = self.index.search(np.ascontiguousarray(query_matrix), top_k)
+            
+            # Padding slots (fewer hits than top_k) come back as id -1
+            distances = self._to_distance(distances)
+            distances[ids < 0] = np.inf
             
-            # Search
-            distances, indices = self.index.search(query_vector, top_k)
+            return SearchResults(ids, distances, self.metadata)
             
-            # Build results
-            results = []
-            for idx, dist in zip(indices[0], distances[0]):
-                if idx < len(self.metadata):
-                    results.append((self.metadata[idx], float(dist)))
+        except Exception as e:
+            logger.error(f"Search failed: {str(e)}")
+            return SearchResults.empty(len(query_matrix), self.metadata)
+            
+    def hybrid_search(
+        self,
+        query_vectors: np.ndarray,
+        query_text: str,
+        top_k: int = None,
+        rerank: bool = None,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Search by embedding and by identifiers, fusing the rankings
+        
+        Each query vector and the BM25 ranking of query_text over-fetch
+        HYBRID_CANDIDATES hits, which are combined with reciprocal rank
+        fusion. Exact identifier matches (class names, resource IDs) that
+        embeddings rank poorly are pulled up by the lexical ranking. The
+        fused candidates are then diversified by the Reranker.
+        
+        Results are cached per index version, so a repeated query costs
+        nothing until the index changes.
+        
+        Args:
+            query_vectors: One query embedding or a (num_queries, dimension) matrix
+            query_text: Raw query text for the lexical index
+            top_k: Number of results to return
+            rerank: Apply MMR / overlap / per-file reranking (default from settings)
+            filters: Optional retrieval filters (folders, paths) hits must match
+            
+        Returns:
+            List of (metadata, fused score) tuples, best first (higher is better)
+        """
+        top_k = top_k or settings.TOP_K_CHUNKS
+        rerank = settings.RERANK_ENABLED if rerank is None else rerank
+        candidates = max(top_k, settings.HYBRID_CANDIDATES)
+        
+        query_vectors = np.asarray(query_vectors, dtype='float32')
+        cache_key = self._retrieval_key(query_vectors, query_text, filters, top_k, rerank)
+        
+        if self._retrieval_cache_version != self.version:
+            self._retrieval_cache.clear()
+            self._retrieval_cache_version = self.version
+            
+        cached = self._retrieval_cache.get(cache_key)
+        if cached is not None:
+            logger.debug(f"Retrieval cache hit", meta={"version": self.version})
+            return list(cached)
+            
+        results = self.search_batch(query_vectors, candidates)
+        rankings = [[int(i) for i in row if i >= 0] for row in results.ids]
+        
+        if self.lexical is not None and query_text:
+            try:
+                rankings.append([i for i, _ in self.lexical.search(query_text, candidates)])
+            except Exception as e:
+                logger.warning(f"Lexical search failed: {str(e)}")
+                
+        # Keep every candidate when reranking, it needs the alternatives
+        limit = candidates if rerank else top_k
+        
+        fused = []
+        fused_ids = []
+        for idx, score in reciprocal_rank_fusion(rankings, k=settings.RRF_K):
+            meta = self.metadata.get(idx)
+            if meta is not None and self._matches_filters(meta, filters):
+                fused.append((meta, score))
+                fused_ids.append(idx)
+                if len(fused) >= limit:
+                    break
                     
-            logger.debug(
-                f"Search returned {len(results)} results",
-                meta={"top_k": top_k}
-            )
+        if rerank and len(fused) > 0:
+            vectors = self.get_vectors(np.array(fused_ids, dtype='int64'))
+            fused = Reranker().rerank(fused, vectors, top_k)
+            
+        logger.debug(
+            f"Hybrid search returned {len(fused)} results",
+            meta={"top_k": top_k, "rankings": len(rankings)}
+        )
+        
+        self._retrieval_cache.put(cache_key, list(fused))
+        
+        return fused
+        
+    def _retrieval_key(
+        self,
+        query_vectors: np.ndarray,
+        query_text: str,
+        filters: Optional[Dict[str, Any]],
+        top_k: int,
+        rerank: bool
+    ) -> str:
+        """Hash a query and its options into a retrieval cache key"""
+        digest = hashlib.sha1(np.ascontiguousarray(query_vectors).tobytes())
+        digest.update((query_text or "").encode('utf-8'))
+        digest.update(json.dumps(filters, sort_keys=True, default=str).encode('utf-8'))
+        digest.update(f"{top_k}:{rerank}:{self.params}".encode('utf-8'))
+        return f"{self.version}:{digest.hexdigest()}"
+        
+    @staticmethod
+    def _matches_filters(meta: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> bool:
+        """Check a chunk against retrieval filters (same rules as CodeChunker)"""
+        if not filters:
+            return True
             
-            return results
+        path = meta.get("path", "")
+        
+        folders = filters.get("folders")
+        if folders and not any(path.startswith(folder.rstrip("/") + "/") for folder in folders):
+            return False
+            
+        paths = filters.get("paths")
+        if paths and not any(path.endswith(p) for p in paths):
+            return False
+            
+        return True
+        
+    def get_vectors(self, ids: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Get stored vectors by FAISS ID
+        
+        Quantized types return their decoded approximation. Returns None
+        if the index cannot reconstruct them.
+        """
+        try:
+            if self.index is None or len(ids) == 0:
+                return None
+            return self.index.reconstruct_batch(np.ascontiguousarray(ids, dtype='int64'))
             
         except Exception as e:
-            logger.error(f"Search failed: {str(e)}")
-            return []
+            logger.warning(f"Could not reconstruct vectors: {str(e)}")
+            return None
             
+    @staticmethod
+    def _lexical_text(meta: Dict[str, Any]) -> str:
+        """Text indexed lexically for a chunk: its code plus its file path"""
+        return f"{meta.get('tokens', '')}\n{meta.get('path', '')}"
+        
+    def _sync_lexical(self):
+        """Build the lexical index from stored metadata if it is missing"""
+        if self.lexical is None:
+            return
+            
+        if self.lexical.exists() and self.lexical.load() and len(self.lexical) == len(self.metadata):
+            return
+            
+        logger.info(f"Building lexical index from metadata", meta={"chunks": len(self.metadata)})
+        self.lexical.clear()
+        for key in self.metadata:
+            self.lexical.upsert([key], [self._lexical_text(self.metadata[key])])
+            
+    def _to_distance(self, score: np.ndarray) -> np.ndarray:
+        """Convert raw FAISS scores to distances (lower is closer)"""
+        if self.metric == "ip":
+            return 1.0 - score
+        return score
+        
     def save(self) -> bool:
         """Save index and metadata to disk"""
         try:
@@ -151,20 +834,43 @@ class FAISSIndex:
                 logger.warning("No index to save")
                 return False
                 
+            # Never write over the file a read-only index is mapped from
+            self._ensure_writable()
+            
+            # Re-select the index type for the corpus size, or train a
+            # staging index once it has enough vectors
+            if not self.retune():
+                self.train_if_ready()
+                
             # Create directory
             settings.FAISS_DIR.mkdir(parents=True, exist_ok=True)
             
-            # Save FAISS index
-            faiss.write_index(self.index, str(self.index_path))
+            # Save FAISS index (atomically, readers may have it mapped)
+            tmp_path = self.index_path.with_suffix(".index.tmp")
+            faiss.write_index(self.index, str(tmp_path))
+            tmp_path.replace(self.index_path)
             
             # Save metadata
-            with open(self.metadata_path, 'wb') as f:
-                pickle.dump({
-                    'metadata': self.metadata,
+            if not self.metadata.save():
+                raise RuntimeError("Failed to save metadata store")
+                
+            if self.lexical is not None and not self.lexical.save():
+                raise RuntimeError("Failed to save lexical index")
+                
+            with open(self.header_path, 'w') as f:
+                json.dump({
                     'version': self.version,
-                    'dimension': self.dimension
+                    'dimension': self.dimension,
+                    'index_type': self.index_type,
+                    'auto': self.auto,
+                    'params': self.params,
+                    'metric': self.metric,
+                    'staging': self.is_staging()
                 }, f)
                 
+            # Drop metadata in the old pickle format
+            self.legacy_metadata_path.unlink(missing_ok=True)
+            
             logger.info(
                 f"Index saved",
                 meta={
@@ -176,34 +882,86 @@ class FAISSIndex:
             # Update manifest in KV
             self._update_manifest()
             
+            _indexes.resize(self.project_id)
+            
             return True
             
         except Exception as e:
             logger.error(f"Failed to save index: {str(e)}")
             return False
             
-    def load(self) -> bool:
-        """Load index and metadata from disk"""
+    def load(self, mmap: bool = None) -> bool:
+        """
+        Load index and metadata from disk
+        
+        Args:
+            mmap: Map the index read-only instead of reading it into
+                memory (default from settings). The index is re-read
+                into memory on the first change.
+        """
         try:
             if not self.index_path.exists():
                 logger.warning("Index file not found")
                 return False
                 
+            mmap = settings.FAISS_MMAP if mmap is None else mmap
+            
+            # Read the header first: the index type decides how to map it
+            legacy = not (self.header_path.exists() and self.metadata.exists())
+            if legacy:
+                # Previous format: everything in one pickle
+                with open(self.legacy_metadata_path, 'rb') as f:
+                    data = pickle.load(f)
+            else:
+                with open(self.header_path, 'r') as f:
+                    data = json.load(f)
+                    
+            index_type = self.resolve_index_type(data.get('index_type') or "flat")
+            
             # Load FAISS index
-            self.index = faiss.read_index(str(self.index_path))
+            if mmap:
+                # IVF maps its inverted lists; other types map their code arrays
+                if index_type in ("ivf_flat", "ivf_pq") and not data.get('staging', False):
+                    flags = faiss.IO_FLAG_MMAP
+                else:
+                    flags = faiss.IO_FLAG_MMAP_IFC
+                index = faiss.read_index(str(self.index_path), flags | faiss.IO_FLAG_READ_ONLY)
+            else:
+                index = faiss.read_index(str(self.index_path))
+                
+            if not isinstance(index, (faiss.IndexIDMap2, faiss.IndexIVF)):
+                logger.warning("Index uses legacy positional format, rebuilding")
+                return False
+                
+            self.index = index
+            self.read_only = mmap
             
             # Load metadata
-            with open(self.metadata_path, 'rb') as f:
-                data = pickle.load(f)
-                self.metadata = data['metadata']
-                self.version = data['version']
-                self.dimension = data['dimension']
+            if legacy:
+                for key, meta in data['metadata'].items():
+                    self.metadata[key] = meta
+            elif not self.metadata.load():
+                return False
                 
+            self._sync_lexical()
+            
+            self.version = data['version']
+            self.dimension = data['dimension']
+            self.index_type = index_type
+            
+            self.auto = data.get('auto', False)
+            self.params = data.get('params', {})
+            
+            # Indexes saved before metrics were configurable used L2
+            self.metric = data.get('metric', 'l2')
+            self._apply_search_params()
+            
             logger.info(
                 f"Index loaded",
                 meta={
                     "vectors": self.index.ntotal,
-                    "version": self.version
+                    "version": self.version,
+                    "mmap": self.read_only
                 }
             )
             
@@ -213,11 +971,27 @@ class FAISSIndex:
             logger.error(f"Failed to load index: {str(e)}")
             return False
             
+    def _ensure_writable(self):
+        """Swap a memory-mapped read-only index for an in-memory copy"""
+        if not self.read_only:
+            return
+            
+        self.index = faiss.read_index(str(self.index_path))
+        self.read_only = False
+        self._apply_search_params()
+        
+        logger.info(f"Index loaded into memory for writing", meta={"project_id": self.project_id})
+        
+        # The in-memory copy costs more than the mapping did
+        _indexes.resize(self.project_id)
+        
     def clear(self):
         """Clear index and metadata"""
         self.index = None
-        self.metadata = []
-        self.version = 0
+        self.read_only = False
+        self.metadata.clear()
+        if self.lexical is not None:
+            self.lexical.clear()
         
     def get_stats(self) -> Dict[str, Any]:
         """Get index statistics"""
@@ -226,9 +1000,61 @@ class FAISSIndex:
             "dimension": self.dimension,
             "total_vectors": self.index.ntotal if self.index else 0,
             "version": self.version,
-            "metadata_count": len(self.metadata)
+            "index_type": self.index_type,
+            "auto": self.auto,
+            "params": self.params,
+            "metric": self.metric,
+            "staging": self.is_staging(),
+            "mmap": self.read_only,
+            "memory_bytes": self.get_memory_bytes(),
+            "metadata_count": len(self.metadata),
+            "lexical_count": len(self.lexical) if self.lexical is not None else 0
         }
         
+    def get_memory_bytes(self) -> int:
+        """Estimate resident memory of the index"""
+        if self.index is None:
+            return 0
+            
+        lexical_bytes = self.lexical.get_memory_bytes() if self.lexical is not None else 0
+        n = self.index.ntotal
+        
+        # ID map (or IVF direct map): id array plus reverse hash map
+        id_map_bytes = 48
+        
+        if self.read_only:
+            # Vectors stay in the page cache, which the OS can reclaim
+            return n * id_map_bytes + lexical_bytes
+            
+        d = self.dimension
+        graph_bytes = settings.FAISS_HNSW_M * 2 * 4
+        base_type = "flat" if self.is_staging() else self.index_type
+        
+        per_vector = {
+            "flat": d * 4,
+            "hnsw": d * 4 + graph_bytes,
+            "ivf_flat": d * 4 + 8,
+            "ivf_pq": self._get_pq_m() + 8,
+            "hnsw_sq8": d + graph_bytes
+        }.get(base_type, d * 4)
+        
+        return n * (per_vector + id_map_bytes) + lexical_bytes
+        
+    def matches_settings(self) -> bool:
+        """Check if the index was built with the configured type and metric"""
+        if self.metric != settings.FAISS_METRIC:
+            return False
+            
+        if settings.FAISS_INDEX_TYPE == "auto":
+            # The type itself is managed by retune()
+            return self.auto
+            
+        try:
+            index_type = self.resolve_index_type(settings.FAISS_INDEX_TYPE)
+        except ValueError:
+            return True
+        return not self.auto and self.index_type == index_type
+        
     def _update_manifest(self):
         """Update index manifest in KV"""
         try:
@@ -236,6 +1062,10 @@ class FAISSIndex:
                 "indexVersion": str(self.version),
                 "numChunks": self.index.ntotal if self.index else 0,
                 "dimension": self.dimension,
+                "indexType": self.index_type,
+                "indexAuto": self.auto,
+                "indexParams": self.params,
+                "metric": self.metric,
                 "lastUpdated": datetime.utcnow().isoformat() + "Z"
             }
             
@@ -244,12 +1074,95 @@ class FAISSIndex:
         except Exception as e:
             logger.warning(f"Failed to update manifest: {str(e)}")
 
-# Index cache
-_indexes: Dict[str, FAISSIndex] = {}
+# Index types in increasing order of scale. All of them remove vectors
+# in place, so incremental updates never rebuild the whole index (HNSW
+# can't, and is only used when configured explicitly).
+AUTO_TIERS = ["flat", "ivf_flat", "ivf_pq"]
+
+def select_index_config(
+    num_vectors: int,
+    dimension: int,
+    current_type: str = None
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Choose an index type and parameters for a corpus
+    
+    - flat while an exact scan is cheap (FAISS_AUTO_FLAT_MAX_VECTORS,
+      scaled by dimension relative to 384)
+    - IVF-Flat while full-float vectors fit the memory budget
+    - IVF-PQ beyond that
+    
+    Query-time parameters are derived from FAISS_RECALL_TARGET. When
+    current_type is given, a boundary must be crossed by the hysteresis
+    margin before the type changes.
+    
+    Returns:
+        Tuple of (canonical index type, params)
+    """
+    flat_max = settings.FAISS_AUTO_FLAT_MAX_VECTORS * 384 / max(dimension, 1)
+    # Float vector, list ID and direct map entry
+    bytes_per_vector = dimension * 4 + 8 + 48
+    ivf_flat_max = settings.FAISS_AUTO_MEMORY_MB * 1024 * 1024 / bytes_per_vector
+    boundaries = [flat_max, max(ivf_flat_max, flat_max)]
+    
+    if current_type in AUTO_TIERS:
+        margin = settings.FAISS_AUTO_HYSTERESIS
+        tier = AUTO_TIERS.index(current_type)
+        while tier < len(boundaries) and num_vectors > boundaries[tier] * (1 + margin):
+            tier += 1
+        while tier > 0 and num_vectors < boundaries[tier - 1] * (1 - margin):
+            tier -= 1
+    else:
+        tier = sum(1 for boundary in boundaries if num_vectors > boundary)
+        
+    index_type = AUTO_TIERS[tier]
+    recall = settings.FAISS_RECALL_TARGET
+    
+    # Higher recall targets explore more of the index per query
+    if recall <= 0.9:
+        effort = 0
+    elif recall <= 0.95:
+        effort = 1
+    elif recall <= 0.98:
+        effort = 2
+    else:
+        effort = 3
+        
+    params: Dict[str, Any] = {}
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = max(1, min(int(4 * np.sqrt(num_vectors)), num_vectors // 39 or 1))
+        params["nprobe"] = max(8, int(np.ceil(nlist * [0.02, 0.05, 0.1, 0.2][effort])))
+    if index_type == "ivf_pq":
+        params["pqM"] = max(1, dimension // (2 if effort >= 2 else 4))
+        
+    return index_type, params
+
+def _on_index_evicted(project_id: str, index: FAISSIndex):
+    """Log index eviction (jobs still holding it keep their reference)"""
+    logger.info(
+        f"Evicted FAISS index from cache",
+        meta={
+            "project_id": project_id,
+            "memory_bytes": index.get_memory_bytes()
+        }
+    )
+
+# Index cache, bounded by estimated resident bytes
+_indexes = LRUCache(
+    max_bytes=settings.FAISS_CACHE_MAX_MB * 1024 * 1024,
+    size_fn=lambda index: index.get_memory_bytes(),
+    on_evict=_on_index_evicted
+)
+
+def is_index_cached(project_id: str) -> bool:
+    """Check if a project's index is loaded in memory"""
+    return project_id in _indexes
 
 def get_faiss_index(project_id: str, dimension: int) -> FAISSIndex:
     """Get or create FAISS index for project"""
-    if project_id not in _indexes:
+    index = _indexes.get(project_id)
+    
+    if index is None:
         index = FAISSIndex(project_id, dimension)
         
         # Try to load existing index
@@ -257,6 +1170,7 @@ def get_faiss_index(project_id: str, dimension: int) -> FAISSIndex:
             # Create new index
             index.create_index()
             
-        _indexes[project_id] = index
-        
-    return _indexes[project_id]
\ No newline at end of file
+    # (Re-)insert so the cache sees the current size
+    _indexes.put(project_id, index)
+    
+    return index
@@ -0,0 +1,330 @@
+import json
+import hashlib
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Set
+from datetime import datetime
+from config.settings import settings
+from utils.logger import logger
+
+class IndexState:
+    """Record of what an index was built from"""
+    
+    def __init__(self, project_id: str):
+        self.project_id = project_id
+        self.commit: Optional[str] = None
+        self.model: Optional[str] = None
+        self.embedding_tag: Optional[str] = None
+        self.dimension = 0
+        self.filters: Optional[Dict[str, Any]] = None
+        self.chunking: Optional[Dict[str, Any]] = None
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.dirty_files: List[str] = []
+        self.updated_at: Optional[str] = None
+        self.state_path = settings.FAISS_DIR / f"{project_id}_state.json"
+        
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary"""
+        return {
+            "projectId": self.project_id,
+            "commit": self.commit,
+            "model": self.model,
+            "embeddingTag": self.embedding_tag,
+            "dimension": self.dimension,
+            "filters": self.filters,
+            "chunking": self.chunking,
+            "files": self.files,
+            "dirtyFiles": self.dirty_files,
+            "updatedAt": self.updated_at
+        }
+        
+    def load(self) -> bool:
+        """Load state from disk"""
+        try:
+            if not self.state_path.exists():
+                return False
+                
+            with open(self.state_path, 'r') as f:
+                data = json.load(f)
+                
+            self.commit = data.get("commit")
+            self.model = data.get("model")
+            self.embedding_tag = data.get("embeddingTag")
+            self.dimension = data.get("dimension", 0)
+            self.filters = data.get("filters")
+            self.chunking = data.get("chunking")
+            self.files = data.get("files", {})
+            self.dirty_files = data.get("dirtyFiles", [])
+            self.updated_at = data.get("updatedAt")
+            
+            return True
+            
+        except Exception as e:
+            logger.warning(f"Failed to load index state: {str(e)}")
+            return False
+            
+    def save(self) -> bool:
+        """Save state to disk"""
+        try:
+            settings.FAISS_DIR.mkdir(parents=True, exist_ok=True)
+            
+            self.updated_at = datetime.utcnow().isoformat() + "Z"
+            
+            # Write atomically so a crash never leaves a half-written state
+            tmp_path = self.state_path.with_suffix(".tmp")
+            with open(tmp_path, 'w') as f:
+                json.dump(self.to_dict(), f)
+            tmp_path.replace(self.state_path)
+            
+            return True
+            
+        except Exception as e:
+            logger.warning(f"Failed to save index state: {str(e)}")
+            return False
+            
+    def reset(self):
+        """Forget all indexed files"""
+        self.commit = None
+        self.files = {}
+        self.dirty_files = []
+        
+    def get_chunk_count(self) -> int:
+        """Get number of chunks recorded across all files"""
+        return sum(len(f.get("chunkIds", [])) for f in self.files.values())
+
+class IncrementalIndexer:
+    """Keep a project's FAISS index in sync with its working tree"""
+    
+    def __init__(
+        self,
+        repo_manager: Any,
+        chunker: Any,
+        embedder: Any,
+        faiss_index: Any
+    ):
+        self.repo_manager = repo_manager
+        self.chunker = chunker
+        self.embedder = embedder
+        self.faiss_index = faiss_index
+        self.project_root = repo_manager.get_repo_path()
+        
+        # Migrations out of a quantized index re-embed instead of copying codes
+        self.faiss_index.embed_texts = embedder.embed_texts
+        self.state = IndexState(faiss_index.project_id)
+        
+    def update(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        force_full: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Bring the index up to date
+        
+        Only files that changed since the last indexed commit are
+        re-chunked and re-embedded. Falls back to a full rebuild when
+        the previous state is missing or incompatible.
+        
+        Args:
+            filters: Optional retrieval filters (folders, paths)
+            force_full: Always rebuild from scratch
+            
+        Returns:
+            Dict with indexing statistics
+        """
+        source_files = {
+            self._rel_path(path): path
+            for path in self.chunker.find_source_files(filters)
+        }
+        
+        reason = None if not force_full else "forced"
+        if reason is None:
+            reason = self._rebuild_reason(filters)
+            
+        if reason:
+            logger.info(f"Full index rebuild ({reason})")
+            return self._full_rebuild(source_files, filters)
+            
+        return self._incremental_update(source_files)
+        
+    def _rebuild_reason(self, filters: Optional[Dict[str, Any]]) -> Optional[str]:
+        """Return why a full rebuild is needed, or None"""
+        if not self.state.load():
+            return "no previous state"
+            
+        if self.state.model != self.embedder.model.get_model_name():
+            return "embedding model changed"
+            
+        # Backend and truncation mode (e.g. fp32 vs int8 ONNX) change the vectors too
+        if self.state.embedding_tag != self.embedder.model.get_cache_tag():
+            return "embedding backend changed"
+            
+        if self.state.dimension != self.faiss_index.dimension:
+            return "dimension changed"
+            
+        if self.state.filters != filters:
+            return "filters changed"
+            
+        if not self.faiss_index.matches_settings():
+            return "index type or metric changed"
+            
+        if self.state.chunking != self._chunking_config():
+            return "chunking settings changed"
+            
+        total_vectors = self.faiss_index.get_stats()["total_vectors"]
+        if total_vectors != self.state.get_chunk_count():
+            return "index out of sync with state"
+            
+        return None
+        
+    def _full_rebuild(
+        self,
+        source_files: Dict[str, Path],
+        filters: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Re-chunk and re-embed every source file"""
+        previous_chunks = self.state.get_chunk_count()
+        self.state.reset()
+        self.state.model = self.embedder.model.get_model_name()
+        self.state.embedding_tag = self.embedder.model.get_cache_tag()
+        self.state.dimension = self.faiss_index.dimension
+        self.state.filters = filters
+        self.state.chunking = self._chunking_config()
+        
+        self.faiss_index.clear()
+        self.faiss_index.create_index(expected_vectors=previous_chunks)
+        
+        added = self._index_files(source_files, set(source_files))
+        self._finish(index_changed=True)
+        
+        return {
+            "mode": "full",
+            "files": len(source_files),
+            "added": added,
+            "removed": 0,
+            "chunks": self.faiss_index.get_stats()["total_vectors"]
+        }
+        
+    def _incremental_update(self, source_files: Dict[str, Path]) -> Dict[str, Any]:
+        """Re-index only files that were added, modified or deleted"""
+        indexed = set(self.state.files)
+        current = set(source_files)
+        
+        deleted = indexed - current
+        added = current - indexed
+        
+        # Ask git which files may have changed; without a usable base
+        # commit every file is a candidate and the hashes decide
+        candidates = self.repo_manager.get_changed_files(self.state.commit)
+        if candidates is None:
+            candidates = set(current)
+        candidates.update(self.state.dirty_files)
+        
+        modified = set()
+        for rel_path in (candidates & current) - added:
+            file_hash = self._hash_file(source_files[rel_path])
+            if file_hash != self.state.files[rel_path].get("hash"):
+                modified.add(rel_path)
+                
+        stale = deleted | modified
+        stale_ids = [
+            chunk_id
+            for rel_path in stale
+            for chunk_id in self.state.files[rel_path].get("chunkIds", [])
+        ]
+        removed = self.faiss_index.remove(stale_ids)
+        
+        for rel_path in stale:
+            self.state.files.pop(rel_path, None)
+            
+        added_chunks = self._index_files(source_files, added | modified)
+        self._finish(index_changed=bool(stale or added))
+        
+        logger.info(
+            "Incremental index update",
+            meta={
+                "added_files": len(added),
+                "modified_files": len(modified),
+                "deleted_files": len(deleted),
+                "added_chunks": added_chunks,
+                "removed_chunks": removed
+            }
+        )
+        
+        return {
+            "mode": "incremental",
+            "files": len(source_files),
+            "added": added_chunks,
+            "removed": removed,
+            "chunks": self.faiss_index.get_stats()["total_vectors"]
+        }
+        
+    def _index_files(self, source_files: Dict[str, Path], rel_paths: Set[str]) -> int:
+        """
+        Chunk, embed and add the given files, recording their hashes
+        
+        Chunks stream through the embedder in fixed-size batches and each
+        batch is upserted as soon as it is embedded, so memory use is
+        bounded by the batch size rather than the size of the project.
+        """
+        if not rel_paths:
+            return 0
+            
+        ordered = sorted(rel_paths)
+        
+        for rel_path in ordered:
+            self.state.files[rel_path] = {
+                "hash": self._hash_file(source_files[rel_path]),
+                "chunkIds": []
+            }
+            
+        chunks = self.chunker.iter_chunks([source_files[p] for p in ordered])
+        added = 0
+        
+        for batch, embeddings in self.embedder.embed_stream(chunks):
+            for chunk in batch:
+                entry = self.state.files.get(Path(chunk.path).as_posix())
+                if entry is not None and chunk.chunk_id not in entry["chunkIds"]:
+                    entry["chunkIds"].append(chunk.chunk_id)
+                    
+            if not self.faiss_index.upsert(
+                [chunk.chunk_id for chunk in batch],
+                embeddings,
+                [chunk.to_dict() for chunk in batch]
+            ):
+                raise RuntimeError("Failed to add vectors to index")
+                
+            added += len(batch)
+            
+        return added
+        
+    def _finish(self, index_changed: bool):
+        """Persist index and state after an update"""
+        self.state.commit = self.repo_manager.get_latest_commit()
+        self.state.dirty_files = sorted(self.repo_manager.get_dirty_files())
+        
+        # A state ahead of the saved index would skip these changes next time
+        if index_changed and not self.faiss_index.save():
+            raise RuntimeError("Failed to save index")
+        self.state.save()
+        
+    @staticmethod
+    def _chunking_config() -> Dict[str, Any]:
+        """Get the settings that decide how files are cut into chunks"""
+        return {
+            "sizing": settings.CHUNK_SIZING_ENABLED,
+            "maxTokens": settings.CHUNK_MAX_TOKENS,
+            "minTokens": settings.CHUNK_MIN_TOKENS,
+            "overlapLines": settings.CHUNK_OVERLAP_LINES
+        }
+        
+    def _rel_path(self, path: Path) -> str:
+        """Get repository-relative POSIX path"""
+        return path.relative_to(self.project_root).as_posix()
+        
+    @staticmethod
+    def _hash_file(path: Path) -> str:
+        """Get SHA256 of file contents"""
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(65536), b""):
+                sha256.update(block)
+        return sha256.hexdigest()
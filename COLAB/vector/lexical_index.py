@@ -0,0 +1,403 @@
+import math
+import hashlib
+import re
+import numpy as np
+from pathlib import Path
+from collections import defaultdict
+from typing import List, Dict, Set, Tuple, Iterable, Optional
+from utils.logger import logger
+
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# Words inside an identifier: "HTTPClient" -> HTTP, Client; "view2d" -> view, 2, d
+WORD_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+def split_identifier(name: str) -> List[str]:
+    """Split a camelCase or snake_case identifier into lowercase words"""
+    words = []
+    for part in name.split("_"):
+        words.extend(word.lower() for word in WORD_PATTERN.findall(part))
+    return words
+
+def tokenize(text: str) -> List[str]:
+    """
+    Get index terms for code or a query
+    
+    Each identifier yields itself (lowercased) plus its camelCase and
+    snake_case words, so "MainActivity" matches both an exact query for
+    the class and a query mentioning "main activity". Dotted references
+    such as R.id.login_button yield one term per segment.
+    """
+    terms = []
+    for identifier in IDENTIFIER_PATTERN.findall(text):
+        whole = identifier.lower()
+        if len(whole) > 1:
+            terms.append(whole)
+            
+        words = split_identifier(identifier)
+        if len(words) > 1:
+            terms.extend(word for word in words if len(word) > 1)
+            
+    return terms
+
+class LexicalIndex:
+    """
+    BM25 inverted index over chunk text and identifiers
+    
+    Keyed by the same integer IDs as FAISSIndex and updated alongside it,
+    so an incremental re-index only touches the chunks that changed.
+    
+    Saved postings are NumPy arrays that are memory-mapped on load, like
+    MetadataStore: terms are keyed by a 64-bit hash and sorted, each with
+    a slice of one (doc, tf) postings array. Documents indexed since the
+    last load sit in small in-memory dicts and replaced or removed saved
+    documents are masked out, until save() compacts everything again.
+    """
+    
+    # BM25 parameters
+    K1 = 1.2
+    B = 0.75
+    
+    TERM_DTYPE = np.dtype([
+        ('key', 'uint64'),
+        ('start', 'int64'),
+        ('count', 'int32')
+    ])
+    
+    POSTING_DTYPE = np.dtype([
+        ('doc', 'int64'),
+        ('tf', 'int32')
+    ])
+    
+    DOC_DTYPE = np.dtype([
+        ('id', 'int64'),
+        ('length', 'int32')
+    ])
+    
+    def __init__(self, base_path: Path):
+        """
+        Args:
+            base_path: Path prefix, e.g. FAISS_DIR / project_id
+        """
+        self.terms_path = Path(f"{base_path}_lexical_terms.npy")
+        self.postings_path = Path(f"{base_path}_lexical_postings.npy")
+        self.docs_path = Path(f"{base_path}_lexical_docs.npy")
+        self.legacy_path = Path(f"{base_path}_lexical.pkl")
+        
+        # Saved index (memory-mapped)
+        self._terms = np.zeros(0, dtype=self.TERM_DTYPE)
+        self._saved = np.zeros(0, dtype=self.POSTING_DTYPE)
+        self._docs = np.zeros(0, dtype=self.DOC_DTYPE)
+        self._removed: Set[int] = set()
+        self._removed_ids: Optional[np.ndarray] = None
+        
+        # Documents indexed since the last load
+        self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._doc_terms: Dict[int, Tuple[str, ...]] = {}
+        self._doc_lengths: Dict[int, int] = {}
+        self._entries = 0
+        
+        self._total_length = 0
+        
+    def exists(self) -> bool:
+        """Check if a saved index exists on disk"""
+        return self.terms_path.exists() and self.postings_path.exists() and self.docs_path.exists()
+        
+    def __len__(self) -> int:
+        return len(self._docs) - len(self._removed) + len(self._doc_lengths)
+        
+    def __contains__(self, doc_id: object) -> bool:
+        if doc_id in self._doc_lengths:
+            return True
+        if doc_id in self._removed:
+            return False
+        return self._find_doc(doc_id) is not None
+        
+    @staticmethod
+    def term_key(term: str) -> int:
+        """Get the 64-bit key of a term in the saved term array"""
+        return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+        
+    def upsert(self, doc_ids: Iterable[int], texts: Iterable[str]):
+        """Index or re-index documents"""
+        for doc_id, text in zip(doc_ids, texts):
+            if doc_id in self:
+                self._remove_doc(doc_id)
+                
+            terms = tokenize(text)
+            counts: Dict[str, int] = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+                
+            for term, tf in counts.items():
+                self._postings[term][doc_id] = tf
+                
+            self._doc_terms[doc_id] = tuple(counts)
+            self._doc_lengths[doc_id] = len(terms)
+            self._total_length += len(terms)
+            self._entries += len(counts)
+            
+    def remove(self, doc_ids: Iterable[int]) -> int:
+        """Remove documents (unknown IDs are ignored)"""
+        removed = 0
+        for doc_id in doc_ids:
+            if doc_id in self:
+                self._remove_doc(doc_id)
+                removed += 1
+        return removed
+        
+    def _remove_doc(self, doc_id: int):
+        """Drop an in-memory document from its posting lists, or mask a saved one"""
+        if doc_id not in self._doc_lengths:
+            self._removed.add(doc_id)
+            self._removed_ids = None
+            self._total_length -= int(self._docs['length'][self._find_doc(doc_id)])
+            return
+            
+        terms = self._doc_terms.pop(doc_id)
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                
+        self._total_length -= self._doc_lengths.pop(doc_id)
+        self._entries -= len(terms)
+        
+    def _find_doc(self, doc_id: object) -> Optional[int]:
+        """Binary search the sorted saved document IDs"""
+        if len(self._docs) == 0 or not isinstance(doc_id, (int, np.integer)):
+            return None
+            
+        ids = self._docs['id']
+        row = int(np.searchsorted(ids, doc_id))
+        if row < len(ids) and ids[row] == doc_id:
+            return row
+        return None
+        
+    def _removed_array(self) -> np.ndarray:
+        """Get the masked saved document IDs as a sorted array"""
+        if self._removed_ids is None:
+            self._removed_ids = np.array(sorted(self._removed), dtype='int64')
+        return self._removed_ids
+        
+    def _saved_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Get (doc IDs, term frequencies) of a term in the saved postings"""
+        empty = (np.zeros(0, dtype='int64'), np.zeros(0, dtype='int32'))
+        if len(self._terms) == 0:
+            return empty
+            
+        key = np.uint64(self.term_key(term))
+        keys = self._terms['key']
+        row = int(np.searchsorted(keys, key))
+        if row >= len(keys) or keys[row] != key:
+            return empty
+            
+        start = int(self._terms['start'][row])
+        postings = self._saved[start:start + int(self._terms['count'][row])]
+        docs, tfs = postings['doc'], postings['tf']
+        
+        if self._removed:
+            keep = ~np.isin(docs, self._removed_array())
+            docs, tfs = docs[keep], tfs[keep]
+            
+        return docs, tfs
+        
+    def search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """
+        Rank documents by BM25 score
+        
+        Args:
+            query: Free text; identifiers are split like indexed code
+            top_k: Number of results to return
+            
+        Returns:
+            List of (id, score) tuples, best first
+        """
+        num_docs = len(self)
+        if num_docs == 0 or top_k <= 0:
+            return []
+            
+        avg_length = self._total_length / num_docs or 1.0
+        doc_parts: List[np.ndarray] = []
+        score_parts: List[np.ndarray] = []
+        
+        for term in set(tokenize(query)):
+            docs, tfs = self._saved_postings(term)
+            lengths = self._docs['length'][np.searchsorted(self._docs['id'], docs)]
+            
+            recent = self._postings.get(term)
+            if recent:
+                docs = np.concatenate([docs, np.fromiter(recent.keys(), dtype='int64', count=len(recent))])
+                tfs = np.concatenate([tfs, np.fromiter(recent.values(), dtype='int32', count=len(recent))])
+                lengths = np.concatenate([
+                    lengths,
+                    np.fromiter((self._doc_lengths[doc_id] for doc_id in recent), dtype='int32', count=len(recent))
+                ])
+                
+            df = len(docs)
+            if df == 0:
+                continue
+                
+            idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+            
+            tfs = tfs.astype('float64')
+            norm = self.K1 * (1 - self.B + self.B * lengths / avg_length)
+            doc_parts.append(docs)
+            score_parts.append(idf * tfs * (self.K1 + 1) / (tfs + norm))
+                
+        if not doc_parts:
+            return []
+            
+        doc_ids, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+        
+        top_k = min(top_k, len(doc_ids))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        
+        return [(int(doc_ids[i]), float(scores[i])) for i in top]
+        
+    def save(self) -> bool:
+        """Compact saved and in-memory postings to disk"""
+        try:
+            self.terms_path.parent.mkdir(parents=True, exist_ok=True)
+            
+            # Saved postings still live, tagged with their term key
+            keys = np.repeat(np.asarray(self._terms['key']), np.asarray(self._terms['count']))
+            docs = np.asarray(self._saved['doc'])
+            tfs = np.asarray(self._saved['tf'])
+            saved_docs = np.asarray(self._docs)
+            
+            if self._removed:
+                removed = self._removed_array()
+                keep = ~np.isin(docs, removed)
+                keys, docs, tfs = keys[keep], docs[keep], tfs[keep]
+                saved_docs = saved_docs[~np.isin(saved_docs['id'], removed)]
+                
+            # Postings indexed since the last load
+            if self._entries:
+                recent = np.array([
+                    (self.term_key(term), doc_id, tf)
+                    for term, postings in self._postings.items()
+                    for doc_id, tf in postings.items()
+                ], dtype=[('key', 'uint64'), ('doc', 'int64'), ('tf', 'int32')])
+                keys = np.concatenate([keys, recent['key']])
+                docs = np.concatenate([docs, recent['doc']])
+                tfs = np.concatenate([tfs, recent['tf']])
+                
+            # Group postings by term, documents ascending within a term
+            order = np.lexsort((docs, keys))
+            postings = np.zeros(len(order), dtype=self.POSTING_DTYPE)
+            postings['doc'] = docs[order]
+            postings['tf'] = tfs[order]
+            
+            unique_keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+            terms = np.zeros(len(unique_keys), dtype=self.TERM_DTYPE)
+            terms['key'] = unique_keys
+            terms['start'] = starts
+            terms['count'] = counts
+            
+            doc_rows = np.array(list(self._doc_lengths.items()), dtype=self.DOC_DTYPE)
+            doc_rows = np.concatenate([saved_docs, doc_rows]) if len(saved_docs) else doc_rows
+            doc_rows.sort(order='id')
+            
+            written = []
+            for path, array in (
+                (self.terms_path, terms),
+                (self.postings_path, postings),
+                (self.docs_path, doc_rows)
+            ):
+                tmp_path = path.with_suffix(".tmp.npy")
+                np.save(tmp_path, array)
+                written.append((tmp_path, path))
+                
+            for tmp_path, path in written:
+                tmp_path.replace(path)
+                
+            # Drop the index in the old pickle format
+            self.legacy_path.unlink(missing_ok=True)
+            
+            # Re-map the compacted files
+            return self.load()
+            
+        except Exception as e:
+            logger.error(f"Failed to save lexical index: {str(e)}")
+            return False
+            
+    def load(self) -> bool:
+        """Memory-map a saved index"""
+        try:
+            terms = np.load(self.terms_path, mmap_mode='r')
+            postings = np.load(self.postings_path, mmap_mode='r')
+            docs = np.load(self.docs_path, mmap_mode='r')
+                
+            self.clear()
+            self._terms = terms
+            self._saved = postings
+            self._docs = docs
+            self._total_length = int(docs['length'].sum())
+            
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to load lexical index: {str(e)}")
+            self.clear()
+            return False
+            
+    def clear(self):
+        """Remove all documents (saved files are left until the next save)"""
+        self._terms = np.zeros(0, dtype=self.TERM_DTYPE)
+        self._saved = np.zeros(0, dtype=self.POSTING_DTYPE)
+        self._docs = np.zeros(0, dtype=self.DOC_DTYPE)
+        self._removed = set()
+        self._removed_ids = None
+        self._postings = defaultdict(dict)
+        self._doc_terms = {}
+        self._doc_lengths = {}
+        self._entries = 0
+        self._total_length = 0
+        
+    def get_memory_bytes(self) -> int:
+        """
+        Rough resident size
+        
+        In-memory postings and per-document bookkeeping, plus the saved
+        document lengths that every search reads. Saved postings stay in
+        the page cache, like a memory-mapped FAISS index.
+        """
+        return (
+            self._entries * 120
+            + len(self._doc_lengths) * 200
+            + len(self._removed) * 80
+            + self._docs.nbytes
+        )
+
+def reciprocal_rank_fusion(
+    rankings: List[List[int]],
+    k: int = 60,
+    weights: Optional[List[float]] = None
+) -> List[Tuple[int, float]]:
+    """
+    Fuse ranked ID lists with reciprocal rank fusion
+    
+    Each list contributes weight / (k + rank) for every ID it contains,
+    so IDs ranked well by several retrievers rise to the top without the
+    retrievers' raw scores having to be comparable.
+    
+    Args:
+        rankings: ID lists, best first
+        k: Rank offset; larger values flatten the contribution of top ranks
+        weights: Optional weight per ranking (default 1.0)
+        
+    Returns:
+        List of (id, fused score) tuples, best first
+    """
+    scores: Dict[int, float] = defaultdict(float)
+    
+    for i, ranking in enumerate(rankings):
+        weight = weights[i] if weights else 1.0
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] += weight / (k + rank)
+            
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,435 @@
+import os
+import json
+import shutil
+import numpy as np
+from pathlib import Path
+from collections.abc import MutableMapping
+from typing import List, Dict, Any, Optional, Iterator, Callable
+from datetime import datetime, timezone
+from config.settings import settings
+from utils.logger import logger
+
+class MetadataStore(MutableMapping):
+    """
+    Compact chunk metadata store keyed by FAISS ID
+    
+    Fixed-width fields live in a NumPy structured array sorted by ID,
+    strings such as paths are interned into small lookup tables, and
+    chunk text lives in a single blob addressed by offsets. Both the
+    array and the blob are memory-mapped on load, so only rows that are
+    actually looked up get decoded into dicts.
+    
+    Rows added or replaced since the last save are encoded straight
+    away, with their text appended to a spill file next to the blob, so
+    indexing a large project never holds chunk text in memory. save()
+    appends the spilled text to the blob and rewrites the blob without
+    dead text only once METADATA_COMPACT_RATIO of it is dead.
+    """
+    
+    ROW_DTYPE = np.dtype([
+        ('id', 'int64'),
+        ('chunk_id', 'uint64'),
+        ('path_id', 'int32'),
+        ('node_type_id', 'int16'),
+        ('language_id', 'int16'),
+        ('start_line', 'int32'),
+        ('end_line', 'int32'),
+        ('timestamp_ms', 'int64'),
+        ('text_offset', 'int64'),
+        ('text_length', 'int32'),
+        ('extra_offset', 'int64'),
+        ('extra_length', 'int32')
+    ])
+    
+    # Fields stored in their own columns rather than in the extra blob
+    COLUMN_META_KEYS = ("language", "nodeType")
+    
+    def __init__(self, base_path: Path):
+        """
+        Args:
+            base_path: Path prefix, e.g. FAISS_DIR / project_id
+        """
+        self.rows_path = Path(f"{base_path}_meta.npy")
+        self.tables_path = Path(f"{base_path}_meta.json")
+        self.blob_path = Path(f"{base_path}_text.bin")
+        self.spill_path = Path(f"{base_path}_text.pending")
+        
+        self.project_id: Optional[str] = None
+        self._rows = np.zeros(0, dtype=self.ROW_DTYPE)
+        self._blob: Optional[np.ndarray] = None
+        self._paths: List[str] = []
+        self._node_types: List[str] = []
+        self._languages: List[str] = []
+        self._table_ids: Dict[int, Dict[str, int]] = {}
+        self._deleted: set = set()
+        self._pending: Dict[int, tuple] = {}
+        self._spill = None
+        self._spill_size = 0
+        
+    def exists(self) -> bool:
+        """Check if a saved store exists on disk"""
+        return self.rows_path.exists() and self.tables_path.exists()
+        
+    def __getitem__(self, key: int) -> Dict[str, Any]:
+        if key in self._pending:
+            row = np.array(self._pending[key], dtype=self.ROW_DTYPE)
+            return self._materialize(row, self._read_spill)
+            
+        if key in self._deleted:
+            raise KeyError(key)
+            
+        row = self._find_row(key)
+        if row is None:
+            raise KeyError(key)
+            
+        return self._materialize(self._rows[row], self._read_blob)
+        
+    def __setitem__(self, key: int, value: Dict[str, Any]):
+        if self._find_row(key) is not None:
+            self._deleted.add(key)
+        self._pending[key] = self._encode(key, value)
+        
+    def __delitem__(self, key: int):
+        found = False
+        
+        if key in self._pending:
+            del self._pending[key]
+            found = True
+            
+        if key not in self._deleted and self._find_row(key) is not None:
+            self._deleted.add(key)
+            found = True
+            
+        if not found:
+            raise KeyError(key)
+            
+    def __contains__(self, key: object) -> bool:
+        if key in self._pending:
+            return True
+        if key in self._deleted:
+            return False
+        return self._find_row(key) is not None
+        
+    def __iter__(self) -> Iterator[int]:
+        for key in self._rows['id'].tolist():
+            if key not in self._deleted:
+                yield key
+        yield from list(self._pending)
+        
+    def __len__(self) -> int:
+        return len(self._rows) - len(self._deleted) + len(self._pending)
+        
+    def clear(self):
+        """Forget all rows in memory (saved files are left until the next save)"""
+        self.project_id = None
+        self._rows = np.zeros(0, dtype=self.ROW_DTYPE)
+        self._blob = None
+        self._paths = []
+        self._node_types = []
+        self._languages = []
+        self._table_ids = {}
+        self._deleted = set()
+        self._discard_spill()
+        
+    def load(self) -> bool:
+        """Memory-map a saved store"""
+        try:
+            with open(self.tables_path, 'r') as f:
+                tables = json.load(f)
+                
+            self.project_id = tables.get("projectId")
+            self._paths = tables["paths"]
+            self._node_types = tables["nodeTypes"]
+            self._languages = tables["languages"]
+            self._table_ids = {}
+            
+            self._rows = np.load(self.rows_path, mmap_mode='r')
+            self._blob = None
+            if self.blob_path.exists() and self.blob_path.stat().st_size > 0:
+                self._blob = np.memmap(self.blob_path, dtype=np.uint8, mode='r')
+                
+            self._deleted = set()
+            self._discard_spill()
+            
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to load metadata store: {str(e)}")
+            return False
+            
+    def save(self) -> bool:
+        """Write pending changes to disk, compacting when much of the blob is dead"""
+        try:
+            self.rows_path.parent.mkdir(parents=True, exist_ok=True)
+            
+            if self._dead_ratio() > settings.METADATA_COMPACT_RATIO:
+                self._compact()
+            else:
+                self._append()
+                
+            # Re-map the written files
+            return self.load()
+            
+        except Exception as e:
+            logger.error(f"Failed to save metadata store: {str(e)}")
+            return False
+            
+    def _dead_ratio(self) -> float:
+        """Get the share of the blob, after appending pending text, no row points to"""
+        if not self.exists():
+            return 1.0
+            
+        total = self._blob_size() + self._spill_size
+        if total == 0:
+            return 0.0
+            
+        live = self._live_rows()
+        pending = np.array(list(self._pending.values()), dtype=self.ROW_DTYPE)
+        live_bytes = sum(
+            int(rows['text_length'].sum()) + int(rows['extra_length'].sum())
+            for rows in (live, pending)
+        )
+        return (total - live_bytes) / total
+        
+    def _live_rows(self) -> np.ndarray:
+        """Get saved rows that were neither deleted nor replaced"""
+        if not self._deleted:
+            return self._rows
+        deleted = np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted))
+        return self._rows[~np.isin(self._rows['id'], deleted)]
+        
+    def _blob_size(self) -> int:
+        return self.blob_path.stat().st_size if self.blob_path.exists() else 0
+        
+    def _append(self):
+        """Append spilled text to the blob and rewrite only the row array"""
+        blob_size = self._blob_size()
+        
+        # Bytes already in the blob never move, so mapped readers stay valid
+        if self._spill is not None and self._spill_size:
+            self._spill.seek(0)
+            with open(self.blob_path, 'ab') as blob:
+                shutil.copyfileobj(self._spill, blob)
+                
+        pending = np.array(list(self._pending.values()), dtype=self.ROW_DTYPE)
+        pending['text_offset'] += blob_size
+        pending['extra_offset'] += blob_size
+        
+        rows = np.concatenate([self._live_rows(), pending])
+        rows.sort(order='id')
+        
+        # Tables only grow, so write them before the rows that use new entries
+        tmp_tables = self.tables_path.with_suffix(".tmp")
+        with open(tmp_tables, 'w') as f:
+            json.dump({
+                "projectId": self.project_id,
+                "paths": self._paths,
+                "nodeTypes": self._node_types,
+                "languages": self._languages
+            }, f)
+        tmp_tables.replace(self.tables_path)
+        
+        tmp_rows = self.rows_path.with_suffix(".tmp.npy")
+        np.save(tmp_rows, rows)
+        tmp_rows.replace(self.rows_path)
+        
+    def _compact(self):
+        """Rewrite live rows and pending changes into fresh files"""
+        paths: Dict[str, int] = {}
+        node_types: Dict[str, int] = {}
+        languages: Dict[str, int] = {}
+        
+        def intern(table: Dict[str, int], value: str) -> int:
+            if value not in table:
+                table[value] = len(table)
+            return table[value]
+            
+        live = [
+            i for i, key in enumerate(self._rows['id'].tolist())
+            if key not in self._deleted
+        ]
+        rows = np.zeros(len(live) + len(self._pending), dtype=self.ROW_DTYPE)
+        offset = 0
+        
+        tmp_blob = self.blob_path.with_suffix(".tmp")
+        with open(tmp_blob, 'wb') as blob:
+        
+            def write(data: bytes) -> int:
+                nonlocal offset
+                start = offset
+                blob.write(data)
+                offset += len(data)
+                return start
+                
+            # Existing rows: copy text bytes straight across
+            for i, old_row in enumerate(live):
+                old = self._rows[old_row]
+                row = rows[i]
+                row['id'] = old['id']
+                row['chunk_id'] = old['chunk_id']
+                row['path_id'] = intern(paths, self._paths[old['path_id']])
+                row['node_type_id'] = intern(node_types, self._node_types[old['node_type_id']])
+                row['language_id'] = intern(languages, self._languages[old['language_id']])
+                row['start_line'] = old['start_line']
+                row['end_line'] = old['end_line']
+                row['timestamp_ms'] = old['timestamp_ms']
+                row['text_offset'] = write(self._read_blob(old['text_offset'], old['text_length']))
+                row['text_length'] = old['text_length']
+                row['extra_offset'] = write(self._read_blob(old['extra_offset'], old['extra_length']))
+                row['extra_length'] = old['extra_length']
+                
+            # Pending rows: already encoded, copy text from the spill file
+            for i, key in enumerate(self._pending, len(live)):
+                pending = np.array(self._pending[key], dtype=self.ROW_DTYPE)
+                row = rows[i]
+                row['id'] = key
+                row['chunk_id'] = pending['chunk_id']
+                row['path_id'] = intern(paths, self._paths[pending['path_id']])
+                row['node_type_id'] = intern(node_types, self._node_types[pending['node_type_id']])
+                row['language_id'] = intern(languages, self._languages[pending['language_id']])
+                row['start_line'] = pending['start_line']
+                row['end_line'] = pending['end_line']
+                row['timestamp_ms'] = pending['timestamp_ms']
+                row['text_offset'] = write(self._read_spill(pending['text_offset'], pending['text_length']))
+                row['text_length'] = pending['text_length']
+                row['extra_offset'] = write(self._read_spill(pending['extra_offset'], pending['extra_length']))
+                row['extra_length'] = pending['extra_length']
+                
+        rows.sort(order='id')
+        
+        tmp_rows = self.rows_path.with_suffix(".tmp.npy")
+        np.save(tmp_rows, rows)
+        
+        tmp_tables = self.tables_path.with_suffix(".tmp")
+        with open(tmp_tables, 'w') as f:
+            json.dump({
+                "projectId": self.project_id,
+                "paths": list(paths),
+                "nodeTypes": list(node_types),
+                "languages": list(languages)
+            }, f)
+            
+        tmp_blob.replace(self.blob_path)
+        tmp_rows.replace(self.rows_path)
+        tmp_tables.replace(self.tables_path)
+        
+    def _find_row(self, key: Any) -> Optional[int]:
+        """Binary search the sorted ID column"""
+        if len(self._rows) == 0 or not isinstance(key, (int, np.integer)):
+            return None
+            
+        ids = self._rows['id']
+        row = int(np.searchsorted(ids, key))
+        if row < len(ids) and ids[row] == key:
+            return row
+        return None
+        
+    def _encode(self, key: int, meta: Dict[str, Any]) -> tuple:
+        """Encode a chunk metadata dict into a row, spilling its text"""
+        self.project_id = self.project_id or meta.get("projectId")
+        chunk_meta = meta.get("metadata", {})
+        text = meta.get("tokens", "").encode('utf-8')
+        extra = {
+            k: v for k, v in chunk_meta.items()
+            if k not in self.COLUMN_META_KEYS
+        }
+        extra_bytes = json.dumps(extra).encode('utf-8') if extra else b""
+        
+        return (
+            key,
+            int(meta["chunkId"], 16),
+            self._intern(self._paths, meta.get("path", "")),
+            self._intern(self._node_types, meta.get("nodeType", "")),
+            self._intern(self._languages, chunk_meta.get("language", "")),
+            meta.get("startLine", 0),
+            meta.get("endLine", 0),
+            self._parse_timestamp(meta.get("timestamp")),
+            self._write_spill(text),
+            len(text),
+            self._write_spill(extra_bytes),
+            len(extra_bytes)
+        )
+        
+    def _intern(self, table: List[str], value: str) -> int:
+        """Get the index of a string in a lookup table, adding it if new"""
+        index = self._table_ids.get(id(table))
+        if index is None:
+            index = {v: i for i, v in enumerate(table)}
+            self._table_ids[id(table)] = index
+            
+        if value not in index:
+            index[value] = len(table)
+            table.append(value)
+        return index[value]
+        
+    def _write_spill(self, data: bytes) -> int:
+        """Append bytes to the spill file and return their offset"""
+        if self._spill is None:
+            self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+            self._spill = open(self.spill_path, 'w+b', buffering=0)
+            self._spill_size = 0
+            
+        offset = self._spill_size
+        if data:
+            self._spill.write(data)
+            self._spill_size += len(data)
+        return offset
+        
+    def _read_spill(self, offset: int, length: int) -> bytes:
+        """Read raw bytes from the spill file"""
+        if length == 0 or self._spill is None:
+            return b""
+        return os.pread(self._spill.fileno(), int(length), int(offset))
+        
+    def _discard_spill(self):
+        """Drop pending rows and delete the spill file"""
+        self._pending = {}
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+        self.spill_path.unlink(missing_ok=True)
+        self._spill_size = 0
+        
+    def _read_blob(self, offset: int, length: int) -> bytes:
+        """Read raw bytes from the text blob"""
+        if length == 0 or self._blob is None:
+            return b""
+        return self._blob[offset:offset + length].tobytes()
+        
+    def _materialize(self, row: np.void, read: Callable[[int, int], bytes]) -> Dict[str, Any]:
+        """Decode a stored row into a chunk metadata dict"""
+        node_type = self._node_types[row['node_type_id']]
+        
+        metadata = {
+            "language": self._languages[row['language_id']],
+            "nodeType": node_type
+        }
+        
+        extra = read(row['extra_offset'], row['extra_length'])
+        if extra:
+            metadata.update(json.loads(extra))
+            
+        timestamp = datetime.fromtimestamp(row['timestamp_ms'] / 1000, tz=timezone.utc)
+        
+        return {
+            "chunkId": f"{int(row['chunk_id']):016x}",
+            "projectId": self.project_id,
+            "path": self._paths[row['path_id']],
+            "nodeType": node_type,
+            "startLine": int(row['start_line']),
+            "endLine": int(row['end_line']),
+            "tokens": read(row['text_offset'], row['text_length']).decode('utf-8'),
+            "metadata": metadata,
+            "timestamp": timestamp.replace(tzinfo=None).isoformat(timespec='milliseconds') + "Z"
+        }
+        
+    @staticmethod
+    def _parse_timestamp(value: Optional[str]) -> int:
+        """Convert an ISO timestamp ending in Z to epoch milliseconds"""
+        if not value:
+            return 0
+        try:
+            parsed = datetime.fromisoformat(value.rstrip("Z")).replace(tzinfo=timezone.utc)
+            return int(parsed.timestamp() * 1000)
+        except ValueError:
+            return 0
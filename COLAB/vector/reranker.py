@@ -0,0 +1,130 @@
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+from config.settings import settings
+
+class Reranker:
+    """
+    Diversify retrieved chunks before they are packed into a prompt
+    
+    Candidates are picked greedily by maximal marginal relevance (MMR):
+    relevance minus similarity to what is already picked, using the
+    chunks' stored vectors. While picking, a chunk is skipped if its line
+    range mostly overlaps an already picked chunk of the same file (a
+    class and its own method) or if its file already has the maximum
+    number of chunks.
+    """
+    
+    def __init__(
+        self,
+        mmr_lambda: float = None,
+        max_per_path: int = None,
+        overlap_ratio: float = None
+    ):
+        """
+        Args:
+            mmr_lambda: Weight of relevance vs. diversity (1.0 = relevance only)
+            max_per_path: Maximum chunks per file (0 = unlimited)
+            overlap_ratio: Share of the shorter line range that must overlap
+                for two chunks of one file to count as duplicates
+        """
+        self.mmr_lambda = mmr_lambda if mmr_lambda is not None else settings.MMR_LAMBDA
+        self.max_per_path = max_per_path if max_per_path is not None else settings.RERANK_MAX_PER_PATH
+        self.overlap_ratio = overlap_ratio if overlap_ratio is not None else settings.RERANK_OVERLAP_RATIO
+        
+    def rerank(
+        self,
+        candidates: List[Tuple[Dict[str, Any], float]],
+        vectors: Optional[np.ndarray],
+        top_k: int
+    ) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Select a diverse top_k from ranked candidates
+        
+        Args:
+            candidates: (metadata, score) tuples, best first (higher is better)
+            vectors: Candidate embeddings in the same order, or None to
+                skip the MMR term and only collapse and cap
+            top_k: Number of results to return
+            
+        Returns:
+            Selected (metadata, score) tuples in selection order
+        """
+        if not candidates:
+            return []
+            
+        scores = np.array([score for _, score in candidates], dtype='float32')
+        top = float(scores.max())
+        relevance = scores / top if top > 0 else np.ones_like(scores)
+        
+        similarity = None
+        if vectors is not None and len(vectors) == len(candidates):
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            unit = vectors / np.maximum(norms, 1e-12)
+            similarity = unit @ unit.T
+            
+        selected: List[int] = []
+        per_path: Dict[str, int] = {}
+        max_similarity = np.zeros(len(candidates), dtype='float32')
+        eligible = np.ones(len(candidates), dtype=bool)
+        
+        while len(selected) < top_k:
+            for i in np.flatnonzero(eligible):
+                if self._is_redundant(candidates[i][0], selected, candidates, per_path):
+                    eligible[i] = False
+                    
+            if not eligible.any():
+                break
+                
+            mmr = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * max_similarity
+            mmr[~eligible] = -np.inf
+            best = int(np.argmax(mmr))
+            
+            selected.append(best)
+            eligible[best] = False
+            path = candidates[best][0].get("path", "")
+            per_path[path] = per_path.get(path, 0) + 1
+            
+            if similarity is not None:
+                max_similarity = np.maximum(max_similarity, similarity[best])
+                
+        return [candidates[i] for i in selected]
+        
+    def _is_redundant(
+        self,
+        meta: Dict[str, Any],
+        selected: List[int],
+        candidates: List[Tuple[Dict[str, Any], float]],
+        per_path: Dict[str, int]
+    ) -> bool:
+        """Check the per-file cap and line-range overlap with picked chunks"""
+        path = meta.get("path", "")
+        if self.max_per_path and per_path.get(path, 0) >= self.max_per_path:
+            return True
+            
+        for i in selected:
+            other = candidates[i][0]
+            if other.get("path", "") == path and self._overlaps(meta, other):
+                return True
+                
+        return False
+        
+    def _overlaps(self, a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+        """Check if two chunks of one file cover mostly the same lines"""
+        # A class skeleton spans its members' lines but elides their bodies
+        if self._is_skeleton(a) != self._is_skeleton(b):
+            return False
+            
+        start = max(a.get("startLine", 0), b.get("startLine", 0))
+        end = min(a.get("endLine", 0), b.get("endLine", 0))
+        if end < start:
+            return False
+            
+        shorter = min(
+            a.get("endLine", 0) - a.get("startLine", 0),
+            b.get("endLine", 0) - b.get("startLine", 0)
+        ) + 1
+        return (end - start + 1) / shorter >= self.overlap_ratio
+        
+    @staticmethod
+    def _is_skeleton(meta: Dict[str, Any]) -> bool:
+        return bool((meta.get("metadata") or {}).get("skeleton"))